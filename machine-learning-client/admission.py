@@ -0,0 +1,159 @@
+"""
+Admission control and request deadlines.
+
+At most max_concurrent requests run the pipeline at once; up to
+max_queue more wait for a slot, and anything beyond that is turned away
+at once with 503 + Retry-After instead of piling up behind the model.
+
+Callers send how long they are still willing to wait in the
+X-Deadline-Ms header (milliseconds remaining, so the two hosts' clocks
+never need to agree). A request whose deadline passes while it waits,
+or between pipeline stages, is dropped: nobody is left to read the
+answer.
+"""
+
+import os
+import threading
+import time
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+# admitted requests per worker when micro-batching is on and
+# ML_MAX_CONCURRENT is not set: enough for the batcher to merge
+MICROBATCH_CONCURRENCY = 4
+
+
+def max_concurrent_from_env(environ=None):
+    """
+    ML_MAX_CONCURRENT, by default 1, or MICROBATCH_CONCURRENCY when
+    ML_MICROBATCH_WINDOW_MS turns micro-batching on: with one admitted
+    request per worker the batcher never has two to merge and its window
+    only adds latency. Setting both to that effect is warned about.
+    """
+    environ = os.environ if environ is None else environ
+    microbatching = float(environ.get("ML_MICROBATCH_WINDOW_MS", "0")) > 0
+    if "ML_MAX_CONCURRENT" not in environ:
+        return MICROBATCH_CONCURRENCY if microbatching else 1
+    limit = int(environ["ML_MAX_CONCURRENT"])
+    if microbatching and limit == 1:
+        print(
+            " * ML_MAX_CONCURRENT=1 admits one request at a time, so"
+            " ML_MICROBATCH_WINDOW_MS only delays it; raise ML_MAX_CONCURRENT"
+        )
+    return limit
+
+
+class Overloaded(Exception):
+    """
+    Raised when the queue is full or a queued request waited too long.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Server busy, retry later")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the caller's deadline has passed.
+    """
+
+    def __init__(self):
+        super().__init__("Deadline exceeded")
+
+
+def deadline_from_header(value, now=None):
+    """
+    time.monotonic() deadline for an X-Deadline-Ms value, or None when the
+    header is missing or not a number.
+    """
+    try:
+        remaining_ms = float(value)
+    except (TypeError, ValueError):
+        return None
+    now = time.monotonic() if now is None else now
+    return now + remaining_ms / 1000.0
+
+
+def check_deadline(deadline):
+    """
+    Raise DeadlineExceeded if the deadline (None = no deadline) has passed.
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded()
+
+
+class AdmissionController:  # pylint: disable=too-many-instance-attributes
+    """
+    A concurrency limit with a bounded, time-limited wait queue.
+    max_concurrent <= 0 admits everything.
+    """
+
+    def __init__(self, max_concurrent, max_queue=0, queue_timeout=5.0, retry_after=1):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.expired = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline=None):
+        """
+        Take a slot, waiting in the queue if needed.
+        Raises Overloaded or DeadlineExceeded instead of waiting forever.
+        """
+        if self.max_concurrent <= 0:
+            return
+        with self._condition:
+            if self.running < self.max_concurrent and self.waiting == 0:
+                self.running += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self.retry_after)
+            give_up = time.monotonic() + self.queue_timeout
+            if deadline is not None:
+                give_up = min(give_up, deadline)
+            self.waiting += 1
+            try:
+                while self.running >= self.max_concurrent:
+                    remaining = give_up - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                else:
+                    self.running += 1
+                    return
+            finally:
+                self.waiting -= 1
+            if deadline is not None and deadline <= give_up:
+                self.expired += 1
+                raise DeadlineExceeded()
+            self.rejected += 1
+            raise Overloaded(self.retry_after)
+
+    def release(self):
+        """
+        Give a slot back and wake the next queued request.
+        """
+        if self.max_concurrent <= 0:
+            return
+        with self._condition:
+            self.running -= 1
+            self._condition.notify()
+
+    def stats(self):
+        """
+        Current load and rejection counters.
+        """
+        with self._condition:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+                "expired": self.expired,
+            }
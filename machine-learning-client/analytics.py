@@ -0,0 +1,330 @@
+"""
+Columnar emotion data and streaming analytics over analysis_results.
+
+Next to the per-face emotion dicts, every result stores its scores as
+one float32 matrix (faces x 7, EMOTION_LABELS order) and its face boxes
+as one int32 matrix (faces x 4), both as little-endian BSON binary.
+Reading them back is a single np.frombuffer per document instead of a
+walk over nested dicts.
+
+Analytics and exports read results through a batched cursor with only
+the columns they need, turn each batch into NumPy arrays and fold it
+into running totals, so memory stays at one batch whatever the size of
+the collection. Results saved before the columns existed are read by a
+second cursor, the only one that fetches the emotion dicts, and merged
+in by _id. A result's time is the one in its ObjectId.
+"""
+
+import csv
+import heapq
+import io
+import json
+import datetime
+import numpy as np
+from bson import ObjectId
+from bson.binary import Binary
+
+from emotion_engine import EMOTION_LABELS
+
+EMOTION_VECTORS = "emotion_vectors"
+FACE_BOXES = "face_boxes"
+COLUMNAR_FIELDS = (EMOTION_VECTORS, FACE_BOXES)
+VECTOR_DTYPE = np.dtype("<f4")
+BOX_DTYPE = np.dtype("<i4")
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BINS = 10
+# a summary keeps one trend entry per bucket in memory
+MAX_TREND_BUCKETS = 10000
+BIN_EPSILON = 1e-4
+# one row per face: its result, the result's time, its index and box, its scores
+EXPORT_COLUMNS = (
+    "result_id",
+    "created_at",
+    "face",
+    "x",
+    "y",
+    "w",
+    "h",
+    *EMOTION_LABELS,
+)
+
+
+class TooManyBuckets(ValueError):
+    """
+    Raised when a summary's trend would need more than MAX_TREND_BUCKETS.
+    """
+
+    def __init__(self):
+        super().__init__(
+            f"More than {MAX_TREND_BUCKETS} trend buckets; "
+            "use a larger bucket or a shorter range"
+        )
+
+
+def emotion_matrix(emotions):
+    """
+    (faces, 7) float32 scores from a list of emotion dicts.
+    """
+    matrix = np.zeros((len(emotions), len(EMOTION_LABELS)), dtype=VECTOR_DTYPE)
+    for row, scores in enumerate(emotions):
+        matrix[row] = [scores.get(label, 0.0) for label in EMOTION_LABELS]
+    return matrix
+
+
+def pack_columns(emotions, faces):
+    """
+    The columnar fields for a result: scores and boxes as binary matrices.
+    """
+    boxes = np.asarray(faces, dtype=BOX_DTYPE).reshape(-1, 4)
+    return {
+        EMOTION_VECTORS: Binary(emotion_matrix(emotions).tobytes()),
+        FACE_BOXES: Binary(boxes.tobytes()),
+    }
+
+
+def public_results(results):
+    """
+    A results document without the binary columns, for JSON responses.
+    """
+    return {key: value for key, value in results.items() if key not in COLUMNAR_FIELDS}
+
+
+def unpack_columns(document):
+    """
+    (scores, boxes) matrices of a stored result. Results saved before the
+    columns existed are converted from their emotion dicts.
+    """
+    if EMOTION_VECTORS in document:
+        scores = np.frombuffer(document[EMOTION_VECTORS], dtype=VECTOR_DTYPE)
+        boxes = np.frombuffer(document.get(FACE_BOXES, b""), dtype=BOX_DTYPE)
+        scores = scores.reshape(-1, len(EMOTION_LABELS))
+    else:
+        scores = emotion_matrix(document.get("emotions") or [])
+        boxes = np.asarray(document.get("faces") or [], dtype=BOX_DTYPE)
+    boxes = boxes.reshape(-1, 4)
+    if len(boxes) != len(scores):
+        boxes = np.zeros((len(scores), 4), dtype=BOX_DTYPE)
+    return scores, boxes
+
+
+def time_query(since=None, until=None):
+    """
+    Filter on the time in _id: since <= time < until (datetimes or None).
+    """
+    bounds = {}
+    if since is not None:
+        bounds["$gte"] = ObjectId.from_datetime(since)
+    if until is not None:
+        bounds["$lt"] = ObjectId.from_datetime(until)
+    return {"_id": bounds} if bounds else {}
+
+
+class FaceBatch:  # pylint: disable=too-few-public-methods
+    """
+    One cursor batch as per-face arrays: owning result index, result
+    timestamp (Unix seconds), face index within its result, box, scores.
+    """
+
+    def __init__(self, documents):
+        self.result_ids = result_ids = [document["_id"] for document in documents]
+        self.results = len(documents)
+        columns = [unpack_columns(document) for document in documents]
+        counts = np.array([len(scores) for scores, _ in columns], dtype=np.int64)
+        times = np.array(
+            [object_id.generation_time.timestamp() for object_id in result_ids],
+            dtype=np.int64,
+        )
+        self.result_index = np.repeat(np.arange(len(documents)), counts)
+        self.times = times[self.result_index]
+        self.face_index = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        width = len(EMOTION_LABELS)
+        self.scores = np.concatenate(
+            [scores for scores, _ in columns] or [np.empty((0, width), VECTOR_DTYPE)]
+        )
+        self.boxes = np.concatenate(
+            [boxes for _, boxes in columns] or [np.empty((0, 4), BOX_DTYPE)]
+        )
+
+
+def face_batches(collection, query=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield FaceBatch objects for the matching results, batch_size results
+    at a time, oldest first. Only the columns are read from MongoDB; the
+    emotion dicts only for results that have no columns.
+    """
+    query = query or {}
+    cursors = [
+        collection.find(
+            {**query, EMOTION_VECTORS: {"$exists": columnar}},
+            dict.fromkeys(fields, 1),
+            batch_size=batch_size,
+        ).sort("_id", 1)
+        for columnar, fields in (
+            (True, COLUMNAR_FIELDS),
+            (False, ("emotions", "faces")),
+        )
+    ]
+    documents = []
+    for document in heapq.merge(*cursors, key=lambda document: document["_id"]):
+        documents.append(document)
+        if len(documents) == batch_size:
+            yield FaceBatch(documents)
+            documents = []
+    if documents:
+        yield FaceBatch(documents)
+
+
+class EmotionSummary:  # pylint: disable=too-many-instance-attributes
+    """
+    Running distributions, means and time-bucketed trends of emotion
+    scores, fed one FaceBatch at a time. Raises TooManyBuckets once the
+    trend needs more than max_buckets buckets.
+    """
+
+    def __init__(self, bucket_seconds=3600, bins=DEFAULT_BINS, max_buckets=None):
+        width = len(EMOTION_LABELS)
+        self.bucket_seconds = bucket_seconds
+        self.bins = bins
+        self.max_buckets = max_buckets or MAX_TREND_BUCKETS
+        self.results = 0
+        self.faces = 0
+        self.sums = np.zeros(width, dtype=np.float64)
+        self.squares = np.zeros(width, dtype=np.float64)
+        self.histogram = np.zeros((width, bins), dtype=np.int64)
+        self.dominant = np.zeros(width, dtype=np.int64)
+        # bucket start -> [faces, score sums]
+        self.buckets = {}
+
+    def add(self, batch):
+        """
+        Fold one batch into the totals.
+        """
+        self.results += batch.results
+        if len(batch.scores) == 0:
+            return
+        scores = batch.scores.astype(np.float64)
+        width = scores.shape[1]
+        self.faces += len(scores)
+        self.sums += scores.sum(axis=0)
+        self.squares += np.square(scores).sum(axis=0)
+        # float32 scores such as 0.9 sit just below their bin edge
+        bins = (scores * self.bins + BIN_EPSILON).astype(np.int64)
+        bins = np.clip(bins, 0, self.bins - 1)
+        cells = (np.arange(width) * self.bins + bins).ravel()
+        self.histogram += np.bincount(cells, minlength=width * self.bins).reshape(
+            width, self.bins
+        )
+        self.dominant += np.bincount(scores.argmax(axis=1), minlength=width)
+
+        starts = batch.times - batch.times % self.bucket_seconds
+        keys, inverse = np.unique(starts, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        sums = np.zeros((len(keys), width))
+        np.add.at(sums, inverse, scores)
+        for key, count, row in zip(keys.tolist(), counts, sums):
+            bucket = self.buckets.setdefault(key, [0, np.zeros(width)])
+            bucket[0] += int(count)
+            bucket[1] += row
+        if len(self.buckets) > self.max_buckets:
+            raise TooManyBuckets()
+
+    def to_dict(self):
+        """
+        JSON-friendly summary.
+        """
+        faces = max(self.faces, 1)
+        means = self.sums / faces
+        deviations = np.sqrt(np.maximum(self.squares / faces - np.square(means), 0))
+        return {
+            "results": self.results,
+            "faces": self.faces,
+            "mean": _labelled(means) if self.faces else {},
+            "std": _labelled(deviations) if self.faces else {},
+            "dominant": {
+                label: int(count) for label, count in zip(EMOTION_LABELS, self.dominant)
+            },
+            "distribution": {
+                "bin_edges": np.linspace(0, 1, self.bins + 1).round(4).tolist(),
+                "counts": {
+                    label: row.tolist()
+                    for label, row in zip(EMOTION_LABELS, self.histogram)
+                },
+            },
+            "trend": [
+                {
+                    "start": _isoformat(start),
+                    "faces": count,
+                    "mean": _labelled(sums / count),
+                }
+                for start, (count, sums) in sorted(self.buckets.items())
+            ],
+        }
+
+
+def _labelled(values):
+    return {
+        label: round(float(value), 4) for label, value in zip(EMOTION_LABELS, values)
+    }
+
+
+def _isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+def summarize(
+    collection, query=None, bucket_seconds=3600, batch_size=DEFAULT_BATCH_SIZE
+):
+    """
+    Emotion summary over the matching results, streamed batch by batch.
+    """
+    summary = EmotionSummary(bucket_seconds)
+    for batch in face_batches(collection, query, batch_size):
+        summary.add(batch)
+    return summary.to_dict()
+
+
+def export_rows(batch):
+    """
+    One row per face of a batch, in EXPORT_COLUMNS order.
+    """
+    result_ids = [str(object_id) for object_id in batch.result_ids]
+    created = [
+        _isoformat(object_id.generation_time.timestamp())
+        for object_id in batch.result_ids
+    ]
+    for result, face, box, scores in zip(
+        batch.result_index.tolist(),
+        batch.face_index.tolist(),
+        batch.boxes.tolist(),
+        batch.scores.round(4).tolist(),
+    ):
+        yield [result_ids[result], created[result], face, *box, *scores]
+
+
+def export_ndjson(collection, query=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield one JSON line per face, one batch of results at a time.
+    """
+    for batch in face_batches(collection, query, batch_size):
+        lines = (
+            json.dumps(dict(zip(EXPORT_COLUMNS, row))) for row in export_rows(batch)
+        )
+        yield "".join(line + "\n" for line in lines)
+
+
+def export_csv(collection, query=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield CSV text: the header, then one chunk per batch of results.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for batch in face_batches(collection, query, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(export_rows(batch))
+        yield buffer.getvalue()
@@ -3,26 +3,440 @@ Flask application to provide an API for processing images
 via the ml-client module.
 """
 
-from flask import Flask, request, jsonify
-from ml_client import process_image
+import base64
+import datetime
+import io
+import os
+import tempfile
+import time
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from ml_client import (
+    collection,
+    process_image,
+    process_image_bytes,
+    process_images_bytes,
+    emotion_engine,
+    readiness,
+    result_cache,
+    result_writer,
+    shutdown,
+    start_warm_up,
+)
+from admission import (
+    AdmissionController,
+    DEADLINE_HEADER,
+    DeadlineExceeded,
+    Overloaded,
+    check_deadline,
+    deadline_from_header,
+    max_concurrent_from_env,
+)
+from analytics import (
+    TooManyBuckets,
+    export_csv,
+    export_ndjson,
+    summarize,
+    time_query,
+)
+from emotion_engine import MicroBatcher
+from image_header import ImageTooLarge
+from metrics import REQUEST_SECONDS, registry
+from profiler import Profiler, ProfilerBusy, admin_authorized
+from video_analysis import (
+    VIDEO_MAX_BYTES,
+    VIDEO_SAMPLE_FPS,
+    VideoTooLarge,
+    analyze_video_file,
+)
 
 app = Flask(__name__)
 
+# Merge faces from concurrent /process calls into one model call.
+# 0 (the default) turns micro-batching off.
+MICROBATCH_WINDOW_MS = float(os.getenv("ML_MICROBATCH_WINDOW_MS", "0"))
+MICROBATCH_MAX_FACES = int(os.getenv("ML_MICROBATCH_MAX_FACES", "128"))
+
+if MICROBATCH_WINDOW_MS > 0:
+    emotion_engine.batcher = MicroBatcher(
+        emotion_engine.run_model,
+        window_ms=MICROBATCH_WINDOW_MS,
+        max_batch_size=MICROBATCH_MAX_FACES,
+    )
+
+
+# Each worker runs at most ML_MAX_CONCURRENT analyses at once (1, or 4
+# with micro-batching on) and queues up to ML_MAX_QUEUE more for at most
+# ML_QUEUE_TIMEOUT seconds; other requests get 503 + Retry-After.
+# ML_MAX_CONCURRENT=0 turns this off.
+admission = AdmissionController(
+    max_concurrent=max_concurrent_from_env(),
+    max_queue=int(os.getenv("ML_MAX_QUEUE", "8")),
+    queue_timeout=float(os.getenv("ML_QUEUE_TIMEOUT", "5")),
+    retry_after=int(os.getenv("ML_RETRY_AFTER", "1")),
+)
+ADMITTED_ENDPOINTS = ("process_image_api", "process_batch_api", "process_video_api")
+
+# /admin/* needs "Authorization: Bearer <ML_ADMIN_TOKEN>"; without a token
+# configured the admin endpoints do not exist.
+ADMIN_TOKEN = os.getenv("ML_ADMIN_TOKEN", "")
+profiler = Profiler()
+
+
+@app.before_request
+def start_timer():
+    """Remember when the request started."""
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def admit_request():
+    """
+    Read the caller's deadline and take an analysis slot. Requests that
+    are already late, or cannot get a slot in time, are answered at once.
+    """
+    g.deadline = deadline_from_header(request.headers.get(DEADLINE_HEADER))
+    if request.endpoint in ADMITTED_ENDPOINTS:
+        check_deadline(g.deadline)
+        admission.acquire(g.deadline)
+        g.admitted = True
+
+
+@app.teardown_request
+def release_slot(_exception=None):
+    """Give the analysis slot back, whatever happened to the request."""
+    if g.pop("admitted", False):
+        admission.release()
+
+
+def count_profiled_request(_exception=None):
+    """Let a running profile count finished requests."""
+    profiler.request_finished()
+
+
+# with profiling off, requests do not even pass through the hook
+if ADMIN_TOKEN:
+    app.teardown_request(count_profiled_request)
+
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    """503 with Retry-After when the worker is saturated."""
+    response = jsonify({"message": str(error)})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
+
+
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(error):
+    """504 for work dropped because the caller's deadline passed."""
+    return jsonify({"message": str(error)}), 504
+
+
+@app.errorhandler(ImageTooLarge)
+def image_too_large(error):
+    """413 for images refused by the size guard before decoding."""
+    return jsonify({"message": str(error)}), 413
+
+
+@app.errorhandler(VideoTooLarge)
+def video_too_large(error):
+    """413 for clips over the size, duration or frame limits."""
+    return jsonify({"message": str(error)}), 413
+
+
+@app.after_request
+def record_latency(response):
+    """Record how long the endpoint took."""
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - g.request_start, request.endpoint or "unknown"
+    )
+    return response
+
+
+RAW_MIMETYPES = ("application/octet-stream",)
+VIDEO_CHUNK_BYTES = 1 << 20
+
+
+def read_image_body():
+    """
+    Return the uploaded image as a memoryview, or None when the request
+    is not a raw image/* body or a multipart upload.
+    """
+    if request.mimetype.startswith("image/") or request.mimetype in RAW_MIMETYPES:
+        return memoryview(request.get_data(cache=False))
+
+    if request.files:
+        upload = request.files.get("image") or next(iter(request.files.values()))
+        stream = upload.stream
+        # small parts are spooled in memory; hand out a view, not a copy
+        if isinstance(stream, io.BytesIO):
+            return stream.getbuffer()
+        return memoryview(stream.read())
+
+    return None
+
+
+def request_user():
+    """
+    The signed-in user the web app is analyzing for (X-User), if any.
+    """
+    return request.headers.get("X-User") or None
+
 
 @app.route("/process", methods=["POST"])
 def process_image_api():
     """
     API to process the image and return analysis results.
+
+    Accepts a raw image/* body, a multipart upload or JSON
+    {"image": "<base64>"}.
     """
-    data = request.get_json()
+    image_buffer = read_image_body()
+    if image_buffer is not None:
+        # release the view so the upload stream can be closed afterwards
+        with image_buffer:
+            if image_buffer.nbytes == 0:
+                return jsonify({"message": "No image data provided"}), 400
+            result = process_image_bytes(image_buffer, request_user(), g.deadline)
+        return jsonify(result)
+
+    data = request.get_json(silent=True) or {}
     image_data = data.get("image")
 
     if not image_data:
         return jsonify({"message": "No image data provided"}), 400
 
-    result = process_image(image_data)
+    result = process_image(image_data, request_user(), g.deadline)
     return jsonify(result)
 
 
+@app.route("/process_batch", methods=["POST"])
+def process_batch_api():
+    """
+    API to process many images in one request.
+
+    Accepts a multipart upload with any number of files or JSON
+    {"images": ["<base64>", ...]}. Returns one result per image, in order.
+    """
+    if request.files:
+        uploads = [upload for _, upload in request.files.items(multi=True)]
+        names = [upload.filename for upload in uploads]
+        # read lazily so only one chunk of images is held at a time
+        image_buffers = (upload.read() for upload in uploads)
+    else:
+        data = request.get_json(silent=True) or {}
+        images = data.get("images") or []
+        names = [None] * len(images)
+        image_buffers = (base64.b64decode(image) for image in images)
+
+    if not names:
+        return jsonify({"message": "No image data provided"}), 400
+
+    results = [
+        {"filename": name, **response}
+        for name, response in zip(
+            names,
+            process_images_bytes(
+                image_buffers, user=request_user(), deadline=g.deadline
+            ),
+        )
+    ]
+    return jsonify({"message": "Images processed", "results": results})
+
+
+def save_video_body(target, max_bytes=None):
+    """
+    Copy the uploaded video into target in chunks, never holding the
+    whole clip in memory. Returns the number of bytes written; raises
+    VideoTooLarge past max_bytes (default VIDEO_MAX_BYTES).
+    """
+    max_bytes = max_bytes or VIDEO_MAX_BYTES
+    if (request.content_length or 0) > max_bytes:
+        raise VideoTooLarge(f"{max_bytes} bytes")
+    if request.files:
+        upload = request.files.get("video") or next(iter(request.files.values()))
+        source = upload.stream
+    elif request.mimetype.startswith("video/") or request.mimetype in RAW_MIMETYPES:
+        source = request.stream
+    else:
+        return 0
+    while chunk := source.read(VIDEO_CHUNK_BYTES):
+        if target.tell() + len(chunk) > max_bytes:
+            raise VideoTooLarge(f"{max_bytes} bytes")
+        target.write(chunk)
+    return target.tell()
+
+
+@app.route("/process_video", methods=["POST"])
+def process_video_api():
+    """
+    API to analyze a video clip and return an emotion time series per face.
+
+    Accepts a raw video/* body or a multipart upload. The sample_fps and
+    detect_every query parameters override the configured defaults.
+    Clips over the video limits get 413; the deadline is checked per frame.
+    """
+    sample_fps = request.args.get("sample_fps", VIDEO_SAMPLE_FPS, type=float)
+    detect_every = request.args.get("detect_every", None, type=int)
+    if sample_fps < 0 or (detect_every is not None and detect_every < 1):
+        return jsonify({"message": "Invalid sampling parameters"}), 400
+
+    # the decoder needs a seekable file, so spool the upload to disk
+    with tempfile.NamedTemporaryFile(suffix=".video") as target:
+        if save_video_body(target) == 0:
+            return jsonify({"message": "No video data provided"}), 400
+        target.flush()
+        try:
+            result = analyze_video_file(
+                target.name, sample_fps, detect_every, g.deadline
+            )
+        except ValueError as error:
+            return jsonify({"message": str(error)}), 400
+    return jsonify({"message": "Video processed", "results": result})
+
+
+def time_range():
+    """
+    time_query() for ?since=&until= ISO 8601 times; ValueError if malformed.
+    """
+    bounds = []
+    for name in ("since", "until"):
+        value = request.args.get(name)
+        moment = datetime.datetime.fromisoformat(value) if value else None
+        if moment is not None and moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        bounds.append(moment)
+    return time_query(*bounds)
+
+
+@app.route("/analytics", methods=["GET"])
+def analytics_api():
+    """
+    Emotion distributions, means and trends over the saved results.
+    ?since=&until= limit the time range; ?bucket= is the trend bucket in
+    seconds (default 3600). A trend of more than MAX_TREND_BUCKETS
+    buckets is refused with 400.
+    """
+    try:
+        query = time_range()
+    except ValueError:
+        return jsonify({"message": "Invalid since/until"}), 400
+    bucket = request.args.get("bucket", 3600, type=int)
+    if bucket <= 0:
+        return jsonify({"message": "Invalid bucket"}), 400
+    try:
+        return jsonify(summarize(collection, query, bucket))
+    except TooManyBuckets as error:
+        return jsonify({"message": str(error)}), 400
+
+
+@app.route("/export", methods=["GET"])
+def export_api():
+    """
+    Stream one row per analyzed face as NDJSON (default) or ?format=csv.
+    Results are read and written one cursor batch at a time.
+    """
+    try:
+        query = time_range()
+    except ValueError:
+        return jsonify({"message": "Invalid since/until"}), 400
+    if request.args.get("format") == "csv":
+        response = Response(
+            stream_with_context(export_csv(collection, query)), mimetype="text/csv"
+        )
+        response.headers["Content-Disposition"] = "attachment; filename=emotions.csv"
+        return response
+    return Response(
+        stream_with_context(export_ndjson(collection, query)),
+        mimetype="application/x-ndjson",
+    )
+
+
+@app.route("/admin/profile", methods=["POST"])
+def profile_api():
+    """
+    Sample this worker's stacks for ?seconds= (default 10) or until
+    ?requests= requests finished, every ?interval_ms= (default 5).
+    Returns collapsed stacks as text, or JSON with ?format=json;
+    ?memory=1 adds a tracemalloc diff over the same window (JSON).
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"message": "Not found"}), 404
+    if not admin_authorized(request.headers.get("Authorization"), ADMIN_TOKEN):
+        return jsonify({"message": "Unauthorized"}), 401
+    memory = request.args.get("memory", "0") in ("1", "true", "yes")
+    try:
+        session = profiler.profile(
+            seconds=request.args.get("seconds", 10.0, type=float),
+            max_requests=request.args.get("requests", 0, type=int),
+            interval=request.args.get("interval_ms", 5.0, type=float) / 1000.0,
+            memory=memory,
+        )
+    except ProfilerBusy as error:
+        return jsonify({"message": str(error)}), 409
+    if memory or request.args.get("format") == "json":
+        return jsonify(session.result())
+    return Response(session.collapsed(), content_type="text/plain; charset=utf-8")
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats_api():
+    """
+    Hit/miss counters of the result cache.
+    """
+    return jsonify(result_cache.stats())
+
+
+@app.route("/writer/stats", methods=["GET"])
+def writer_stats_api():
+    """
+    Mode, queue depth and counters of the result writer.
+    """
+    return jsonify(result_writer.stats())
+
+
+@app.route("/admission/stats", methods=["GET"])
+def admission_stats_api():
+    """
+    Running and queued analyses, and how many were turned away.
+    """
+    return jsonify(admission.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_api():
+    """
+    Per-stage latency, image size and face count histograms in the
+    Prometheus text format.
+    """
+    return Response(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz_api():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz_api():
+    """
+    Readiness: the model is warm and MongoDB is reachable. Answers 503
+    until both hold, so traffic is only routed to a warm instance.
+    """
+    ready, checks = readiness()
+    status = {"status": "ready" if ready else "not ready", "checks": checks}
+    return jsonify(status), 200 if ready else 503
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001)
+    # development server; use gunicorn -c gunicorn.conf.py app:app in production
+    start_warm_up()
+    try:
+        app.run(host="0.0.0.0", port=5001)
+    finally:
+        shutdown()
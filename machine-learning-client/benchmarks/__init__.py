@@ -0,0 +1,6 @@
+"""
+Benchmarks for the machine learning client.
+
+Run them from the machine-learning-client folder, e.g.
+    python -m benchmarks.bench_pipeline
+"""
@@ -0,0 +1,71 @@
+"""
+Speed and recall of every face detector backend.
+
+Backends whose model files are missing from ML_FACE_MODEL_DIR are skipped.
+Recall needs a labeled corpus: a folder with labels.json (see corpus.py).
+
+    python -m benchmarks.bench_detectors --images DIR [--max-side 1280]
+"""
+
+import argparse
+import time
+import numpy as np
+
+from benchmarks.corpus import detection_recall, load_corpus
+from benchmarks.timing import print_table, summarize, time_call, write_json
+from face_detectors import DETECTORS, make_face_detector, prepare_image
+
+
+def bench_detector(
+    detector, corpus, max_side, repeat
+):  # pylint: disable=too-many-locals
+    """
+    Latency, throughput and recall of one backend over the corpus.
+    """
+    latencies, recalls = [], []
+    start = time.perf_counter()
+    for _, frame, truth in corpus:
+        for _ in range(repeat):
+            image, scale = prepare_image(detector, frame, max_side)
+            faces, elapsed = time_call(detector.detect, image)
+            latencies.append(elapsed)
+        score = detection_recall(np.asarray(faces).reshape(-1, 4) * scale, truth)
+        if score is not None:
+            recalls.append(score)
+    total = time.perf_counter() - start
+    summary = summarize(latencies)
+    return {
+        "detector": detector.name,
+        "images_per_s": round(len(latencies) / total, 2),
+        "p50_ms": summary["p50_ms"],
+        "p95_ms": summary["p95_ms"],
+        "recall": round(float(np.mean(recalls)), 3) if recalls else "n/a",
+    }
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", help="labeled folder (default: synthetic)")
+    parser.add_argument("--detectors", nargs="+", default=list(DETECTORS))
+    parser.add_argument("--max-side", type=int, default=1280)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images)
+    rows = []
+    for name in args.detectors:
+        try:
+            detector = make_face_detector(name)
+        except FileNotFoundError as error:
+            print(f"skipping {name}: {error}")
+            continue
+        rows.append(bench_detector(detector, corpus, args.max_side, args.repeat))
+
+    print_table(rows, ["detector", "images_per_s", "p50_ms", "p95_ms", "recall"])
+    write_json(args.json, {"benchmark": "detectors", "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
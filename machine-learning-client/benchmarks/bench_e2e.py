@@ -0,0 +1,496 @@
+"""
+End-to-end load test: images uploaded to the web app at a fixed
+concurrency, through the ML service, into MongoDB.
+
+By default the real services are started locally (benchmarks/stand_ins.py)
+against a throwaway mongod, or against mongomock when mongod is not
+installed; --web-url/--ml-url point at services that are already up
+(e.g. docker compose) instead. Each client signs up and logs in first, so
+uploads go through the server-side session and the user's history too
+(--anonymous skips that).
+
+Every upload is a different byte string, so the ML result cache is
+missed and each request runs detection, emotions and the MongoDB write;
+--repeat sends the corpus as is to measure cache hits instead. For each
+concurrency level the report has requests/s, latency percentiles,
+outcomes and, from the services' /metrics before and after, the time
+per request spent in each stage of both services (with several gunicorn
+workers a scrape only sees one of them).
+
+--json writes everything, with the commit it ran on; --compare reads an
+earlier --json file and exits with status 1 when requests/s fell or
+p95/p99 latency rose by more than --tolerance percent.
+
+    python -m benchmarks.bench_e2e [--concurrency 1 4 8] [--requests 100]
+        [--images DIR] [--mongo auto|mongod|fake|URI] [--repeat]
+        [--json out.json] [--compare baseline.json]
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import queue
+import re
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+import requests
+
+from benchmarks.corpus import encode_jpeg, load_corpus
+from benchmarks.stand_ins import ML_DIR, local_services
+from benchmarks.timing import print_table, summarize, write_json
+
+REQUEST_TIMEOUT = 60.0
+# histograms whose per-label sums make the per-stage breakdown
+STAGE_METRICS = (
+    ("web", "web_request_seconds", "request"),
+    ("web", "web_stage_seconds", "stage"),
+    ("ml", "ml_request_seconds", "request"),
+    ("ml", "ml_stage_seconds", "stage"),
+)
+# the benchmark's own scrapes and the health checks are not uploads
+PROBE_ENDPOINTS = {
+    "metrics",
+    "metrics_api",
+    "healthz",
+    "healthz_api",
+    "readyz",
+    "readyz_api",
+}
+# name_sum{label="value"} 1.5 / name_count 3 / name_quantile{...,quantile="0.95"} 0.2
+_SERIES = re.compile(r'^(\w+?)_(sum|count)(?:\{\w+="([^"]*)"\})? (\S+)$')
+_QUANTILE = re.compile(r'^(\w+)_quantile\{\w+="([^"]*)",quantile="0\.95"\} (\S+)$')
+# metrics a regression check looks at, and whether higher is better
+HEADLINE = (
+    ("requests_per_s", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+)
+REGRESSION_CHECKED = ("requests_per_s", "p95_ms", "p99_ms")
+
+
+def build_corpus(folder):
+    """
+    The fixed corpus as upload-ready JPEGs, with their size and face count.
+    """
+    corpus = []
+    for name, frame, boxes in load_corpus(folder):
+        height, width = frame.shape[:2]
+        corpus.append(
+            {
+                "name": name,
+                "image": f"{width}x{height}",
+                "faces": None if boxes is None else len(boxes),
+                "data": encode_jpeg(frame),
+            }
+        )
+    return corpus
+
+
+def request_body(item, serial, repeat):
+    """
+    The bytes to upload. Unless repeat is set, a serial number goes after
+    the end of the JPEG: decoders ignore it, but every upload hashes to a
+    new key, so no cache answers it.
+    """
+    if repeat:
+        return item["data"]
+    return item["data"] + b"\0bench" + str(serial).encode()
+
+
+class UploadClient:
+    """
+    One simulated user: a requests session, optionally signed in.
+    """
+
+    def __init__(self, web_url):
+        self.web_url = web_url
+        self.session = requests.Session()
+
+    def sign_in(self, username, password):
+        """
+        Sign up and log in; the session cookie is kept for the uploads.
+        """
+        form = {"username": username, "password": password}
+        self.session.post(
+            f"{self.web_url}/sign_up",
+            data={**form, "confirm_password": password},
+            timeout=REQUEST_TIMEOUT,
+        )
+        response = self.session.post(
+            f"{self.web_url}/login",
+            data=form,
+            allow_redirects=False,
+            timeout=REQUEST_TIMEOUT,
+        )
+        if not response.headers.get("Location", "").endswith("/upload"):
+            raise RuntimeError(f"could not log in as {username}")
+
+    def upload(self, name, body):
+        """
+        Upload one image the way the form does; (seconds, outcome).
+        A redirect to /analysis is "ok", one back to /upload means the
+        web app flashed an error ("rejected").
+        """
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                f"{self.web_url}/upload",
+                files={"file": (f"{name}.jpg", body, "image/jpeg")},
+                allow_redirects=False,
+                timeout=REQUEST_TIMEOUT,
+            )
+        except requests.exceptions.RequestException:
+            return time.perf_counter() - start, "exception"
+        elapsed = time.perf_counter() - start
+        location = response.headers.get("Location", "")
+        if response.status_code == 302 and location.endswith("/analysis"):
+            return elapsed, "ok"
+        if response.status_code == 302:
+            return elapsed, "rejected"
+        return elapsed, f"http_{response.status_code}"
+
+
+def scrape(url):
+    """
+    Histogram sums, counts and windowed p95s from a /metrics endpoint:
+    {(metric, label, "sum"|"count"|"p95"): value}.
+    """
+    text = requests.get(f"{url}/metrics", timeout=REQUEST_TIMEOUT).text
+    values = {}
+    for line in text.splitlines():
+        match = _SERIES.match(line)
+        if match:
+            name, kind, label, value = match.groups()
+            values[(name, label, kind)] = float(value)
+            continue
+        match = _QUANTILE.match(line)
+        if match:
+            name, label, value = match.groups()
+            values[(name, label, "p95")] = float(value)
+    return values
+
+
+def stage_rows(before, after, requests_sent):
+    """
+    Per-stage count, mean and time per upload between two scrapes of
+    each service. p95_ms is over the histogram's recent window.
+    """
+    rows = []
+    for service, metric, kind in STAGE_METRICS:
+        labels = sorted(
+            {
+                label
+                for name, label, part in after[service]
+                if name == metric and part == "count"
+            }
+        )
+        for label in labels:
+            count = after[service][(metric, label, "count")] - before[service].get(
+                (metric, label, "count"), 0.0
+            )
+            if count <= 0 or (kind == "request" and label in PROBE_ENDPOINTS):
+                continue
+            total = after[service][(metric, label, "sum")] - before[service].get(
+                (metric, label, "sum"), 0.0
+            )
+            rows.append(
+                {
+                    "service": service,
+                    "stage": f"{kind}:{label}" if kind == "request" else label,
+                    "count": int(count),
+                    "mean_ms": round(total / count * 1000, 3),
+                    "ms_per_upload": round(total / requests_sent * 1000, 3),
+                    "p95_ms": round(
+                        after[service].get((metric, label, "p95"), 0.0) * 1000, 3
+                    ),
+                }
+            )
+    return rows
+
+
+def faces_found(before, after):
+    """
+    Images the ML service analyzed and the faces it found between scrapes.
+    """
+    images, faces = (
+        after["ml"].get(("ml_faces_per_image", None, part), 0.0)
+        - before["ml"].get(("ml_faces_per_image", None, part), 0.0)
+        for part in ("count", "sum")
+    )
+    return {"images_analyzed": int(images), "faces_found": int(faces)}
+
+
+class LoadRun:
+    """
+    Uploads spread over signed-in clients, one thread per client.
+    Serial numbers carry on across levels so no upload repeats.
+    """
+
+    def __init__(self, urls, corpus, repeat=False):
+        self.urls = urls
+        self.corpus = corpus
+        self.repeat = repeat
+        self.clients = []
+        self._serial = 0
+
+    def add_clients(self, count, anonymous=False):
+        """
+        Make sure there are at least count clients, signed in unless anonymous.
+        """
+        run_id = secrets.token_hex(4)
+        while len(self.clients) < count:
+            client = UploadClient(self.urls["web_url"])
+            if not anonymous:
+                client.sign_in(f"bench-{run_id}-{len(self.clients)}", run_id)
+            self.clients.append(client)
+
+    def send(self, concurrency, total):
+        """
+        Upload total images from concurrency threads; per-upload records
+        and the wall time.
+        """
+        jobs = queue.SimpleQueue()
+        for index in range(total):
+            item = self.corpus[index % len(self.corpus)]
+            jobs.put((item, request_body(item, self._serial + index, self.repeat)))
+        self._serial += total
+        records = []
+
+        def work(client):
+            while True:
+                try:
+                    item, body = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                elapsed, outcome = client.upload(item["name"], body)
+                records.append((item["name"], elapsed, outcome))
+
+        threads = [
+            threading.Thread(target=work, args=(client,))
+            for client in self.clients[:concurrency]
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return records, time.perf_counter() - start
+
+    def level(self, concurrency, total):
+        """
+        Run one concurrency level and report on it.
+        """
+        before = {
+            "web": scrape(self.urls["web_url"]),
+            "ml": scrape(self.urls["ml_url"]),
+        }
+        records, seconds = self.send(concurrency, total)
+        after = {"web": scrape(self.urls["web_url"]), "ml": scrape(self.urls["ml_url"])}
+        outcomes = Counter(outcome for _, _, outcome in records)
+        latency = summarize(
+            [elapsed for _, elapsed, outcome in records if outcome == "ok"]
+        )
+        return {
+            "concurrency": concurrency,
+            "requests": total,
+            "seconds": round(seconds, 3),
+            "requests_per_s": round(outcomes["ok"] / seconds, 2),
+            **{key: value for key, value in latency.items() if key != "count"},
+            "ok": outcomes["ok"],
+            "errors": total - outcomes["ok"],
+            "outcomes": dict(outcomes),
+            **faces_found(before, after),
+            "stages": stage_rows(before, after, total),
+            "images": self.image_rows(records),
+        }
+
+    def image_rows(self, records):
+        """
+        Latency of the successful uploads of each corpus image.
+        """
+        rows = []
+        for item in self.corpus:
+            latency = summarize(
+                [
+                    elapsed
+                    for name, elapsed, outcome in records
+                    if name == item["name"] and outcome == "ok"
+                ]
+            )
+            rows.append(
+                {
+                    "name": item["name"],
+                    "image": item["image"],
+                    "faces": item["faces"],
+                    "kb": round(len(item["data"]) / 1024, 1),
+                    **latency,
+                }
+            )
+        return rows
+
+
+def git_revision():
+    """
+    The commit being measured, marked "-dirty" with uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ML_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ML_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if status.strip() else "")
+
+
+def compare(previous, current, tolerance):
+    """
+    Headline numbers of two reports side by side, per concurrency level;
+    returns (rows, regressions).
+    """
+    earlier = {run["concurrency"]: run for run in previous["runs"]}
+    rows, regressions = [], []
+    for run in current["runs"]:
+        baseline = earlier.get(run["concurrency"])
+        if baseline is None:
+            continue
+        for metric, higher_is_better in HEADLINE:
+            old, new = baseline.get(metric), run.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            row = {
+                "concurrency": run["concurrency"],
+                "metric": metric,
+                "before": old,
+                "after": new,
+                "change_pct": round(change, 1),
+            }
+            if metric in REGRESSION_CHECKED and worse > tolerance:
+                row["regression"] = "yes"
+                regressions.append(row)
+            rows.append(row)
+    return rows, regressions
+
+
+def measure(args, urls):
+    """
+    Warm up, then measure every concurrency level in turn.
+    """
+    corpus = build_corpus(args.images)
+    load = LoadRun(urls, corpus, args.repeat)
+    load.add_clients(max(args.concurrency), args.anonymous)
+    # first uploads pay for model loading, connection set-up and indexes
+    load.send(max(args.concurrency), args.warmup or len(corpus))
+    return [load.level(concurrency, args.requests) for concurrency in args.concurrency]
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument(
+        "--requests", type=int, default=100, help="uploads per concurrency level"
+    )
+    parser.add_argument("--warmup", type=int, help="uploads before timing")
+    parser.add_argument("--images", help="folder of images (default: synthetic)")
+    parser.add_argument(
+        "--mongo",
+        default="auto",
+        help="mongod, fake (mongomock), a mongodb:// URI, or auto",
+    )
+    parser.add_argument("--mongod", default="mongod", help="mongod binary")
+    parser.add_argument("--web-url", help="use this running web app")
+    parser.add_argument("--ml-url", help="use this running ML service")
+    parser.add_argument("--repeat", action="store_true", help="allow cache hits")
+    parser.add_argument("--anonymous", action="store_true", help="do not sign in")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier --json file to check against")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="percent")
+    args = parser.parse_args()
+
+    if bool(args.web_url) != bool(args.ml_url):
+        parser.error("--web-url and --ml-url go together")
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    if args.web_url:
+        urls = {"mongo": "external", "web_url": args.web_url, "ml_url": args.ml_url}
+        runs = measure(args, urls)
+    else:
+        with local_services(args.mongo, args.mongod) as urls:
+            runs = measure(args, urls)
+
+    print_table(
+        runs,
+        [
+            "concurrency",
+            "requests",
+            "ok",
+            "errors",
+            "requests_per_s",
+            "p50_ms",
+            "p95_ms",
+            "p99_ms",
+            "max_ms",
+            "images_analyzed",
+            "faces_found",
+        ],
+    )
+    print(f"\nstages at concurrency {runs[-1]['concurrency']}:")
+    print_table(
+        runs[-1]["stages"],
+        ["service", "stage", "count", "mean_ms", "ms_per_upload", "p95_ms"],
+    )
+    print(f"\nimages at concurrency {runs[-1]['concurrency']}:")
+    print_table(
+        runs[-1]["images"],
+        ["name", "image", "faces", "kb", "count", "p50_ms", "p95_ms", "max_ms"],
+    )
+
+    report = {
+        "benchmark": "e2e",
+        "commit": git_revision(),
+        "started": started,
+        "python": platform.python_version(),
+        "mongo": urls["mongo"],
+        "config": {
+            "requests": args.requests,
+            "images": args.images or "synthetic",
+            "repeat": args.repeat,
+            "anonymous": args.anonymous,
+        },
+        "runs": runs,
+    }
+    write_json(args.json, report)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        rows, regressions = compare(baseline, report, args.tolerance)
+        print(f"\ncompared with {baseline.get('commit')}:")
+        print_table(
+            rows,
+            ["concurrency", "metric", "before", "after", "change_pct", "regression"],
+        )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Per-face latency and worker memory of each emotion backend.
+
+Every backend is measured in a fresh process, the way a gunicorn worker
+would load it: resident memory is read before the engine is built and
+after a warm-up inference, then faces are classified at several batch
+sizes. TFLite models come from export_emotion_model.py.
+
+    python -m benchmarks.bench_emotion_backends
+        [--models models/emotion_model_float16.tflite ...]
+"""
+
+import argparse
+import multiprocessing
+import os
+
+from benchmarks.timing import print_table, rss_mb, summarize, time_call, write_json
+
+
+def _measure(backend, model_path, batch_sizes, repeat):
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    import numpy as np
+    from emotion_engine import make_emotion_engine
+    from serving import limit_threads
+
+    limit_threads(1)
+    before = rss_mb()
+    kwargs = {"model_path": model_path} if backend == "tflite" else {}
+    engine = make_emotion_engine(backend, **kwargs)
+    height, width = engine.target_size
+    engine.run_model(np.zeros((1, height, width, 1), dtype=np.float32))
+    row = {
+        "backend": backend,
+        "model": engine.model_name,
+        "rss_mb": round(rss_mb() - before, 1),
+    }
+    rng = np.random.default_rng(0)
+    for batch_size in batch_sizes:
+        tensor = rng.uniform(-1, 1, (batch_size, height, width, 1)).astype(np.float32)
+        engine.run_model(tensor)
+        latencies = [time_call(engine.run_model, tensor)[1] for _ in range(repeat)]
+        per_face = summarize(latencies)["p50_ms"] / batch_size
+        row[f"ms_per_face_b{batch_size}"] = round(per_face, 3)
+    return row
+
+
+def run(models, batch_sizes, repeat):
+    """
+    One row per backend: memory added by loading it and per-face latency.
+    """
+    backends = [("keras", None)] + [("tflite", path) for path in models]
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for backend, model_path in backends:
+        if model_path and not os.path.exists(model_path):
+            print(f"skipping {model_path}: run export_emotion_model.py first")
+            continue
+        with context.Pool(1) as pool:
+            rows.append(
+                pool.apply(_measure, (backend, model_path, batch_sizes, repeat))
+            )
+    return rows
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--models",
+        nargs="*",
+        default=[
+            os.path.join("models", "emotion_model_float16.tflite"),
+            os.path.join("models", "emotion_model_int8.tflite"),
+        ],
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rows = run(args.models, args.batch_sizes, args.repeat)
+    columns = ["backend", "model", "rss_mb"] + [
+        f"ms_per_face_b{batch_size}" for batch_size in args.batch_sizes
+    ]
+    print_table(rows, columns)
+    write_json(args.json, {"benchmark": "emotion_backends", "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Peak memory of decoding one image, by image size, with and without the
+size guard.
+
+Every image is decoded in a fresh process the way process_image_bytes
+decodes it, minus the ML_DETECT_MAX_SIDE reduction, so any scaling
+comes from the guard alone ("off" is a plain full-size decode). peak_mb
+is the most resident memory the decode added on top of the loaded
+pipeline and the encoded bytes. With the guard on it should stay near
+3 bytes x ML_MAX_DECODE_PIXELS however big the image is. Images the guard refuses show "refused".
+
+    python -m benchmarks.bench_memory [--megapixels 1 12 24 48 96]
+        [--max-decode-pixels 24000000] [--max-image-pixels 100000000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import cv2
+import numpy as np
+
+from benchmarks.timing import print_table, reset_peak_rss, rss_mb, time_call, write_json
+
+FORMATS = (".jpg", ".png")
+
+
+def encode_blank(extension, megapixels):
+    """
+    Encode a noisy 4:3 image of about the given size.
+    """
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    rng = np.random.default_rng(0)
+    # low-amplitude noise on a gradient compresses like a photo, not a blank
+    frame = np.linspace(0, 200, width, dtype=np.uint8)[None, :, None].repeat(height, 0)
+    frame = (frame + rng.integers(0, 16, (height, 1, 1), dtype=np.uint8)).repeat(3, 2)
+    _, buffer = cv2.imencode(extension, frame)  # pylint: disable=no-member
+    return width, height, buffer.tobytes()
+
+
+def _measure(path, max_image_pixels, max_decode_pixels):
+    # pylint: disable=import-outside-toplevel
+    import ml_client
+    from image_header import ImageTooLarge
+
+    ml_client.MAX_IMAGE_PIXELS = max_image_pixels
+    ml_client.MAX_DECODE_PIXELS = max_decode_pixels
+    with open(path, "rb") as image_file:
+        image_bytes = image_file.read()
+    exact = reset_peak_rss()
+    before = rss_mb()
+    try:
+        (frame, _), elapsed = time_call(
+            ml_client.decode_image_reduced, image_bytes, min_side=0
+        )
+    except ImageTooLarge:
+        frame, elapsed = "refused", 0.0
+    peak = rss_mb("VmHWM") - before
+    decoded = (
+        frame if isinstance(frame, str) else "x".join(map(str, frame.shape[1::-1]))
+    )
+    return {
+        "decoded": decoded,
+        "peak_mb": round(peak, 1) if exact else f"<={peak:.1f}",
+        "ms": round(elapsed * 1000, 1),
+    }
+
+
+def run(megapixels, guard):  # pylint: disable=too-many-locals
+    """
+    One row per (format, size): encoded size, decoded size and peak memory
+    with the guard off and on.
+    """
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for extension in FORMATS:
+            for size in megapixels:
+                width, height, data = encode_blank(extension, size)
+                path = os.path.join(folder, f"image{extension}")
+                with open(path, "wb") as image_file:
+                    image_file.write(data)
+                del data
+                row = {
+                    "format": extension[1:],
+                    "image": f"{width}x{height}",
+                    "file_mb": round(os.path.getsize(path) / 2**20, 1),
+                }
+                for label, limits in (("off", (0, 0)), ("on", guard)):
+                    with context.Pool(1) as pool:
+                        result = pool.apply(_measure, (path, *limits))
+                    for key, value in result.items():
+                        row[f"{key}_{label}"] = value
+                rows.append(row)
+    return rows
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--megapixels", type=float, nargs="+", default=[1, 12, 24, 48, 96]
+    )
+    parser.add_argument("--max-image-pixels", type=int, default=100_000_000)
+    parser.add_argument("--max-decode-pixels", type=int, default=24_000_000)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rows = run(args.megapixels, (args.max_image_pixels, args.max_decode_pixels))
+    columns = ["format", "image", "file_mb"] + [
+        f"{key}_{label}"
+        for label in ("off", "on")
+        for key in ("decoded", "peak_mb", "ms")
+    ]
+    print_table(rows, columns)
+    write_json(args.json, {"benchmark": "memory", "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
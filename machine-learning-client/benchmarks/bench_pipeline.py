@@ -0,0 +1,67 @@
+"""
+Per-image latency of the emotion stage in each ML_PIPELINE_MODE.
+
+    python -m benchmarks.bench_pipeline [--images DIR] [--repeat N] [--json OUT]
+"""
+
+import argparse
+
+import ml_client
+from benchmarks.corpus import load_corpus
+from benchmarks.timing import print_table, summarize, time_call, write_json
+
+MODES = ("redetect", "single_pass", "batched")
+
+
+def run(corpus, repeat):
+    """
+    Time detection plus emotion recognition for every image in each mode.
+    """
+    rows = []
+    for name, frame, boxes in corpus:
+        faces = boxes if boxes is not None else ml_client.identify_people(frame)
+        # warm up so graph building is not counted against the first mode
+        for mode in MODES:
+            ml_client.recognize_emotions(frame, faces, mode=mode)
+        row = {"image": name, "faces": len(faces)}
+        for mode in MODES:
+            latencies = []
+            for _ in range(repeat):
+                emotions, elapsed = time_call(
+                    ml_client.recognize_emotions, frame, faces, mode=mode
+                )
+                latencies.append(elapsed)
+            row[f"{mode}_ms"] = summarize(latencies)["p50_ms"]
+            row[f"{mode}_emotions"] = len(emotions)
+        row["speedup"] = round(row["redetect_ms"] / max(row["batched_ms"], 1e-9), 2)
+        rows.append(row)
+    return rows
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", help="folder of images (default: synthetic)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rows = run(load_corpus(args.images), args.repeat)
+    print_table(
+        rows,
+        [
+            "image",
+            "faces",
+            "redetect_ms",
+            "single_pass_ms",
+            "batched_ms",
+            "speedup",
+            "redetect_emotions",
+            "single_pass_emotions",
+        ],
+    )
+    write_json(args.json, {"benchmark": "pipeline", "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Detection accuracy vs. latency at several working resolutions.
+
+For every ML_DETECT_MAX_SIDE value the JPEG is decoded (at reduced scale
+where possible) and faces are detected on the downsized copy. Recall is
+measured against the labels, or against full-resolution detection when
+the corpus has no labels.
+
+    python -m benchmarks.bench_resolution [--images DIR] [--sides 0 1920 1280 960 640]
+"""
+
+import argparse
+import numpy as np
+
+import ml_client
+from benchmarks.corpus import detection_recall, encode_jpeg, load_corpus
+from benchmarks.timing import print_table, summarize, time_call, write_json
+
+
+def detect(image_bytes, max_side):
+    """
+    Decode and detect the way process_image_bytes does, boxes in original
+    image coordinates.
+    """
+    frame, scale = ml_client.decode_image_reduced(image_bytes, min_side=max_side)
+    faces = ml_client.identify_people(frame, max_side=max_side)
+    return np.round(np.asarray(faces, dtype=np.float64) * scale).reshape(-1, 4)
+
+
+def run(corpus, sides, repeat):
+    """
+    Return one summary row per working resolution.
+    """
+    encoded = [(name, encode_jpeg(frame), boxes) for name, frame, boxes in corpus]
+    truth = [
+        boxes if boxes is not None else detect(image_bytes, 0)
+        for _, image_bytes, boxes in encoded
+    ]
+
+    rows = []
+    for side in sides:
+        latencies, recalls = [], []
+        for (_, image_bytes, _), expected in zip(encoded, truth):
+            for _ in range(repeat):
+                detected, elapsed = time_call(detect, image_bytes, side)
+                latencies.append(elapsed)
+            score = detection_recall(detected, expected)
+            if score is not None:
+                recalls.append(score)
+        summary = summarize(latencies)
+        rows.append(
+            {
+                "max_side": side or "full",
+                "p50_ms": summary["p50_ms"],
+                "p95_ms": summary["p95_ms"],
+                "recall": round(float(np.mean(recalls)), 3) if recalls else "n/a",
+            }
+        )
+    return rows
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", help="folder of images (default: synthetic)")
+    parser.add_argument(
+        "--sides", type=int, nargs="+", default=[0, 1920, 1280, 960, 640]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rows = run(load_corpus(args.images), args.sides, args.repeat)
+    print_table(rows, ["max_side", "p50_ms", "p95_ms", "recall"])
+    write_json(args.json, {"benchmark": "resolution", "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Pipeline throughput with 1/2/4/8 worker processes.
+
+Each worker is started the way gunicorn.conf.py starts one: thread pools
+capped to its share of the CPUs, model loaded once, warm-up inference.
+Images are then spread across the pool and images/second is reported.
+
+    python -m benchmarks.bench_workers [--workers 1 2 4 8] [--images DIR]
+"""
+
+import argparse
+import multiprocessing
+import time
+
+from benchmarks.corpus import load_corpus
+from benchmarks.timing import print_table, write_json
+from serving import limit_threads, threads_per_worker
+
+_STATE = {}
+
+
+def _init_worker(threads, folder):
+    limit_threads(threads)
+    import ml_client  # pylint: disable=import-outside-toplevel
+
+    ml_client.warm_up()
+    _STATE["ml_client"] = ml_client
+    _STATE["corpus"] = load_corpus(folder)
+
+
+def _analyze(index):
+    ml_client = _STATE["ml_client"]
+    corpus = _STATE["corpus"]
+    _, frame, boxes = corpus[index % len(corpus)]
+    faces = boxes if boxes is not None else ml_client.identify_people(frame)
+    return len(ml_client.recognize_emotions(frame, faces))
+
+
+def run(worker_counts, folder, rounds):
+    """
+    Time rounds x corpus images through a pool of each size.
+    """
+    tasks = len(load_corpus(folder)) * rounds
+    # spawn, like gunicorn without preload: no model state crosses a fork
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for workers in worker_counts:
+        threads = threads_per_worker(workers)
+        with context.Pool(
+            workers, initializer=_init_worker, initargs=(threads, folder)
+        ) as pool:
+            # make sure every worker finished loading before timing
+            pool.map(_analyze, range(workers), chunksize=1)
+            start = time.perf_counter()
+            pool.map(_analyze, range(tasks), chunksize=1)
+            elapsed = time.perf_counter() - start
+        rows.append(
+            {
+                "workers": workers,
+                "threads_per_worker": threads,
+                "images": tasks,
+                "seconds": round(elapsed, 3),
+                "images_per_s": round(tasks / elapsed, 2),
+            }
+        )
+    base = rows[0]["images_per_s"]
+    for row in rows:
+        row["speedup"] = round(row["images_per_s"] / base, 2)
+    return rows
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--images", help="folder of images (default: synthetic)")
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rows = run(args.workers, args.images, args.rounds)
+    print_table(
+        rows,
+        [
+            "workers",
+            "threads_per_worker",
+            "images",
+            "seconds",
+            "images_per_s",
+            "speedup",
+        ],
+    )
+    write_json(args.json, {"benchmark": "workers", "rows": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Fixed image corpus shared by the benchmarks.
+
+Images are read from a folder when one is given. A folder may contain a
+labels.json file mapping each file name to its list of [x, y, w, h] face
+boxes. Without a folder a deterministic synthetic corpus is generated so
+every run measures the same pixels.
+"""
+
+# pylint: disable=no-member
+
+import json
+import os
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# (width, height, number of faces)
+SYNTHETIC_LAYOUT = [
+    (640, 480, 2),
+    (1280, 720, 5),
+    (1920, 1080, 10),
+    (1920, 1080, 20),
+    (4032, 3024, 8),
+]
+
+
+def load_corpus(folder=None, seed=0):
+    """
+    Return a list of (name, frame, boxes) tuples.
+    boxes is None when the folder has no label for the image.
+    """
+    if folder:
+        return _load_folder(folder)
+    return synthetic_corpus(seed)
+
+
+def _load_folder(folder):
+    labels = {}
+    labels_path = os.path.join(folder, "labels.json")
+    if os.path.exists(labels_path):
+        with open(labels_path, encoding="utf-8") as labels_file:
+            labels = json.load(labels_file)
+
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        frame = cv2.imread(os.path.join(folder, name), cv2.IMREAD_COLOR)
+        if frame is None:
+            continue
+        boxes = labels.get(name)
+        if boxes is not None:
+            boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+        corpus.append((name, frame, boxes))
+    return corpus
+
+
+def synthetic_corpus(seed=0):
+    """
+    Build images with face-like blobs laid out on a grid, returning the
+    blob boxes alongside each frame. The Haar cascade does fire on most
+    blobs (2, 5, 9, 18 and 6 of the 2, 5, 10, 20 and 8 with the default
+    pipeline settings), so detection-dependent timings scale with those
+    counts; stages timed on the returned boxes do not depend on them.
+    """
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for width, height, count in SYNTHETIC_LAYOUT:
+        frame = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        frame = cv2.GaussianBlur(frame, (0, 0), 3)
+        boxes = _grid_boxes(width, height, count)
+        for x, y, w, h in boxes:  # pylint: disable=invalid-name
+            center = (int(x + w // 2), int(y + h // 2))
+            cv2.ellipse(frame, center, (w // 2, h // 2), 0, 0, 360, (180, 190, 220), -1)
+            cv2.circle(
+                frame, (int(x + w // 3), int(y + h // 3)), w // 12, (40, 40, 40), -1
+            )
+            cv2.circle(
+                frame, (int(x + 2 * w // 3), int(y + h // 3)), w // 12, (40, 40, 40), -1
+            )
+        corpus.append((f"synthetic_{width}x{height}_{count}faces", frame, boxes))
+    return corpus
+
+
+def _grid_boxes(width, height, count):
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    cell_w, cell_h = width // cols, height // rows
+    side = int(min(cell_w, cell_h) * 0.6)
+    boxes = []
+    for index in range(count):
+        row, col = divmod(index, cols)
+        x = col * cell_w + (cell_w - side) // 2  # pylint: disable=invalid-name
+        y = row * cell_h + (cell_h - side) // 2  # pylint: disable=invalid-name
+        boxes.append([x, y, side, side])
+    return np.array(boxes, dtype=np.int32)
+
+
+def encode_jpeg(frame, quality=90):
+    """
+    JPEG-encode a frame, returning the raw bytes.
+    """
+    _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+def box_iou(first, second):
+    """
+    Intersection over union of two [x, y, w, h] boxes.
+    """
+    ax, ay, aw, ah = first
+    bx, by, bw, bh = second
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = inter_w * inter_h
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union else 0.0
+
+
+def detection_recall(detected, truth, threshold=0.5):
+    """
+    Share of truth boxes matched by a detected box with IoU >= threshold,
+    or None when there are no truth boxes.
+    """
+    if truth is None or len(truth) == 0:
+        return None
+    unmatched = [list(box) for box in detected]
+    matched = 0
+    for expected in truth:
+        scores = [box_iou(expected, box) for box in unmatched]
+        if scores and max(scores) >= threshold:
+            unmatched.pop(int(np.argmax(scores)))
+            matched += 1
+    return matched / len(truth)
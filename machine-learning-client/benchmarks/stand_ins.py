@@ -0,0 +1,256 @@
+"""
+Local stand-ins for the end-to-end benchmark: a throwaway MongoDB and
+the real ML and web services, each in its own process.
+
+MongoDB is either a mongod started on a free port with a temporary
+--dbpath, or an in-process mongomock database inside each service
+(--mongo fake). The services are started through their own app.py
+__main__ blocks, so they serve on their usual ports (ML 5001, web 5000)
+with the same start-up as in development.
+
+This file is also the service launcher; bench_e2e.py runs it as
+
+    python benchmarks/stand_ins.py SERVICE_DIR [--fake-mongo]
+
+so that the two app.py and metrics.py modules never share a process.
+"""
+
+import contextlib
+import os
+import runpy
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEB_DIR = os.path.join(os.path.dirname(ML_DIR), "web_app")
+ML_URL = "http://127.0.0.1:5001"
+WEB_URL = "http://127.0.0.1:5000"
+STARTUP_TIMEOUT = 180.0
+POLL_INTERVAL = 0.25
+LOG_TAIL = 40
+
+
+def free_port():
+    """
+    A TCP port nothing is listening on right now.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_until(check, timeout, what):
+    """
+    Poll check() until it returns True; RuntimeError after timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return
+        time.sleep(POLL_INTERVAL)
+    raise RuntimeError(f"{what} did not come up within {timeout:.0f}s")
+
+
+def url_ok(url):
+    """
+    Whether a GET of url answers 200.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+class LocalMongod:
+    """
+    mongod on a free port with a temporary data directory, removed on exit.
+    """
+
+    def __init__(self, binary="mongod"):
+        self.binary = binary
+        self.port = free_port()
+        self.dbpath = None
+        self.process = None
+
+    @property
+    def uri(self):
+        """
+        Connection string of the running server.
+        """
+        return f"mongodb://127.0.0.1:{self.port}/"
+
+    def __enter__(self):
+        self.dbpath = tempfile.mkdtemp(prefix="bench-mongod-")
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [
+                self.binary,
+                "--dbpath",
+                self.dbpath,
+                "--port",
+                str(self.port),
+                "--bind_ip",
+                "127.0.0.1",
+                "--quiet",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_until(self._accepting, STARTUP_TIMEOUT, "mongod")
+        return self
+
+    def _accepting(self):
+        if self.process.poll() is not None:
+            raise RuntimeError(f"mongod exited with {self.process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+            return True
+        except OSError:
+            return False
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+class ServiceProcess:  # pylint: disable=too-many-instance-attributes
+    """
+    One service started from its directory by this file, stopped on exit.
+    Ready once ready_url answers 200; its output goes to a log file that
+    is printed if it fails to start.
+    """
+
+    def __init__(
+        self, name, service_dir, ready_url, env, workdir=None, fake_mongo=False
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.name = name
+        self.service_dir = os.path.abspath(service_dir)
+        self.ready_url = ready_url
+        self.env = env
+        self.workdir = workdir or self.service_dir
+        self.fake_mongo = fake_mongo
+        self.process = None
+        self.log = None
+
+    def __enter__(self):
+        command = [sys.executable, os.path.abspath(__file__), self.service_dir]
+        if self.fake_mongo:
+            command.append("--fake-mongo")
+        # pylint: disable=consider-using-with
+        self.log = tempfile.TemporaryFile(mode="w+", prefix=f"bench-{self.name}-")
+        self.process = subprocess.Popen(
+            command,
+            cwd=self.workdir,
+            env={**os.environ, **self.env, "PYTHONUNBUFFERED": "1"},
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+        )
+        try:
+            wait_until(self._ready, STARTUP_TIMEOUT, f"{self.name} service")
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def _ready(self):
+        if self.process.poll() is not None:
+            self.log.seek(0)
+            tail = "".join(self.log.readlines()[-LOG_TAIL:])
+            raise RuntimeError(
+                f"{self.name} service exited with {self.process.returncode}:\n{tail}"
+            )
+        return url_ok(self.ready_url)
+
+    def __exit__(self, *exc_info):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log.close()
+
+
+def install_fake_mongo():
+    """
+    Make pymongo.MongoClient an in-memory mongomock client for this process.
+    mongomock has no server monitor, so it reports a readable server for
+    the /readyz checks.
+    """
+    # pylint: disable=import-outside-toplevel
+    import mongomock
+    import mongomock.gridfs
+    import pymongo
+
+    class _Topology:  # pylint: disable=too-few-public-methods
+        @staticmethod
+        def has_readable_server():
+            """Always: the database lives in this process."""
+            return True
+
+    class FakeMongoClient(mongomock.MongoClient):  # pylint: disable=abstract-method
+        """
+        mongomock client with the bit of topology state the services read.
+        """
+
+        topology_description = _Topology()
+
+    mongomock.gridfs.enable_gridfs_integration()
+    pymongo.MongoClient = FakeMongoClient
+
+
+@contextlib.contextmanager
+def local_services(mongo="auto", mongod_binary="mongod"):
+    """
+    Start MongoDB, the ML service and the web app; yields a description
+    of what is running. mongo is "mongod", "fake", a mongodb:// URI of a
+    server to use as is, or "auto" (mongod when it is installed, else fake).
+    """
+    if mongo == "auto":
+        mongo = "mongod" if shutil.which(mongod_binary) else "fake"
+    fake = mongo == "fake"
+    with contextlib.ExitStack() as stack:
+        if mongo == "mongod":
+            uri = stack.enter_context(LocalMongod(mongod_binary)).uri
+        else:
+            uri = "mongodb://127.0.0.1:27017/" if fake else mongo
+        env = {"MONGO_URI": uri, "ML_CLIENT_URL": f"{ML_URL}/process"}
+        # the web app keeps uploads under its working directory
+        web_workdir = stack.enter_context(
+            tempfile.TemporaryDirectory(prefix="bench-web-")
+        )
+        stack.enter_context(
+            ServiceProcess("ml", ML_DIR, f"{ML_URL}/readyz", env, fake_mongo=fake)
+        )
+        stack.enter_context(
+            ServiceProcess(
+                "web", WEB_DIR, f"{WEB_URL}/readyz", env, web_workdir, fake_mongo=fake
+            )
+        )
+        yield {
+            "mongo": "mongomock" if fake else mongo,
+            "web_url": WEB_URL,
+            "ml_url": ML_URL,
+        }
+
+
+def serve(service_dir, fake_mongo=False):
+    """
+    Run a service's app.py as __main__, the way "python app.py" does.
+    """
+    sys.path.insert(0, service_dir)
+    if fake_mongo:
+        install_fake_mongo()
+    runpy.run_path(os.path.join(service_dir, "app.py"), run_name="__main__")
+
+
+if __name__ == "__main__":
+    serve(os.path.abspath(sys.argv[1]), "--fake-mongo" in sys.argv[2:])
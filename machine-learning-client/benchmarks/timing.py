@@ -0,0 +1,85 @@
+"""
+Small timing helpers shared by the benchmarks.
+"""
+
+import json
+import time
+import numpy as np
+
+
+def time_call(func, *args, **kwargs):
+    """
+    Call func once, returning (result, elapsed seconds).
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def summarize(latencies):
+    """
+    Summarize a list of latencies in seconds as milliseconds.
+    """
+    values = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if values.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def rss_mb(field="VmRSS"):
+    """
+    Resident set size of this process in MiB; field="VmHWM" gives the peak.
+    """
+    with open("/proc/self/status", encoding="utf-8") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def reset_peak_rss():
+    """
+    Start a new VmHWM peak from the current RSS (Linux 4.0+). Returns
+    False where that is not possible.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def print_table(rows, columns):
+    """
+    Print rows (a list of dicts) as an aligned text table.
+    """
+    widths = [
+        max(len(column), *(len(str(row.get(column, ""))) for row in rows))
+        for column in columns
+    ]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print(
+            "  ".join(
+                str(row.get(column, "")).ljust(width)
+                for column, width in zip(columns, widths)
+            )
+        )
+
+
+def write_json(path, payload):
+    """
+    Write benchmark results to path as JSON, if a path was given.
+    """
+    if not path:
+        return
+    with open(path, "w", encoding="utf-8") as output:
+        json.dump(payload, output, indent=2)
@@ -0,0 +1,368 @@
+"""
+Batched emotion classification.
+
+Every face crop in an image is resized and normalized into one tensor and
+the emotion model is run once per batch instead of once per face. An
+optional MicroBatcher merges the tensors of concurrent requests so the
+model sees even larger batches.
+
+ML_EMOTION_BACKEND picks what runs the model: "keras" (default) loads
+fer's model with TensorFlow; "tflite" runs the same model exported by
+export_emotion_model.py with float16 or int8 weights through the LiteRT
+interpreter, without importing TensorFlow.
+"""
+
+# pylint: disable=no-member
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import cv2
+import numpy as np
+
+EMOTION_BACKEND = os.getenv("ML_EMOTION_BACKEND", "keras")
+EMOTION_TFLITE_MODEL = os.getenv(
+    "ML_EMOTION_TFLITE_MODEL", os.path.join("models", "emotion_model_float16.tflite")
+)
+
+EMOTION_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+
+# same padding / offsets FER applies before classifying a face
+PADDING = 40
+OFFSETS = (10, 10)
+# gray level fed to the model for a box with nothing of the frame in it
+BLANK_PIXEL = 128.0
+
+
+def load_emotion_model():
+    """
+    Load the Keras emotion model that ships with the fer package.
+    """
+    import fer  # pylint: disable=import-outside-toplevel
+    from tensorflow.keras.models import (  # pylint: disable=import-outside-toplevel,import-error,no-name-in-module
+        load_model,
+    )
+
+    model_path = os.path.join(
+        os.path.dirname(fer.__file__), "data", "emotion_model.hdf5"
+    )
+    return load_model(model_path, compile=False)
+
+
+def load_interpreter(model_path, num_threads=None):
+    """
+    Open a .tflite model with the lightest interpreter installed:
+    ai-edge-litert, then tflite-runtime, then TensorFlow's own.
+    """
+    # pylint: disable=import-outside-toplevel,import-error
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter  # pylint: disable=no-name-in-module
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"Emotion model not found: {model_path} (run export_emotion_model.py)"
+        )
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+
+def to_square(box):
+    """
+    Grow the shorter side of an (x, y, w, h) box so the box is square.
+    """
+    x, y, w, h = (int(value) for value in box)  # pylint: disable=invalid-name
+    if h > w:
+        x -= (h - w) // 2
+        w = h
+    elif w > h:
+        y -= (w - h) // 2
+        h = w
+    return x, y, w, h
+
+
+def pad_gray(frame):
+    """
+    Convert to grayscale and pad every side so boxes at the border still
+    get their offsets, filling with the mean of the bottom rows like FER.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    fill = cv2.mean(gray[-2:, :])[0]
+    return cv2.copyMakeBorder(
+        gray, PADDING, PADDING, PADDING, PADDING, cv2.BORDER_CONSTANT, value=fill
+    )
+
+
+class BatchedEmotionEngine:
+    """
+    Classify every face of an image with a single model call.
+    """
+
+    name = "keras"
+    model_name = "fer/emotion_model.hdf5"
+
+    def __init__(self, model=None, max_batch_size=128, offsets=OFFSETS):
+        # without a model, the fer model is loaded on first use so that
+        # importing this module does not import TensorFlow
+        self._model = model
+        self._model_lock = threading.Lock()
+        self.max_batch_size = max_batch_size
+        self.offsets = offsets
+        # set to a MicroBatcher to share model calls between requests
+        self.batcher = None
+
+    @property
+    def model(self):
+        """
+        The Keras model, loaded the first time it is needed.
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self.load_model()
+        return self._model
+
+    def load_model(self):
+        """
+        Load the model; called once, on first use.
+        """
+        return load_emotion_model()
+
+    @property
+    def loaded(self):
+        """
+        Whether the model has been loaded.
+        """
+        return self._model is not None
+
+    @property
+    def target_size(self):
+        """
+        (height, width) of the model input.
+        """
+        return tuple(self.model.input_shape[1:3])
+
+    def prepare(self, frame, faces):
+        """
+        Crop, resize and normalize every face into one float32 tensor
+        of shape (faces, height, width, 1).
+        """
+        height, width = self.target_size
+        tensor = np.empty((len(faces), height, width, 1), dtype=np.float32)
+        if len(faces) == 0:
+            return tensor
+
+        padded = pad_gray(frame)
+        for index, box in enumerate(faces):
+            crop = self._crop(padded, box)
+            if crop.size == 0:
+                # the box lies outside the frame: classify a blank face so
+                # the results still line up with the boxes
+                tensor[index] = BLANK_PIXEL
+                continue
+            tensor[index, :, :, 0] = cv2.resize(crop, (width, height))
+
+        # scale to [-1, 1] in place, as the model was trained
+        tensor *= 2.0 / 255.0
+        tensor -= 1.0
+        return tensor
+
+    def _crop(self, padded, box):
+        """
+        Cut a face out of the padded gray frame, squared and with offsets.
+        """
+        x, y, w, h = to_square(box)  # pylint: disable=invalid-name
+        x_off, y_off = self.offsets
+        x1 = max(0, x - x_off + PADDING)
+        y1 = max(0, y - y_off + PADDING)
+        return padded[y1 : y + h + y_off + PADDING, x1 : x + w + x_off + PADDING]
+
+    def classify(self, tensor):
+        """
+        Run the model over a prepared tensor, returning an (n, 7) array.
+        """
+        if len(tensor) == 0:
+            return np.empty((0, len(EMOTION_LABELS)), dtype=np.float32)
+        if self.batcher is not None:
+            return self.batcher.classify(tensor)
+        return self.run_model(tensor)
+
+    def run_model(self, tensor):
+        """
+        Call the model directly, in chunks of at most max_batch_size.
+        """
+        outputs = [
+            np.asarray(
+                self.model.predict_on_batch(tensor[start : start + self.max_batch_size])
+            )
+            for start in range(0, len(tensor), self.max_batch_size)
+        ]
+        return np.concatenate(outputs)
+
+    def predict(self, frame, faces):
+        """
+        Return a list of emotion dicts, one per face.
+        """
+        return label_scores(self.classify(self.prepare(frame, faces)))
+
+    def predict_many(self, items):
+        """
+        Classify the faces of several images with one model call.
+        items is a list of (frame, faces); returns one list of emotion
+        dicts per image.
+        """
+        tensors = [self.prepare(frame, faces) for frame, faces in items]
+        if not tensors:
+            return []
+        scores = label_scores(self.classify(np.concatenate(tensors)))
+        results, start = [], 0
+        for tensor in tensors:
+            results.append(scores[start : start + len(tensor)])
+            start += len(tensor)
+        return results
+
+
+class TFLiteEmotionEngine(BatchedEmotionEngine):
+    """
+    The same classifier exported to TensorFlow Lite, run by the LiteRT
+    interpreter. Batches are padded to a power of two so the interpreter
+    only reallocates its tensors for a handful of batch sizes.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path=None, num_threads=None, **kwargs):
+        super().__init__(**kwargs)
+        self.model_path = model_path or EMOTION_TFLITE_MODEL
+        self.model_name = os.path.basename(self.model_path)
+        # follow the thread cap serving.limit_threads gives this worker
+        threads = os.getenv("TF_NUM_INTRAOP_THREADS")
+        self.num_threads = num_threads or (int(threads) if threads else None)
+        self._batch_size = None
+        # an interpreter must not be invoked from two threads at once
+        self._run_lock = threading.Lock()
+
+    def load_model(self):
+        interpreter = load_interpreter(self.model_path, self.num_threads)
+        interpreter.allocate_tensors()
+        return interpreter
+
+    @property
+    def target_size(self):
+        shape = self.model.get_input_details()[0]["shape"]
+        return int(shape[1]), int(shape[2])
+
+    def run_model(self, tensor):
+        """
+        Invoke the interpreter in chunks of at most max_batch_size.
+        """
+        interpreter = self.model
+        input_index = interpreter.get_input_details()[0]["index"]
+        output_index = interpreter.get_output_details()[0]["index"]
+        outputs = []
+        with self._run_lock:
+            for start in range(0, len(tensor), self.max_batch_size):
+                chunk = tensor[start : start + self.max_batch_size]
+                size = min(1 << (len(chunk) - 1).bit_length(), self.max_batch_size)
+                if size != self._batch_size:
+                    interpreter.resize_tensor_input(
+                        input_index, (size,) + chunk.shape[1:]
+                    )
+                    interpreter.allocate_tensors()
+                    self._batch_size = size
+                batch = np.zeros((size,) + chunk.shape[1:], dtype=np.float32)
+                batch[: len(chunk)] = chunk
+                interpreter.set_tensor(input_index, batch)
+                interpreter.invoke()
+                outputs.append(
+                    interpreter.get_tensor(output_index)[: len(chunk)].copy()
+                )
+        return np.concatenate(outputs)
+
+
+EMOTION_ENGINES = {
+    "keras": BatchedEmotionEngine,
+    "tflite": TFLiteEmotionEngine,
+}
+
+
+def make_emotion_engine(name=EMOTION_BACKEND, **kwargs):
+    """
+    Build the emotion engine for a backend name.
+    """
+    if name not in EMOTION_ENGINES:
+        raise ValueError(f"Unknown emotion backend: {name}")
+    return EMOTION_ENGINES[name](**kwargs)
+
+
+def label_scores(scores):
+    """
+    Turn rows of model output into FER-style {"happy": 0.75, ...} dicts.
+    """
+    return [
+        {label: round(float(score), 2) for label, score in zip(EMOTION_LABELS, row)}
+        for row in scores
+    ]
+
+
+class MicroBatcher:  # pylint: disable=too-few-public-methods
+    """
+    Merge face tensors submitted by concurrent requests into one model call.
+
+    The first tensor to arrive opens a window of window_ms; everything that
+    arrives before it closes (up to max_batch_size faces) is classified
+    together and the rows are handed back to each caller.
+    """
+
+    def __init__(self, run_model, window_ms=5.0, max_batch_size=128):
+        self.run_model = run_model
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._loop, name="emotion-micro-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def classify(self, tensor):
+        """
+        Queue a tensor for the next batch and wait for its scores.
+        """
+        future = Future()
+        self._pending.put((tensor, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._pending.get()]
+        faces = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while faces < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            faces += len(item[0])
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                scores = self.run_model(np.concatenate([tensor for tensor, _ in batch]))
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            start = 0
+            for tensor, future in batch:
+                future.set_result(scores[start : start + len(tensor)])
+                start += len(tensor)
@@ -0,0 +1,102 @@
+"""
+Export fer's emotion model to TensorFlow Lite for ML_EMOTION_BACKEND=tflite.
+
+float16 halves the weights and keeps the outputs within a rounding error
+of the Keras model. int8 quantizes the weights and activations to 8 bits;
+its activation ranges are calibrated on face crops from --images (random
+tensors when no folder is given, which costs some accuracy).
+
+    python export_emotion_model.py [--quantization float16 int8]
+        [--output-dir models] [--images DIR]
+"""
+
+# pylint: disable=no-member
+
+import argparse
+import os
+import cv2
+import numpy as np
+from emotion_engine import BatchedEmotionEngine, load_emotion_model
+from face_detectors import make_face_detector
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+CALIBRATION_SAMPLES = 200
+
+
+def calibration_faces(engine, folder=None, limit=CALIBRATION_SAMPLES):
+    """
+    Prepared face tensors for int8 calibration, one face per item.
+    """
+    if folder:
+        detector = make_face_detector("haar")
+        for name in sorted(os.listdir(folder)):
+            frame = cv2.imread(os.path.join(folder, name))
+            if frame is None:
+                continue
+            faces = detector.detect(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            for face in engine.prepare(frame, faces):
+                yield face[np.newaxis]
+                limit -= 1
+                if limit == 0:
+                    return
+    rng = np.random.default_rng(0)
+    height, width = engine.target_size
+    for _ in range(limit):
+        yield rng.uniform(-1.0, 1.0, (1, height, width, 1)).astype(np.float32)
+
+
+def convert(model, quantization, calibration=None):
+    """
+    Convert a Keras model to .tflite bytes with the given quantization.
+    calibration is a callable returning face tensors (int8 only).
+    """
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([face] for face in calibration())
+    return converter.convert()
+
+
+def export(quantizations, output_dir, images=None):
+    """
+    Write emotion_model_<quantization>.tflite files; returns their paths.
+    """
+    model = load_emotion_model()
+    engine = BatchedEmotionEngine(model=model)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for quantization in quantizations:
+        data = convert(model, quantization, lambda: calibration_faces(engine, images))
+        path = os.path.join(output_dir, f"emotion_model_{quantization}.tflite")
+        with open(path, "wb") as model_file:
+            model_file.write(data)
+        paths.append(path)
+    return paths
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--quantization",
+        nargs="+",
+        choices=QUANTIZATIONS,
+        default=["float16", "int8"],
+    )
+    parser.add_argument("--output-dir", default="models")
+    parser.add_argument("--images", help="face images to calibrate int8 on")
+    args = parser.parse_args()
+
+    for path in export(args.quantization, args.output_dir, args.images):
+        print(f"wrote {path} ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
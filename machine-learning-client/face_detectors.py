@@ -0,0 +1,211 @@
+"""
+Interchangeable CPU face detector backends.
+
+Every backend has a detect(image) method returning an (n, 4) int32 array
+of [x, y, w, h] boxes, a params dict of its tunable settings and a
+needs_color flag telling identify_people whether to pass the BGR frame
+or a grayscale copy. Select one with ML_FACE_DETECTOR and tune it with a
+JSON object in ML_FACE_DETECTOR_PARAMS.
+
+The LBP cascade and the DNN models are not part of the opencv-python
+wheels; put them in ML_FACE_MODEL_DIR (default "models"):
+    lbp:   lbpcascade_frontalface_improved.xml
+    ssd:   deploy.prototxt, res10_300x300_ssd_iter_140000.caffemodel
+    yunet: face_detection_yunet_2023mar.onnx
+"""
+
+# pylint: disable=no-member
+
+import json
+import os
+import cv2
+import numpy as np
+
+FACE_DETECTOR = os.getenv("ML_FACE_DETECTOR", "haar")
+FACE_DETECTOR_PARAMS = json.loads(os.getenv("ML_FACE_DETECTOR_PARAMS", "{}"))
+FACE_MODEL_DIR = os.getenv("ML_FACE_MODEL_DIR", "models")
+
+NO_FACES = np.empty((0, 4), dtype=np.int32)
+
+
+def model_path(filename, model_dir=None):
+    """
+    Path of a model file, failing early with a clear message if missing.
+    """
+    path = os.path.join(model_dir or FACE_MODEL_DIR, filename)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Face detector model not found: {path}")
+    return path
+
+
+def corners_to_boxes(corners, width, height):
+    """
+    Convert [x1, y1, x2, y2] rows to clipped [x, y, w, h] int boxes.
+    """
+    if len(corners) == 0:
+        return NO_FACES
+    corners = np.asarray(corners, dtype=np.float64)
+    x1 = np.clip(corners[:, 0], 0, width)
+    y1 = np.clip(corners[:, 1], 0, height)
+    x2 = np.clip(corners[:, 2], 0, width)
+    y2 = np.clip(corners[:, 3], 0, height)
+    boxes = np.stack([x1, y1, x2 - x1, y2 - y1], axis=1).round().astype(np.int32)
+    return boxes[(boxes[:, 2] > 0) & (boxes[:, 3] > 0)]
+
+
+def prepare_image(detector, frame, max_side):
+    """
+    Convert a BGR frame to what the detector wants, downsized so its
+    longest side is at most max_side (0 = keep full size).
+    Returns (image, scale) where scale maps image pixels back to frame.
+    """
+    image = frame
+    if not detector.needs_color:
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = image.shape[:2]
+    scale = max(height, width) / max_side if max_side else 1.0
+    if scale <= 1.0:
+        return image, 1.0
+    size = (round(width / scale), round(height / scale))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+class CascadeDetector:  # pylint: disable=too-few-public-methods
+    """
+    OpenCV cascade classifier (Haar or LBP features) on a gray image.
+    """
+
+    name = "cascade"
+    needs_color = False
+
+    def __init__(self, cascade_file, scale_factor=1.1, min_neighbors=5, min_size=30):
+        self.cascade = cv2.CascadeClassifier(cascade_file)
+        self.params = {
+            "scaleFactor": scale_factor,
+            "minNeighbors": min_neighbors,
+            "minSize": (min_size, min_size),
+        }
+
+    def detect(self, image):
+        """
+        Return [x, y, w, h] boxes for a grayscale image.
+        """
+        return self.cascade.detectMultiScale(image, **self.params)
+
+
+class HaarDetector(CascadeDetector):  # pylint: disable=too-few-public-methods
+    """
+    The original Haar cascade shipped with OpenCV.
+    """
+
+    name = "haar"
+
+    def __init__(self, cascade_file=None, **params):
+        cascade_file = cascade_file or (
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        )
+        super().__init__(cascade_file, **params)
+
+
+class LBPDetector(CascadeDetector):  # pylint: disable=too-few-public-methods
+    """
+    LBP cascade: faster than Haar, somewhat lower recall.
+    """
+
+    name = "lbp"
+
+    def __init__(self, cascade_file=None, model_dir=None, **params):
+        cascade_file = cascade_file or model_path(
+            "lbpcascade_frontalface_improved.xml", model_dir
+        )
+        super().__init__(cascade_file, **params)
+
+
+class SSDDetector:  # pylint: disable=too-few-public-methods
+    """
+    ResNet-10 SSD face detector run through cv2.dnn.
+    """
+
+    name = "ssd"
+    needs_color = True
+
+    def __init__(self, model_dir=None, confidence=0.5, input_size=300):
+        self.net = cv2.dnn.readNetFromCaffe(
+            model_path("deploy.prototxt", model_dir),
+            model_path("res10_300x300_ssd_iter_140000.caffemodel", model_dir),
+        )
+        self.params = {"confidence": confidence, "input_size": input_size}
+
+    def detect(self, image):
+        """
+        Return [x, y, w, h] boxes for a BGR image.
+        """
+        height, width = image.shape[:2]
+        size = self.params["input_size"]
+        blob = cv2.dnn.blobFromImage(
+            cv2.resize(image, (size, size)), 1.0, (size, size), (104.0, 177.0, 123.0)
+        )
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        detections = detections[detections[:, 2] >= self.params["confidence"]]
+        corners = detections[:, 3:7] * np.array([width, height, width, height])
+        return corners_to_boxes(corners, width, height)
+
+
+class YuNetDetector:  # pylint: disable=too-few-public-methods
+    """
+    YuNet ONNX face detector via cv2.FaceDetectorYN.
+    """
+
+    name = "yunet"
+    needs_color = True
+
+    def __init__(
+        self, model_dir=None, score_threshold=0.7, nms_threshold=0.3, top_k=5000
+    ):
+        self.detector = cv2.FaceDetectorYN.create(
+            model_path("face_detection_yunet_2023mar.onnx", model_dir),
+            "",
+            (320, 320),
+            score_threshold,
+            nms_threshold,
+            top_k,
+        )
+        self.params = {
+            "score_threshold": score_threshold,
+            "nms_threshold": nms_threshold,
+            "top_k": top_k,
+        }
+
+    def detect(self, image):
+        """
+        Return [x, y, w, h] boxes for a BGR image.
+        """
+        height, width = image.shape[:2]
+        self.detector.setInputSize((width, height))
+        _, faces = self.detector.detect(image)
+        if faces is None:
+            return NO_FACES
+        corners = faces[:, :4].copy()
+        corners[:, 2:] += corners[:, :2]
+        return corners_to_boxes(corners, width, height)
+
+
+DETECTORS = {
+    "haar": HaarDetector,
+    "lbp": LBPDetector,
+    "ssd": SSDDetector,
+    "yunet": YuNetDetector,
+}
+
+
+def make_face_detector(name=FACE_DETECTOR, **params):
+    """
+    Build a detector backend by name, with ML_FACE_DETECTOR_PARAMS
+    applied when building the configured one.
+    """
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown face detector: {name}")
+    if name == FACE_DETECTOR:
+        params = {**FACE_DETECTOR_PARAMS, **params}
+    return DETECTORS[name](**params)
@@ -0,0 +1,39 @@
+"""
+Production server settings: gunicorn -c gunicorn.conf.py app:app
+
+ML_WORKERS processes (default: one per CPU) each load the model once at
+startup, in the background: /healthz answers at once and /readyz once the
+model is warm. The app is not preloaded in the master because TensorFlow
+is not fork-safe once initialized.
+"""
+
+# pylint: disable=invalid-name,unused-argument
+
+import os
+from admission import max_concurrent_from_env
+from serving import limit_threads, shutdown, threads_per_worker, warm_up
+
+bind = f"0.0.0.0:{os.getenv('ML_PORT', '5001')}"
+workers = int(os.getenv("ML_WORKERS", str(os.cpu_count() or 1)))
+# enough threads for the admitted and queued requests (app.admission) plus
+# two spare to turn the rest away and answer health checks
+_max_concurrent = max_concurrent_from_env()
+_max_queue = int(os.getenv("ML_MAX_QUEUE", "8"))
+threads = int(os.getenv("ML_WORKER_THREADS", str(_max_concurrent + _max_queue + 2)))
+preload_app = False
+timeout = int(os.getenv("ML_WORKER_TIMEOUT", "60"))
+
+
+def post_fork(server, worker):
+    """Give each worker its share of the CPUs before TensorFlow loads."""
+    limit_threads(threads_per_worker(workers))
+
+
+def post_worker_init(worker):
+    """Start warming the model up; the worker serves /healthz meanwhile."""
+    warm_up(background=True)
+
+
+def worker_exit(server, worker):
+    """Save the results still queued for MongoDB before the worker exits."""
+    shutdown()
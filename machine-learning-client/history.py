@@ -0,0 +1,92 @@
+"""
+Per-user analysis history and running emotion totals.
+
+Every analysis made for a signed-in user adds a small entry to "history"
+(read newest first through the (user, created_at, _id) index) and bumps
+the user's document in "user_stats" with $inc, so a dashboard reads one
+document however long the history is.
+"""
+
+import datetime
+from collections import Counter
+
+RECORDED_MESSAGES = ("Image processed", "No faces detected")
+
+
+def utcnow():
+    """Timezone-aware current time."""
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def history_entry(user, response, now):
+    """
+    The history document for one analysis response.
+    """
+    results = response.get("results") or {}
+    return {
+        "user": user,
+        "created_at": now,
+        "result_id": results.get("_id"),
+        "message": response.get("message"),
+        "faces_detected": results.get("faces_detected", 0),
+        "emotions": results.get("emotions", []),
+    }
+
+
+def stats_increments(entries):
+    """
+    $inc fields adding these entries to a user_stats document.
+    """
+    increments = Counter()
+    for entry in entries:
+        increments["analyses"] += 1
+        for scores in entry["emotions"]:
+            increments["faces"] += 1
+            for label, value in scores.items():
+                increments[f"emotion_sums.{label}"] += value
+            if scores:
+                increments[f"dominant.{max(scores, key=scores.get)}"] += 1
+    return dict(increments)
+
+
+class AnalysisHistory:
+    """
+    Writes history entries and keeps user_stats up to date.
+    """
+
+    def __init__(self, database):
+        self.entries = database["history"]
+        self.stats = database["user_stats"]
+        self._indexed = False
+
+    def ensure_indexes(self):
+        """
+        Index for newest-first keyset pages of one user's history.
+        """
+        if not self._indexed:
+            self.entries.create_index([("user", 1), ("created_at", -1), ("_id", -1)])
+            self._indexed = True
+
+    def record(self, user, responses):
+        """
+        Record analysis responses for a user: one insert_many for the
+        entries and one update for the totals. Failed analyses are skipped.
+        """
+        if not user:
+            return 0
+        now = utcnow()
+        entries = [
+            history_entry(user, response, now)
+            for response in responses
+            if response.get("message") in RECORDED_MESSAGES
+        ]
+        if not entries:
+            return 0
+        self.ensure_indexes()
+        self.entries.insert_many(entries)
+        self.stats.update_one(
+            {"_id": user},
+            {"$inc": stats_increments(entries), "$set": {"last_analysis_at": now}},
+            upsert=True,
+        )
+        return len(entries)
@@ -0,0 +1,94 @@
+"""
+Read image dimensions from the file header without decoding pixels,
+and decide from them whether, and at what scale, an image may be decoded.
+"""
+
+import struct
+
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) do not
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# markers without a length field
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG decoders can scale by these factors while decoding
+JPEG_REDUCTION_FACTORS = (1, 2, 4, 8)
+
+
+class ImageTooLarge(Exception):
+    """
+    Raised for an image whose header claims more pixels than allowed.
+    """
+
+    def __init__(self, width, height):
+        super().__init__(f"Image too large ({width}x{height})")
+        self.width = width
+        self.height = height
+
+
+def read_image_header(image_buffer):
+    """
+    Return (format, width, height) for a JPEG or PNG, or None when the
+    header is not recognised.
+    """
+    data = memoryview(image_buffer)
+    if data[:8] == PNG_SIGNATURE:
+        return _read_png(data)
+    if data[:2] == b"\xff\xd8":
+        return _read_jpeg(data)
+    return None
+
+
+def _read_png(data):
+    # the IHDR chunk always comes first: length, "IHDR", width, height
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", data[16:24])
+    return "png", width, height
+
+
+def _read_jpeg(data):
+    offset = 2
+    size = len(data)
+    while offset + 4 <= size:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        (length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > size:
+                return None
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return "jpeg", width, height
+        if marker == 0xDA:  # start of scan: no frame header found before it
+            return None
+        offset += 2 + length
+    return None
+
+
+def required_reduction(header, max_pixels, max_decode_pixels):
+    """
+    Smallest factor the image must be decoded at (1 = full size) so the
+    decoded frame has at most max_decode_pixels pixels. Only JPEGs can be
+    scaled while decoding. Raises ImageTooLarge when the image is over
+    max_pixels, or cannot be brought under max_decode_pixels.
+    A limit of 0 is no limit.
+    """
+    image_format, width, height = header
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(width, height)
+    if not max_decode_pixels:
+        return 1
+    factors = JPEG_REDUCTION_FACTORS if image_format == "jpeg" else (1,)
+    for factor in factors:
+        # the decoder rounds partial blocks up
+        if -(-width // factor) * -(-height // factor) <= max_decode_pixels:
+            return factor
+    raise ImageTooLarge(width, height)
@@ -0,0 +1,116 @@
+"""
+Storage backends for uploaded image bytes.
+
+analysis_results only keeps a reference to the image; the bytes live in
+GridFS or in a local content-addressed folder. Both stores are keyed by
+the SHA-256 of the bytes, so uploading the same image twice stores it once.
+"""
+
+import hashlib
+import os
+import tempfile
+import gridfs
+
+IMAGE_STORE = os.getenv("ML_IMAGE_STORE", "gridfs")
+IMAGE_STORE_DIR = os.getenv("ML_IMAGE_STORE_DIR", "image_store")
+
+
+def image_digest(image_bytes):
+    """
+    SHA-256 hex digest used as the image reference.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class GridFSImageStore:
+    """
+    Keep images in a GridFS bucket, using the digest as the file _id.
+    """
+
+    name = "gridfs"
+
+    def __init__(self, database, bucket="images"):
+        self.fs = gridfs.GridFS(database, collection=bucket)
+
+    def put(self, image_bytes, digest=None):
+        """
+        Store the bytes unless they are already present; return the digest.
+        image_bytes may be any bytes-like object.
+        """
+        digest = digest or image_digest(image_bytes)
+        if not self.fs.exists(digest):
+            try:
+                # GridFS only takes bytes; bytes(bytes) is not a copy
+                self.fs.put(bytes(image_bytes), _id=digest)
+            except gridfs.errors.FileExists:
+                pass  # stored by a concurrent request
+        return digest
+
+    def get(self, digest):
+        """
+        Return the stored bytes.
+        """
+        return self.fs.get(digest).read()
+
+    def exists(self, digest):
+        """
+        Whether an image with this digest is stored.
+        """
+        return self.fs.exists(digest)
+
+
+class LocalImageStore:
+    """
+    Keep images on disk as <root>/<first two hex chars>/<digest>.
+    """
+
+    name = "local"
+
+    def __init__(self, root=IMAGE_STORE_DIR):
+        self.root = root
+
+    def path(self, digest):
+        """
+        Where the image with this digest lives on disk.
+        """
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, image_bytes, digest=None):
+        """
+        Store the bytes unless they are already present; return the digest.
+        """
+        digest = digest or image_digest(image_bytes)
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see half an image
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(image_bytes)
+        os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest):
+        """
+        Return the stored bytes.
+        """
+        with open(self.path(digest), "rb") as image_file:
+            return image_file.read()
+
+    def exists(self, digest):
+        """
+        Whether an image with this digest is stored.
+        """
+        return os.path.exists(self.path(digest))
+
+
+def make_image_store(database, kind=IMAGE_STORE):
+    """
+    Build the store selected by ML_IMAGE_STORE ("gridfs" or "local").
+    """
+    if kind == "local":
+        return LocalImageStore()
+    if kind == "gridfs":
+        return GridFSImageStore(database)
+    raise ValueError(f"Unknown image store: {kind}")
@@ -0,0 +1,38 @@
+"""
+Build expensive objects on first use instead of at import time.
+"""
+
+import threading
+
+
+class Lazy:
+    """
+    Stand-in that calls factory() the first time an attribute is read
+    and forwards every attribute to the result from then on.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """
+        Whether the object has been built yet.
+        """
+        return self._value is not None
+
+    def get(self):
+        """
+        The wrapped object, built on the first call (once, across threads).
+        """
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        # only called for names not found on the Lazy itself
+        return getattr(self.get(), name)
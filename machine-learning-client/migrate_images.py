@@ -0,0 +1,112 @@
+"""
+Move images embedded in analysis_results documents into the image store.
+
+Older documents carry the whole upload in an "image" field (a base64
+string, or BSON binary for raw uploads). This command writes those bytes
+to the configured image store and replaces the field with a reference and
+the image dimensions. Images that are not valid base64 or cannot be
+decoded are skipped and left in place.
+
+Migrated documents get no "faces" boxes: those were never stored with the
+embedded images, and re-running detection could disagree with the saved
+emotions. Pages showing them fall back to the plain thumbnail.
+
+    python migrate_images.py [--batch-size N] [--dry-run]
+"""
+
+# pylint: disable=no-member
+
+import argparse
+import base64
+import binascii
+import os
+import cv2
+import numpy as np
+from pymongo import MongoClient, UpdateOne
+from image_store import make_image_store
+
+
+def image_bytes_from_document(image):
+    """
+    Bytes of an embedded image, whether stored as base64 text or binary.
+    """
+    if isinstance(image, str):
+        # data URLs keep their payload after the comma
+        if image.startswith("data:"):
+            image = image.split(",", 1)[1]
+        return base64.b64decode(image)
+    return bytes(image)
+
+
+def migrate_document(document, store):
+    """
+    Store one document's image and return the $set / $unset update for it,
+    or None when the image cannot be decoded.
+    """
+    try:
+        image_bytes = image_bytes_from_document(document["image"])
+    except binascii.Error:
+        return None
+    frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None
+    height, width = frame.shape[:2]
+    return {
+        "$set": {
+            "image_ref": store.put(image_bytes),
+            "image_store": store.name,
+            "image_width": width,
+            "image_height": height,
+        },
+        "$unset": {"image": ""},
+    }
+
+
+def migrate(collection, store, batch_size=100, dry_run=False):
+    """
+    Migrate every document that still embeds its image.
+    Returns (migrated, skipped) counts.
+    """
+    migrated = skipped = 0
+    updates = []
+    cursor = collection.find(
+        {"image": {"$exists": True}}, {"image": 1}, batch_size=batch_size
+    )
+    for document in cursor:
+        update = migrate_document(document, store) if not dry_run else {}
+        if update is None:
+            skipped += 1
+            continue
+        migrated += 1
+        if dry_run:
+            continue
+        updates.append(UpdateOne({"_id": document["_id"]}, update))
+        if len(updates) >= batch_size:
+            collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    return migrated, skipped
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    db = client["ml_database"]
+    migrated, skipped = migrate(
+        db["analysis_results"],
+        make_image_store(db),
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+    verb = "would migrate" if args.dry_run else "migrated"
+    print(f"{verb} {migrated} documents, skipped {skipped} undecodable images")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,19 +6,104 @@ Machine learning client to process images and detect emotions.
 
 import os
 import base64
+import threading
+import time
+import traceback
 import cv2
 import numpy as np
-from fer import FER
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from admission import check_deadline
+from analytics import pack_columns, public_results
+from emotion_engine import make_emotion_engine
+from face_detectors import make_face_detector, prepare_image
+from history import AnalysisHistory
+from image_header import ImageTooLarge, read_image_header, required_reduction
+from image_store import image_digest, make_image_store
+from lazy import Lazy
+from metrics import FACES_PER_IMAGE, IMAGE_BYTES, STAGE_SECONDS
+from result_cache import ResultCache
+from result_writer import ResultWriter
 
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 client = MongoClient(mongo_uri)
 db = client["ml_database"]
 collection = db["analysis_results"]
+image_store = make_image_store(db)
+analysis_history = AnalysisHistory(db)
 
-emotion_detector = FER()
-face_detector = cv2.CascadeClassifier(
-    cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+
+def make_fer():
+    """
+    Build FER's detector; importing fer imports TensorFlow, so this only
+    happens when a pipeline mode that uses it first needs it.
+    """
+    from fer import FER  # pylint: disable=import-outside-toplevel
+
+    return FER()
+
+
+# Nothing heavy is loaded at import: the emotion models are built on first
+# use or by warm_up(), which sets model_ready when inference works.
+emotion_detector = Lazy(make_fer)
+emotion_engine = make_emotion_engine()
+face_detector = make_face_detector()
+model_ready = threading.Event()
+
+# "batched" crops every Haar box into one tensor for a single model call.
+# "single_pass" hands the Haar boxes to FER's own detect_emotions.
+# "redetect" is the original behaviour where FER re-runs its own face
+# detector on every crop; it is kept so the modes can be benchmarked.
+PIPELINE_MODE = os.getenv("ML_PIPELINE_MODE", "batched")
+
+# Faces are detected on a copy whose longest side is at most this many
+# pixels (0 = full resolution). Large JPEGs are also decoded at 1/2, 1/4
+# or 1/8 scale when the result is still at least this big.
+DETECT_MAX_SIDE = int(os.getenv("ML_DETECT_MAX_SIDE", "1280"))
+
+# /process_batch analyzes this many images per emotion model call and
+# insert_many, so only one chunk of decoded frames is in memory at a time.
+BATCH_CHUNK_SIZE = int(os.getenv("ML_BATCH_CHUNK_SIZE", "16"))
+
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Size guard, checked from the header before any pixel is decoded.
+# Images over ML_MAX_IMAGE_PIXELS are refused. Larger than
+# ML_MAX_DECODE_PIXELS, JPEGs are decoded at 1/2, 1/4 or 1/8 scale and
+# PNGs are refused, which bounds the memory one image can take (about
+# 3 bytes per decoded pixel). Files that are neither JPEG nor PNG are not
+# decoded while the guard is on. 0 turns a limit off.
+MAX_IMAGE_PIXELS = int(os.getenv("ML_MAX_IMAGE_PIXELS", "100000000"))
+MAX_DECODE_PIXELS = int(os.getenv("ML_MAX_DECODE_PIXELS", "24000000"))
+
+# Repeated images are answered from the cache without running the model.
+# The key includes everything below, so changing a setting misses.
+result_cache = ResultCache(
+    collection,
+    params={
+        "detector": face_detector.name,
+        "detector_params": face_detector.params,
+        "model": emotion_engine.model_name,
+        "mode": PIPELINE_MODE,
+        "detect_max_side": DETECT_MAX_SIDE,
+    },
+    maxsize=int(os.getenv("ML_RESULT_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("ML_RESULT_CACHE_TTL", "3600")),
+)
+
+# Results are saved write-behind: ids are assigned here, documents are
+# inserted in batches by a background thread. ML_WRITE_MODE=sync waits
+# for MongoDB to acknowledge every result before answering.
+result_writer = ResultWriter(
+    collection,
+    mode=os.getenv("ML_WRITE_MODE", "write_behind"),
+    max_batch=int(os.getenv("ML_WRITE_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("ML_WRITE_FLUSH_INTERVAL", "0.05")),
+    max_pending=int(os.getenv("ML_WRITE_MAX_PENDING", "10000")),
 )
 
 
@@ -29,26 +114,100 @@ def decode_image(image_data):
     Decode the image from databse
     """
     image_bytes = base64.b64decode(image_data)
-    nparr = np.frombuffer(image_bytes, np.uint8)
+    return decode_image_buffer(image_bytes)
+
+
+def decode_image_buffer(image_buffer):
+    """
+    Decode raw encoded image bytes (bytes, bytearray or memoryview).
+    np.frombuffer wraps the buffer, so nothing is copied before imdecode.
+    """
+    nparr = np.frombuffer(image_buffer, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)  # pylint: disable=no-member
     return img
 
 
-def identify_people(frame):
+@STAGE_SECONDS.timed("decode")
+def decode_image_reduced(image_buffer, min_side=None):
     """
-    Identify faces in the image
+    Decode at the smallest 1/2, 1/4 or 1/8 scale whose longest side is
+    still at least min_side, and at least as small as the size guard
+    requires. For JPEGs the scaling happens inside the decoder, so the
+    full-size image is never materialized.
+    Returns (frame, scale) where scale maps frame pixels to the original;
+    frame is None when the image cannot be decoded. Raises ImageTooLarge
+    for images over the size guard.
     """
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_detector.detectMultiScale(
-        gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
-    )
+    min_side = DETECT_MAX_SIDE if min_side is None else min_side
+    guarded = bool(MAX_IMAGE_PIXELS or MAX_DECODE_PIXELS)
+    header = read_image_header(image_buffer) if min_side or guarded else None
+    if header is None and guarded:
+        return None, 1.0
+    flag, original_side = cv2.IMREAD_COLOR, None
+    if header is not None:
+        original_side = max(header[1], header[2])
+        required = required_reduction(header, MAX_IMAGE_PIXELS, MAX_DECODE_PIXELS)
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if factor == required or (min_side and original_side / factor >= min_side):
+                flag = reduced_flag
+                break
+
+    nparr = np.frombuffer(image_buffer, np.uint8)
+    frame = cv2.imdecode(nparr, flag)
+    if frame is None or flag == cv2.IMREAD_COLOR:
+        return frame, 1.0
+    return frame, original_side / max(frame.shape[:2])
+
+
+@STAGE_SECONDS.timed("detect")
+def identify_people(frame, max_side=None):
+    """
+    Identify faces in the image.
+    Detection runs on a copy no larger than max_side; the boxes are
+    returned in the coordinates of frame.
+    """
+    max_side = DETECT_MAX_SIDE if max_side is None else max_side
+    image, scale = prepare_image(face_detector, frame, max_side)
+    faces = face_detector.detect(image)
+    if scale > 1.0 and len(faces) > 0:
+        faces = np.round(np.asarray(faces) * scale).astype(np.int32)
     return faces
 
 
-def recognize_emotions(frame, faces):
+@STAGE_SECONDS.timed("emotions")
+def recognize_emotions(frame, faces, mode=None):
     """
     Recognize emotions for each face.
     """
+    mode = mode or PIPELINE_MODE
+    if mode == "redetect":
+        return _recognize_emotions_redetect(frame, faces)
+
+    if len(faces) == 0:
+        return []
+    if mode == "batched":
+        return emotion_engine.predict(frame, faces)
+    # faces were already found by identify_people, so skip FER's detector
+    detections = emotion_detector.detect_emotions(frame, face_rectangles=faces)
+    return [detection["emotions"] for detection in detections]
+
+
+@STAGE_SECONDS.timed("emotions")
+def recognize_emotions_many(items, mode=None):
+    """
+    Recognize emotions for the faces of several (frame, faces) pairs.
+    The batched mode classifies all of them with one model call.
+    """
+    mode = mode or PIPELINE_MODE
+    if mode == "batched":
+        return emotion_engine.predict_many(items)
+    return [recognize_emotions(frame, faces, mode) for frame, faces in items]
+
+
+def _recognize_emotions_redetect(frame, faces):
+    """
+    Recognize emotions by letting FER detect a face again inside each crop.
+    """
     emotions_list = []
     for x, y, w, h in faces:  # pylint: disable=invalid-name
         face_image = frame[y : y + h, x : x + w]
@@ -58,36 +217,268 @@ def recognize_emotions(frame, faces):
     return emotions_list
 
 
-def process_image(image_data):
+def warm_up():
+    """
+    Run detection and one emotion inference on a blank frame so the first
+    real request does not pay for building the model's predict function.
+    """
+    frame = np.zeros((96, 96, 3), dtype=np.uint8)
+    identify_people(frame)
+    recognize_emotions(frame, np.array([[16, 16, 64, 64]]))
+    model_ready.set()
+
+
+def ensure_indexes(retry_interval=5.0):
+    """
+    Create the result cache's index, retrying until MongoDB is up, so no
+    request ever waits for it.
+    """
+    while True:
+        try:
+            result_cache.ensure_index()
+            return
+        except PyMongoError as error:
+            print(f" * Could not create indexes yet: {error}")
+            time.sleep(retry_interval)
+
+
+def start_warm_up():
+    """
+    Run warm_up() in a background thread so the server can answer
+    /healthz while the model loads, and ensure_indexes() in another.
+    Returns the warm-up thread.
+    """
+
+    def run():
+        try:
+            warm_up()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # stay not ready; /readyz keeps reporting the model as down
+            traceback.print_exc()
+
+    threading.Thread(target=ensure_indexes, name="indexes", daemon=True).start()
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def shutdown(timeout=10.0):
+    """
+    Save the results still queued by result_writer; call before exiting.
+    """
+    if not result_writer.close(timeout):
+        print(" * Results were still queued when shutdown timed out")
+
+
+def database_reachable():
+    """
+    Whether the MongoDB client has found a readable server. Reads the
+    state kept by pymongo's background monitor, so it never blocks.
+    """
+    return client.topology_description.has_readable_server()
+
+
+def readiness():
+    """
+    Return (ready, checks): the model is warm and MongoDB is reachable.
+    """
+    checks = {"model": model_ready.is_set(), "database": database_reachable()}
+    return all(checks.values()), checks
+
+
+def process_image(image_data, user=None, deadline=None):
     """
     Processes the incoming image:
     1. Decodes the image.
     2. Identify faces in the image.
     3. Recognize emotions for each detected face.
     """
-    # Decode the image
-    frame = decode_image(image_data)
+    with STAGE_SECONDS.time("base64_decode"):
+        image_bytes = base64.b64decode(image_data)
+    return process_image_bytes(image_bytes, user, deadline)
+
+
+def process_image_bytes(image_buffer, user=None, deadline=None):
+    """
+    Same as process_image for a raw (not base64) image body.
+    Images seen before are answered from result_cache. When user is
+    given the analysis is added to their history. Raises
+    DeadlineExceeded rather than start a stage after the deadline
+    (a time.monotonic() value), and ImageTooLarge for images refused
+    by the size guard.
+    """
+    IMAGE_BYTES.observe(len(image_buffer))
+    with STAGE_SECONDS.time("cache_lookup"):
+        # hashlib reads the buffer in place; only a stored image is copied
+        digest = image_digest(image_buffer)
+        response = result_cache.get(digest)
+    if response is None:
+        frame, scale = decode_image_reduced(image_buffer)
+        response = analyze_frame(frame, image_buffer, digest, scale, deadline)
+        result_cache.put(digest, response)
+    record_history(user, [response])
+    return response
+
+
+def record_history(user, responses):
+    """
+    Add analyses to a user's history (nothing for anonymous requests).
+    The write is queued on result_writer, so the request does not wait.
+    """
+    if user:
+        result_writer.defer(save_history, user, list(responses))
+
+
+def save_history(user, responses):
+    """
+    Write history entries and totals. The results are already saved, so
+    a failed history write is logged rather than raised.
+    """
+    with STAGE_SECONDS.time("history"):
+        try:
+            analysis_history.record(user, responses)
+        except PyMongoError as error:
+            print(f" * Could not record history for {user}: {error}")
+
+
+def analyze_frame(frame, image_bytes, digest=None, scale=1.0, deadline=None):
+    """
+    Find faces and emotions in a decoded frame and save the results.
+    The image bytes go to image_store; the result only keeps a reference.
+    scale maps frame pixels back to the original image (reduced decode).
+    """
     if frame is None:
         return {"message": "Failed to decode image"}
 
     # identify faces
+    check_deadline(deadline)
     faces = identify_people(frame)
+    FACES_PER_IMAGE.observe(len(faces))
     # if not faces:
     if len(faces) == 0:
         return {"message": "No faces detected"}
 
     # Recognize emotions
+    check_deadline(deadline)
     emotions = recognize_emotions(frame, faces)
 
     # Save results to MongoDB
-    results = {
-        "faces_detected": len(faces),
-        "emotions": emotions,
-        "image": image_data,
-    }
-    collection.insert_one(results)
-    results["_id"] = str(results["_id"])
+    results = build_results(frame, faces, emotions, image_bytes, digest, scale)
+    with STAGE_SECONDS.time("persist"):
+        result_id = result_writer.save(results)
+    # the saved document may still be queued; answer with a copy
     return {
         "message": "Image processed",
-        "results": results,
+        "results": {**public_results(results), "_id": str(result_id)},
     }
+
+
+def build_results(
+    frame, faces, emotions, image_bytes, digest=None, scale=1.0
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    The analysis_results document for one image; queues the image bytes
+    for image_store, which keys them by digest.
+    Scores and boxes are also kept as binary matrices (analytics.py).
+    """
+    digest = digest or image_digest(image_bytes)
+    height, width = (round(side * scale) for side in frame.shape[:2])
+    result_writer.defer(store_image, image_bytes, digest)
+    boxes = [[round(int(value) * scale) for value in box] for box in faces]
+    return {
+        "faces_detected": len(faces),
+        "emotions": emotions,
+        "faces": boxes,
+        **pack_columns(emotions, boxes),
+        "image_ref": digest,
+        "image_store": image_store.name,
+        "image_width": width,
+        "image_height": height,
+        "cache_key": result_cache.key(digest),
+    }
+
+
+def store_image(image_bytes, digest):
+    """
+    Save image bytes under their digest.
+    """
+    with STAGE_SECONDS.time("store_image"):
+        image_store.put(image_bytes, digest)
+
+
+def process_images_bytes(image_buffers, chunk_size=None, user=None, deadline=None):
+    """
+    Like process_image_bytes for many images; yields one response per
+    image, in order. Images are analyzed chunk_size at a time with one
+    emotion model call and one insert_many per chunk.
+    """
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    chunk = []
+    for image_buffer in image_buffers:
+        chunk.append(image_buffer)
+        if len(chunk) == chunk_size:
+            yield from _process_chunk(chunk, user, deadline)
+            chunk = []
+    if chunk:
+        yield from _process_chunk(chunk, user, deadline)
+
+
+def _process_chunk(image_buffers, user=None, deadline=None):
+    """
+    Analyze a chunk of images, answering repeats from result_cache.
+    """
+    responses, pending = [], []
+    for image_buffer in image_buffers:
+        IMAGE_BYTES.observe(len(image_buffer))
+        with STAGE_SECONDS.time("cache_lookup"):
+            digest = image_digest(image_buffer)
+            response = result_cache.get(digest)
+        if response is None:
+            check_deadline(deadline)
+            try:
+                frame, scale = decode_image_reduced(image_buffer)
+            except ImageTooLarge as error:
+                responses.append({"message": str(error)})
+                continue
+            faces = identify_people(frame) if frame is not None else []
+            if frame is not None:
+                FACES_PER_IMAGE.observe(len(faces))
+            if frame is None:
+                response = {"message": "Failed to decode image"}
+            elif len(faces) == 0:
+                response = {"message": "No faces detected"}
+            else:
+                pending.append(
+                    (len(responses), frame, faces, image_buffer, digest, scale)
+                )
+            if response is not None:
+                result_cache.put(digest, response)
+        responses.append(response)
+
+    if pending:
+        check_deadline(deadline)
+        _save_chunk(pending, responses)
+    record_history(user, responses)
+    return responses
+
+
+def _save_chunk(pending, responses):
+    """
+    Classify the faces of every pending image at once and hand all the
+    documents to result_writer together.
+    """
+    emotions = recognize_emotions_many([(item[1], item[2]) for item in pending])
+    documents = [
+        build_results(frame, faces, face_emotions, image_bytes, digest, scale)
+        for (_, frame, faces, image_bytes, digest, scale), face_emotions in zip(
+            pending, emotions
+        )
+    ]
+    with STAGE_SECONDS.time("persist"):
+        ids = result_writer.save_many(documents)
+    for (index, _, _, _, digest, _), results, result_id in zip(pending, documents, ids):
+        responses[index] = {
+            "message": "Image processed",
+            "results": {**public_results(results), "_id": str(result_id)},
+        }
+        result_cache.put(digest, responses[index])
@@ -0,0 +1,227 @@
+"""
+On-demand sampling profiler for a live worker.
+
+Nothing runs until an admin asks for a profile. A profile starts one
+daemon thread that wakes every interval, reads every other thread's
+stack with sys._current_frames() and counts it; the threads being
+profiled are never traced or slowed down, so the overhead is the
+sampler's own CPU time. The session ends after a number of seconds or
+once a number of requests have finished, whichever comes first, and
+the counts come back in the collapsed-stack format flamegraph.pl and
+speedscope read ("root;caller;callee count" per line).
+
+With memory=True, tracemalloc runs for the same window and the result
+also lists the source lines whose allocations grew the most. tracemalloc
+slows every allocation while it runs, so it is only on when asked for.
+
+Only one profile runs at a time in a process; each gunicorn worker
+profiles itself.
+"""
+
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+MAX_SECONDS = 120.0
+MIN_INTERVAL = 0.001
+MEMORY_FRAMES = 16
+MEMORY_TOP = 25
+
+
+def admin_authorized(authorization, token):
+    """
+    Whether an Authorization header carries the admin token as a bearer
+    token. Always False when no token is configured.
+    """
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when a profile is requested while another one is running.
+    """
+
+    def __init__(self):
+        super().__init__("A profile is already running")
+
+
+def frame_label(frame):
+    """
+    "function (file.py:line)" for the function a frame is running.
+    """
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def collapse_stack(frame, thread_name):
+    """
+    The stack of a frame as one collapsed line, root first.
+    """
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class ProfileSession:  # pylint: disable=too-many-instance-attributes
+    """
+    One bounded profile: sample stacks until the time or request budget
+    is spent.
+    """
+
+    def __init__(self, seconds, max_requests=0, interval=0.005, memory=False):
+        self.seconds = min(max(seconds, 0.0), MAX_SECONDS)
+        self.max_requests = max_requests
+        self.interval = max(interval, MIN_INTERVAL)
+        self.memory = memory
+        self.stacks = Counter()
+        self.samples = 0
+        self.requests = 0
+        self.done = threading.Event()
+        self.started = None
+        self.elapsed = 0.0
+        self._skip = set()
+        self._owns_tracemalloc = False
+        self._snapshot = None
+        self._memory_diff = []
+        self._lock = threading.Lock()
+
+    def request_finished(self):
+        """
+        Count a finished request; ends the session at max_requests.
+        """
+        with self._lock:
+            self.requests += 1
+            if self.max_requests and self.requests >= self.max_requests:
+                self.done.set()
+
+    def run(self, caller=None):
+        """
+        Sample until done, in the calling thread. caller is the ident of
+        a thread to leave out (the one waiting for the result).
+        """
+        self._skip = {threading.get_ident(), caller}
+        names = {}
+        if self.memory:
+            self._start_memory()
+        self.started = time.monotonic()
+        deadline = self.started + self.seconds
+        try:
+            while not self.done.is_set() and time.monotonic() < deadline:
+                self._sample(names)
+                self.done.wait(self.interval)
+        finally:
+            self.elapsed = time.monotonic() - self.started
+            if self.memory:
+                self._stop_memory()
+            self.done.set()
+
+    def _sample(self, names):
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        if len(names) != len(frames):
+            names.clear()
+            names.update(
+                (thread.ident, thread.name) for thread in threading.enumerate()
+            )
+        for ident, frame in frames.items():
+            if ident not in self._skip:
+                self.stacks[collapse_stack(frame, names.get(ident, str(ident)))] += 1
+        self.samples += 1
+
+    def _start_memory(self):
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start(MEMORY_FRAMES)
+        self._snapshot = tracemalloc.take_snapshot()
+
+    def _stop_memory(self):
+        snapshot = tracemalloc.take_snapshot()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = snapshot.filter_traces(ignore).compare_to(
+            self._snapshot.filter_traces(ignore), "lineno"
+        )
+        self._memory_diff = [
+            {
+                "where": str(stat.traceback[0]),
+                "size_diff": stat.size_diff,
+                "size": stat.size,
+                "count_diff": stat.count_diff,
+            }
+            for stat in stats[:MEMORY_TOP]
+            if stat.size_diff
+        ]
+        self._snapshot = None
+
+    def collapsed(self):
+        """
+        Collapsed stacks, one "frames count" line each, busiest first.
+        """
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def result(self):
+        """
+        Summary with the collapsed stacks and, if asked for, the memory diff.
+        """
+        result = {
+            "seconds": round(self.elapsed, 3),
+            "samples": self.samples,
+            "requests": self.requests,
+            "interval_ms": self.interval * 1000,
+            "collapsed": self.collapsed(),
+        }
+        if self.memory:
+            result["memory_diff"] = self._memory_diff
+        return result
+
+
+class Profiler:
+    """
+    Runs at most one ProfileSession at a time for this process.
+    """
+
+    def __init__(self):
+        self.session = None
+        self._lock = threading.Lock()
+
+    def request_finished(self):
+        """
+        Hook for the end of every request; a no-op while not profiling.
+        """
+        session = self.session
+        if session is not None:
+            session.request_finished()
+
+    def profile(self, seconds, max_requests=0, interval=0.005, memory=False):
+        """
+        Profile this process and return the finished ProfileSession.
+        Blocks for up to seconds; raises ProfilerBusy if one is running.
+        """
+        session = ProfileSession(seconds, max_requests, interval, memory)
+        with self._lock:
+            if self.session is not None:
+                raise ProfilerBusy()
+            self.session = session
+        caller = threading.get_ident()
+        sampler = threading.Thread(
+            target=session.run, args=(caller,), name="profiler", daemon=True
+        )
+        try:
+            sampler.start()
+            sampler.join()
+        finally:
+            self.session = None
+        return session
@@ -0,0 +1,95 @@
+"""
+Result cache for repeated images.
+
+Results are keyed by the SHA-256 of the image bytes plus a fingerprint of
+the detector/model settings, so changing a setting never serves stale
+results. Lookups go to an in-process LRU first and then to the indexed
+cache_key field of analysis_results.
+"""
+
+import hashlib
+import json
+import threading
+from analytics import COLUMNAR_FIELDS
+from lru_cache import LRUCache
+
+# the binary analytics columns are not part of a response
+RESPONSE_PROJECTION = {field: 0 for field in COLUMNAR_FIELDS}
+
+
+def params_fingerprint(params):
+    """
+    Short stable hash of the settings that influence a result.
+    """
+    encoded = json.dumps(params, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Two-tier (memory, then MongoDB) cache of /process responses.
+    """
+
+    def __init__(self, collection, params, maxsize=1024, ttl=3600.0):
+        self.collection = collection
+        self.fingerprint = params_fingerprint(params)
+        self.memory = LRUCache(maxsize, ttl)
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+        self._counter_lock = threading.Lock()
+
+    def key(self, digest):
+        """
+        Cache key for an image digest under the current settings.
+        """
+        return f"{digest}:{self.fingerprint}"
+
+    def _count(self, name):
+        with self._counter_lock:
+            self.counters[name] += 1
+
+    def ensure_index(self):
+        """
+        Index cache_key. Run once at startup; lookups never create it.
+        """
+        self.collection.create_index("cache_key")
+
+    def get(self, digest):
+        """
+        Return the cached response for an image, or None.
+        """
+        key = self.key(digest)
+        response = self.memory.get(key)
+        if response is not None:
+            self._count("memory_hits")
+            return response
+
+        document = self.collection.find_one({"cache_key": key}, RESPONSE_PROJECTION)
+        if document is None:
+            self._count("misses")
+            return None
+
+        document["_id"] = str(document["_id"])
+        response = {"message": "Image processed", "results": document}
+        self.memory.put(key, response)
+        self._count("db_hits")
+        return response
+
+    def put(self, digest, response):
+        """
+        Remember a response in memory. Stored results are found in MongoDB
+        through their cache_key, so only the memory tier is written here.
+        """
+        self.memory.put(self.key(digest), response)
+
+    def stats(self):
+        """
+        Hit/miss counters plus the current memory tier size.
+        """
+        with self._counter_lock:
+            stats = dict(self.counters)
+        lookups = sum(stats.values())
+        hits = stats["memory_hits"] + stats["db_hits"]
+        stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        stats["fingerprint"] = self.fingerprint
+        return stats
@@ -0,0 +1,227 @@
+"""
+Write-behind persistence of analysis results.
+
+Result documents get their ObjectId here, in the process, so a response
+can carry the id before MongoDB has seen the document. In write_behind
+mode documents go into a bounded queue and a background thread saves
+them with insert_many once max_batch are waiting or flush_interval has
+passed since the first one; a full queue blocks the caller rather than
+growing without bound. In sync mode every save is inserted and
+acknowledged before it returns, for deployments that cannot lose a
+result to a crash.
+
+Because ids are assigned up front a retried insert_many is idempotent:
+documents that made it the first time fail with a duplicate key error,
+which is ignored.
+
+The other writes a request causes (storing the image, the user's history
+and totals) go through the same queue with defer(), so a request only
+enqueues. Deferred calls run before the documents batched with them,
+which keeps an image stored before the result that refers to it. They are
+not all idempotent, so a failed call is logged and counted, not retried.
+"""
+
+import queue
+import threading
+import time
+import traceback
+from collections import namedtuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+from metrics import STAGE_SECONDS
+
+SYNC = "sync"
+WRITE_BEHIND = "write_behind"
+WRITE_MODES = (SYNC, WRITE_BEHIND)
+DUPLICATE_KEY = 11000
+
+_STOP = object()
+_Deferred = namedtuple("_Deferred", ["function", "args"])
+
+
+class ResultWriter:  # pylint: disable=too-many-instance-attributes
+    """
+    Saves result documents to a collection, synchronously or write-behind.
+    """
+
+    def __init__(
+        self,
+        collection,
+        mode=WRITE_BEHIND,
+        max_batch=100,
+        flush_interval=0.05,
+        max_pending=10000,
+        retries=3,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {mode}")
+        self.collection = collection
+        self.mode = mode
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def save(self, document):
+        """
+        Save one document and return its id.
+        """
+        document.setdefault("_id", ObjectId())
+        if self._writes_through():
+            self.collection.insert_one(document)
+            self.written += 1
+        else:
+            self._queue.put(document)
+        return document["_id"]
+
+    def save_many(self, documents):
+        """
+        Save several documents and return their ids, in order.
+        """
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+        if self._writes_through():
+            self.collection.insert_many(documents)
+            self.written += len(documents)
+        else:
+            for document in documents:
+                self._queue.put(document)
+        return [document["_id"] for document in documents]
+
+    def defer(self, function, *args):
+        """
+        Call function(*args) on the writer thread, or right away in sync
+        mode. For writes a response does not have to wait for.
+        """
+        if self._writes_through():
+            function(*args)
+        else:
+            self._queue.put(_Deferred(function, args))
+
+    def _writes_through(self):
+        """
+        True when saves go straight to MongoDB: sync mode, or after close()
+        so late writes during shutdown are not left in a dead queue.
+        """
+        if self.mode == SYNC or self._closed:
+            return True
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="result-writer", daemon=True
+                    )
+                    self._thread.start()
+        return False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                stopping = True
+            for item in batch:
+                if isinstance(item, _Deferred):
+                    self._call(item)
+            documents = [
+                item
+                for item in batch
+                if item is not _STOP and not isinstance(item, _Deferred)
+            ]
+            if documents:
+                self._write(documents)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, documents):
+        """
+        insert_many with retries; documents that still fail are counted
+        and dropped so one bad batch cannot stall the queue.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with STAGE_SECONDS.time("insert"):
+                    self.collection.insert_many(documents, ordered=False)
+                break
+            except BulkWriteError as error:
+                errors = error.details.get("writeErrors", [])
+                if all(item.get("code") == DUPLICATE_KEY for item in errors):
+                    break  # saved by an earlier attempt
+                if attempt == self.retries:
+                    self._drop(documents, error)
+                    return
+            except PyMongoError as error:
+                if attempt == self.retries:
+                    self._drop(documents, error)
+                    return
+            time.sleep(min(2.0, 0.1 * 2**attempt))
+        self.written += len(documents)
+        self.batches += 1
+
+    def _call(self, deferred):
+        try:
+            deferred.function(*deferred.args)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # the writer thread must outlive any one bad call
+            self.failed += 1
+            print(f" * Deferred {deferred.function.__name__} failed: {error}")
+            traceback.print_exc()
+
+    def _drop(self, documents, error):
+        self.failed += len(documents)
+        print(f" * Dropped {len(documents)} results: {error}")
+        traceback.print_exc()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued document has been written (or dropped)
+        and every deferred call has run.
+        Returns False if timeout seconds passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """
+        Drain the queue and stop the background thread; later saves are
+        written synchronously. Returns False if the drain timed out.
+        """
+        self._closed = True
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def stats(self):
+        """
+        Counters for /writer/stats.
+        """
+        return {
+            "mode": self.mode,
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
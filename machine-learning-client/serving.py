@@ -0,0 +1,51 @@
+"""
+Helpers for running the ML service as a pool of worker processes.
+
+gunicorn.conf.py uses these hooks: every worker caps its TensorFlow/OpenCV
+thread pools to its share of the CPUs, imports the app (which is cheap:
+nothing heavy loads at import) and loads the model with a warm-up
+inference in a background thread. /readyz answers 503 until that is done.
+"""
+
+import os
+import cv2
+
+
+def threads_per_worker(workers, cpus=None):
+    """
+    CPU threads each worker may use so the pool does not oversubscribe.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    return max(1, cpus // max(1, workers))
+
+
+def limit_threads(threads):
+    """
+    Cap the thread pools of TensorFlow, OpenMP and OpenCV.
+    Must run before TensorFlow is imported in this process.
+    """
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    cv2.setNumThreads(threads)  # pylint: disable=no-member
+
+
+def warm_up(background=False):
+    """
+    Load the model in this process and run one throwaway inference,
+    in a background thread when background is set.
+    """
+    import ml_client  # pylint: disable=import-outside-toplevel
+
+    if background:
+        return ml_client.start_warm_up()
+    return ml_client.warm_up()
+
+
+def shutdown():
+    """
+    Drain the results this process still has queued for MongoDB.
+    """
+    import ml_client  # pylint: disable=import-outside-toplevel
+
+    ml_client.shutdown()
@@ -0,0 +1,150 @@
+"""Test module for admission control and deadlines."""
+
+# pylint: disable=redefined-outer-name
+
+import threading
+import time
+from unittest.mock import patch
+import pytest
+
+import app as ml_app
+from admission import (
+    MICROBATCH_CONCURRENCY,
+    AdmissionController,
+    DeadlineExceeded,
+    Overloaded,
+    check_deadline,
+    deadline_from_header,
+    max_concurrent_from_env,
+)
+from ml_client import process_image_bytes
+
+
+@pytest.fixture
+def client():
+    """Flask test client."""
+    return ml_app.app.test_client()
+
+
+def test_deadline_from_header():
+    """Test the remaining budget becomes a local monotonic deadline."""
+    assert deadline_from_header("1500", now=10.0) == 11.5
+    assert deadline_from_header(None) is None
+    assert deadline_from_header("soon") is None
+
+
+def test_check_deadline():
+    """Test only a passed deadline raises."""
+    check_deadline(None)
+    check_deadline(time.monotonic() + 10)
+    with pytest.raises(DeadlineExceeded):
+        check_deadline(time.monotonic() - 0.001)
+
+
+def test_admission_rejects_when_queue_full():
+    """Test requests beyond the concurrency limit and queue are shed at once."""
+    admission = AdmissionController(max_concurrent=1, max_queue=0, retry_after=3)
+    admission.acquire()
+    with pytest.raises(Overloaded) as error:
+        admission.acquire()
+    assert error.value.retry_after == 3
+    admission.release()
+    admission.acquire()
+    assert admission.stats()["rejected"] == 1
+
+
+def test_admission_queued_request_gets_freed_slot():
+    """Test a queued request runs as soon as a slot is released."""
+    admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+    admission.acquire()
+    admitted = threading.Event()
+
+    def queued():
+        admission.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=queued)
+    thread.start()
+    time.sleep(0.05)
+    assert admission.stats()["waiting"] == 1
+    assert not admitted.is_set()
+    admission.release()
+    thread.join(timeout=2)
+    assert admitted.is_set()
+    assert admission.stats()["running"] == 1
+
+
+def test_admission_queue_timeout_and_deadline():
+    """Test waiting ends with 503 at queue_timeout, or DeadlineExceeded first."""
+    admission = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout=0.05)
+    admission.acquire()
+    with pytest.raises(Overloaded):
+        admission.acquire()
+    with pytest.raises(DeadlineExceeded):
+        admission.acquire(deadline=time.monotonic() + 0.01)
+    stats = admission.stats()
+    assert (stats["rejected"], stats["expired"], stats["waiting"]) == (1, 1, 0)
+
+
+def test_process_api_sheds_load(client):
+    """Test /process answers 503 with Retry-After when the worker is full."""
+    admission = AdmissionController(max_concurrent=1, max_queue=0, retry_after=2)
+    admission.acquire()
+    with patch.object(ml_app, "admission", admission), patch(
+        "app.process_image_bytes"
+    ) as process:
+        response = client.post("/process", data=b"jpeg", content_type="image/jpeg")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    process.assert_not_called()
+
+
+def test_process_api_releases_slot(client):
+    """Test the slot is given back after the request, even when it fails."""
+    admission = AdmissionController(max_concurrent=1, max_queue=0)
+    with patch.object(ml_app, "admission", admission), patch(
+        "app.process_image_bytes", return_value={"message": "No faces detected"}
+    ):
+        for _ in range(2):
+            response = client.post("/process", data=b"jpg", content_type="image/jpeg")
+            assert response.status_code == 200
+    assert admission.stats()["running"] == 0
+
+
+def test_expired_deadline_skips_pipeline(client):
+    """Test a request whose deadline already passed is dropped before any work."""
+    with patch("app.process_image_bytes") as process:
+        response = client.post(
+            "/process",
+            data=b"jpeg",
+            content_type="image/jpeg",
+            headers={"X-Deadline-Ms": "0"},
+        )
+    assert response.status_code == 504
+    process.assert_not_called()
+
+
+def test_deadline_checked_before_detection():
+    """Test a deadline that passes after decoding stops before detection."""
+    with patch("ml_client.result_cache") as cache, patch(
+        "ml_client.decode_image_reduced", return_value=("frame", 1.0)
+    ), patch("ml_client.identify_people") as identify:
+        cache.get.return_value = None
+        with pytest.raises(DeadlineExceeded):
+            process_image_bytes(b"jpeg", deadline=time.monotonic() - 1)
+    identify.assert_not_called()
+
+
+def test_max_concurrent_from_env(capsys):
+    """Test micro-batching raises the default limit and warns about 1."""
+    assert max_concurrent_from_env({}) == 1
+    assert max_concurrent_from_env({"ML_MICROBATCH_WINDOW_MS": "5"}) == (
+        MICROBATCH_CONCURRENCY
+    )
+    assert max_concurrent_from_env({"ML_MAX_CONCURRENT": "2"}) == 2
+    assert "ML_MICROBATCH" not in capsys.readouterr().out
+    limit = max_concurrent_from_env(
+        {"ML_MICROBATCH_WINDOW_MS": "5", "ML_MAX_CONCURRENT": "1"}
+    )
+    assert limit == 1
+    assert "ML_MICROBATCH_WINDOW_MS" in capsys.readouterr().out
@@ -0,0 +1,230 @@
+"""Test module for columnar emotion data, analytics and exports."""
+
+# pylint: disable=redefined-outer-name
+
+import csv
+import datetime
+import io
+import json
+from unittest.mock import MagicMock, patch
+import numpy as np
+import pytest
+from bson import ObjectId
+
+import app as ml_app
+from analytics import (
+    EMOTION_VECTORS,
+    EXPORT_COLUMNS,
+    EmotionSummary,
+    FaceBatch,
+    TooManyBuckets,
+    face_batches,
+    export_csv,
+    export_ndjson,
+    pack_columns,
+    public_results,
+    summarize,
+    time_query,
+    unpack_columns,
+)
+from emotion_engine import EMOTION_LABELS
+
+T0 = datetime.datetime(2024, 11, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def result(minutes, emotions, faces=None):
+    """A stored result made at T0 + minutes, with its binary columns."""
+    faces = (
+        faces if faces is not None else [[i, i, 10, 10] for i in range(len(emotions))]
+    )
+    object_id = ObjectId.from_datetime(T0 + datetime.timedelta(minutes=minutes))
+    return {
+        "_id": object_id,
+        "emotions": emotions,
+        "faces": faces,
+        **pack_columns(emotions, faces),
+    }
+
+
+def collection_of(documents, consumed=None):
+    """
+    Mock collection whose find().sort() iterates the documents matching
+    the emotion_vectors $exists filter lazily.
+    """
+
+    def cursor(matching):
+        for document in matching:
+            if consumed is not None:
+                consumed.append(document["_id"])
+            yield document
+
+    def find(query, *_args, **_kwargs):
+        columnar = query[EMOTION_VECTORS]["$exists"]
+        matching = [
+            document
+            for document in documents
+            if (EMOTION_VECTORS in document) == columnar
+        ]
+        found = MagicMock()
+        found.sort.side_effect = lambda *args: cursor(matching)
+        return found
+
+    collection = MagicMock()
+    collection.find.side_effect = find
+    return collection
+
+
+@pytest.fixture
+def documents():
+    """Three results over two hours: two faces, one face, no faces."""
+    return [
+        result(0, [{"happy": 0.9, "sad": 0.1}, {"angry": 0.6, "neutral": 0.4}]),
+        result(30, [{"happy": 0.7, "surprise": 0.3}]),
+        result(70, []),
+    ]
+
+
+def test_columns_round_trip():
+    """Test scores and boxes come back as float32/int32 matrices in label order."""
+    document = result(0, [{"happy": 0.75, "sad": 0.25}], [[1, 2, 3, 4]])
+    scores, boxes = unpack_columns(document)
+    assert scores.dtype == np.float32
+    assert scores.tolist() == [[0, 0, 0, 0.75, 0.25, 0, 0]]
+    assert boxes.tolist() == [[1, 2, 3, 4]]
+
+
+def test_legacy_results_use_dicts():
+    """Test results saved before the columns existed are still read."""
+    scores, boxes = unpack_columns(
+        {"emotions": [{"neutral": 1.0}], "faces": [[5, 6, 7, 8]]}
+    )
+    assert scores.tolist() == [[0, 0, 0, 0, 0, 0, 1.0]]
+    assert boxes.tolist() == [[5, 6, 7, 8]]
+
+
+def test_public_results_drop_binary():
+    """Test responses never carry the binary columns."""
+    document = result(0, [{"happy": 1.0}])
+    assert set(public_results(document)) == {"_id", "emotions", "faces"}
+
+
+def test_face_batch_indexes(documents):
+    """Test per-face arrays point back at their result and position."""
+    batch = FaceBatch(documents)
+    assert batch.results == 3
+    assert batch.result_index.tolist() == [0, 0, 1]
+    assert batch.face_index.tolist() == [0, 1, 0]
+    assert batch.scores.shape == (3, 7)
+
+
+def test_time_query():
+    """Test time ranges become _id ranges."""
+    assert not time_query()
+    query = time_query(T0, T0 + datetime.timedelta(hours=1))
+    assert query["_id"]["$gte"].generation_time == T0
+    assert query["_id"]["$lt"] == ObjectId.from_datetime(
+        T0 + datetime.timedelta(hours=1)
+    )
+
+
+def test_summarize(documents):
+    """Test means, distributions, dominant counts and hourly trends."""
+    collection = collection_of(documents)
+    summary = summarize(collection, bucket_seconds=3600, batch_size=2)
+
+    assert collection.find.call_args[1] == {"batch_size": 2}
+    assert (summary["results"], summary["faces"]) == (3, 3)
+    assert summary["mean"]["happy"] == pytest.approx((0.9 + 0.7) / 3, abs=1e-4)
+    assert summary["dominant"]["happy"] == 2
+    assert summary["dominant"]["angry"] == 1
+    assert summary["distribution"]["counts"]["happy"][9] == 1
+    assert summary["distribution"]["counts"]["happy"][7] == 1
+    assert sum(summary["distribution"]["counts"]["sad"]) == 3
+    assert [(bucket["start"], bucket["faces"]) for bucket in summary["trend"]] == [
+        (T0.isoformat(), 3)
+    ]
+    assert summary["trend"][0]["mean"]["happy"] == pytest.approx(0.5333, abs=1e-4)
+
+
+def test_face_batches_read_dicts_only_for_legacy_results(documents):
+    """Test columnar results ship no dicts and legacy ones merge in by time."""
+    legacy = {
+        "_id": ObjectId.from_datetime(T0 + datetime.timedelta(minutes=45)),
+        "emotions": [{"sad": 1.0}],
+        "faces": [[1, 2, 3, 4]],
+    }
+    collection = collection_of(documents + [legacy])
+
+    batches = list(face_batches(collection, time_query(since=T0), batch_size=10))
+
+    columnar_call, legacy_call = collection.find.call_args_list
+    assert columnar_call[0][1] == {"emotion_vectors": 1, "face_boxes": 1}
+    assert legacy_call[0][1] == {"emotions": 1, "faces": 1}
+    assert "_id" in columnar_call[0][0] and "_id" in legacy_call[0][0]
+    ids = [document["_id"] for document in documents]
+    assert batches[0].result_ids == [ids[0], ids[1], legacy["_id"], ids[2]]
+    assert batches[0].scores[3][EMOTION_LABELS.index("sad")] == 1.0
+
+
+def test_summary_caps_trend_buckets(documents):
+    """Test a trend with too many buckets is refused, not grown without bound."""
+    summary = EmotionSummary(bucket_seconds=60, max_buckets=1)
+    with pytest.raises(TooManyBuckets):
+        summary.add(FaceBatch(documents))
+    client = ml_app.app.test_client()
+    with patch.object(ml_app, "collection", collection_of(documents)), patch(
+        "analytics.MAX_TREND_BUCKETS", 1
+    ):
+        assert client.get("/analytics?bucket=60").status_code == 400
+
+
+def test_export_streams_batch_by_batch(documents):
+    """Test the export yields a chunk before the cursor is read to the end."""
+    consumed = []
+    chunks = export_ndjson(collection_of(documents, consumed), batch_size=1)
+
+    first = next(chunks)
+    assert len(consumed) == 1
+    rows = [json.loads(line) for line in first.splitlines()]
+    assert [row["face"] for row in rows] == [0, 1]
+    assert rows[0]["result_id"] == str(documents[0]["_id"])
+    assert rows[0]["happy"] == pytest.approx(0.9)
+    assert rest_faces(chunks) == 1
+
+
+def rest_faces(chunks):
+    """Rows left in the remaining NDJSON chunks."""
+    return sum(len(chunk.splitlines()) for chunk in chunks)
+
+
+def test_export_csv(documents):
+    """Test the CSV export has a header and one row per face."""
+    text = "".join(export_csv(collection_of(documents), batch_size=2))
+    rows = list(csv.reader(io.StringIO(text)))
+    assert tuple(rows[0]) == EXPORT_COLUMNS
+    assert len(rows) == 4
+    assert rows[3][0] == str(documents[1]["_id"])
+    assert rows[3][2:7] == ["0", "0", "0", "10", "10"]
+
+
+def test_analytics_endpoint(documents):
+    """Test /analytics summarizes the collection and checks its arguments."""
+    client = ml_app.app.test_client()
+    with patch.object(ml_app, "collection", collection_of(documents)):
+        response = client.get("/analytics?since=2024-11-01T00:00:00&bucket=1800")
+        assert response.status_code == 200
+        assert len(response.get_json()["trend"]) == 2
+        assert client.get("/analytics?since=yesterday").status_code == 400
+        assert client.get("/analytics?bucket=0").status_code == 400
+
+
+def test_export_endpoint(documents):
+    """Test /export streams NDJSON by default and CSV on request."""
+    client = ml_app.app.test_client()
+    with patch.object(ml_app, "collection", collection_of(documents)):
+        response = client.get("/export")
+        assert response.mimetype == "application/x-ndjson"
+        assert len(response.get_data(as_text=True).splitlines()) == 3
+        response = client.get("/export?format=csv")
+        assert response.mimetype == "text/csv"
+        assert "attachment" in response.headers["Content-Disposition"]
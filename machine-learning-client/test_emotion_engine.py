@@ -0,0 +1,138 @@
+# pylint: disable=redefined-outer-name
+"""Test module for the batched emotion engine."""
+
+import threading
+from unittest.mock import patch
+import numpy as np
+import pytest
+
+from emotion_engine import BatchedEmotionEngine, MicroBatcher, EMOTION_LABELS
+import ml_client
+
+
+class FakeModel:  # pylint: disable=too-few-public-methods
+    """Stand-in for the Keras model that records every batch it sees."""
+
+    input_shape = (None, 64, 64, 1)
+
+    def __init__(self):
+        self.batches = []
+
+    def predict_on_batch(self, batch):
+        """Return a "happy" score for every face in the batch."""
+        self.batches.append(batch.shape)
+        scores = np.zeros((len(batch), len(EMOTION_LABELS)), dtype=np.float32)
+        scores[:, EMOTION_LABELS.index("happy")] = 1.0
+        return scores
+
+
+@pytest.fixture
+def frame():
+    """Create a random test frame."""
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(200, 300, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def faces():
+    """Three face boxes, one of them touching the image border."""
+    return np.array([[0, 0, 40, 50], [100, 60, 60, 60], [250, 150, 50, 50]])
+
+
+def test_prepare_tensor_shape_and_range(frame, faces):
+    """Test every face becomes one normalized 64x64 slice."""
+    engine = BatchedEmotionEngine(model=FakeModel())
+    tensor = engine.prepare(frame, faces)
+    assert tensor.shape == (3, 64, 64, 1)
+    assert tensor.dtype == np.float32
+    assert tensor.min() >= -1.0 and tensor.max() <= 1.0
+
+
+def test_predict_uses_one_model_call(frame, faces):
+    """Test all faces of an image are classified in a single call."""
+    model = FakeModel()
+    engine = BatchedEmotionEngine(model=model)
+    emotions = engine.predict(frame, faces)
+    assert model.batches == [(3, 64, 64, 1)]
+    assert len(emotions) == 3
+    assert emotions[0]["happy"] == 1.0
+    assert set(emotions[0]) == set(EMOTION_LABELS)
+
+
+def test_model_loads_on_first_use(frame, faces):
+    """Test the default model is only loaded when faces are classified."""
+    with patch("emotion_engine.load_emotion_model", return_value=FakeModel()) as load:
+        engine = BatchedEmotionEngine()
+        assert not engine.loaded
+        load.assert_not_called()
+        engine.predict(frame, faces)
+        engine.predict(frame, faces)
+    assert engine.loaded
+    load.assert_called_once()
+
+
+def test_predict_many_shares_one_model_call(frame, faces):
+    """Test the faces of several images go through one model call."""
+    model = FakeModel()
+    engine = BatchedEmotionEngine(model=model)
+    emotions = engine.predict_many([(frame, faces), (frame, faces[:1]), (frame, [])])
+    assert model.batches == [(4, 64, 64, 1)]
+    assert [len(image_emotions) for image_emotions in emotions] == [3, 1, 0]
+    assert not engine.predict_many([])
+
+
+def test_predict_chunks_large_batches(frame, faces):
+    """Test batches larger than max_batch_size are split."""
+    model = FakeModel()
+    engine = BatchedEmotionEngine(model=model, max_batch_size=2)
+    assert len(engine.predict(frame, faces)) == 3
+    assert [shape[0] for shape in model.batches] == [2, 1]
+
+
+def test_predict_no_faces(frame):
+    """Test no model call is made without faces."""
+    model = FakeModel()
+    engine = BatchedEmotionEngine(model=model)
+    assert not engine.predict(frame, np.empty((0, 4), dtype=np.int32))
+    assert not model.batches
+
+
+def test_micro_batcher_merges_concurrent_requests(frame, faces):
+    """Test faces from concurrent callers share one model call."""
+    model = FakeModel()
+    engine = BatchedEmotionEngine(model=model)
+    engine.batcher = MicroBatcher(engine.run_model, window_ms=200)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(engine.predict(frame, faces)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4
+    assert all(len(result) == 3 for result in results)
+    assert sum(shape[0] for shape in model.batches) == 12
+    assert len(model.batches) < 4
+
+
+def test_batched_matches_fer(frame, faces):
+    """Test the batched engine agrees with FER on the same boxes."""
+    expected = ml_client.emotion_detector.detect_emotions(frame, face_rectangles=faces)
+    actual = ml_client.emotion_engine.predict(frame, faces)
+    assert len(actual) == len(expected)
+    for ours, theirs in zip(actual, expected):
+        for label in EMOTION_LABELS:
+            assert ours[label] == pytest.approx(theirs["emotions"][label], abs=0.011)
+
+
+def test_prepare_box_outside_frame(frame):
+    """Test a box wholly outside the frame gives a blank slice, not an error."""
+    engine = BatchedEmotionEngine(model=FakeModel())
+    tensor = engine.prepare(frame, np.array([[400, 10, 40, 40], [100, 60, 60, 60]]))
+    assert tensor.shape == (2, 64, 64, 1)
+    assert np.allclose(tensor[0], 128.0 * 2.0 / 255.0 - 1.0, atol=1e-6)
+    assert len(engine.predict(frame, np.array([[400, 10, 40, 40]]))) == 1
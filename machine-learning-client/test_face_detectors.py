@@ -0,0 +1,61 @@
+"""Test module for the face detector backends."""
+
+from unittest.mock import MagicMock, patch
+import numpy as np
+import pytest
+
+from face_detectors import (
+    HaarDetector,
+    LBPDetector,
+    SSDDetector,
+    corners_to_boxes,
+    make_face_detector,
+)
+
+
+def test_make_face_detector_default_is_haar():
+    """Test the default backend is the original Haar cascade."""
+    detector = make_face_detector("haar", min_neighbors=3)
+    assert isinstance(detector, HaarDetector)
+    assert detector.params["minNeighbors"] == 3
+    assert not detector.needs_color
+
+
+def test_make_face_detector_unknown():
+    """Test unknown backends are rejected."""
+    with pytest.raises(ValueError):
+        make_face_detector("mtcnn")
+
+
+def test_haar_detects_nothing_on_blank_image():
+    """Test the Haar backend runs on a gray image."""
+    faces = HaarDetector().detect(np.zeros((120, 120), dtype=np.uint8))
+    assert len(faces) == 0
+
+
+def test_missing_model_file(tmp_path):
+    """Test a missing model file gives a clear error."""
+    with pytest.raises(FileNotFoundError, match="lbpcascade"):
+        LBPDetector(model_dir=str(tmp_path))
+
+
+def test_corners_to_boxes_clips_to_image():
+    """Test corner boxes are clipped and converted to x, y, w, h."""
+    boxes = corners_to_boxes([[-5, 10, 50, 60], [90, 90, 130, 130]], 100, 100)
+    assert boxes.tolist() == [[0, 10, 50, 50], [90, 90, 10, 10]]
+    assert corners_to_boxes([], 100, 100).shape == (0, 4)
+
+
+def test_ssd_filters_by_confidence():
+    """Test SSD detections below the confidence threshold are dropped."""
+    net = MagicMock()
+    detections = np.zeros((1, 1, 2, 7), dtype=np.float32)
+    detections[0, 0, 0] = [0, 1, 0.9, 0.1, 0.2, 0.5, 0.6]
+    detections[0, 0, 1] = [0, 1, 0.2, 0.0, 0.0, 1.0, 1.0]
+    net.forward.return_value = detections
+    with patch("face_detectors.model_path", side_effect=lambda name, _: name), patch(
+        "face_detectors.cv2.dnn.readNetFromCaffe", return_value=net
+    ):
+        detector = SSDDetector(confidence=0.5)
+    faces = detector.detect(np.zeros((100, 200, 3), dtype=np.uint8))
+    assert faces.tolist() == [[20, 20, 80, 40]]
@@ -0,0 +1,128 @@
+"""Test module for the per-user analysis history."""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pymongo.errors import PyMongoError
+
+import ml_client
+from app import app
+from history import AnalysisHistory, stats_increments
+from result_writer import SYNC, ResultWriter
+
+PROCESSED = {
+    "message": "Image processed",
+    "results": {
+        "_id": "r1",
+        "faces_detected": 2,
+        "emotions": [{"happy": 0.75, "sad": 0.25}, {"happy": 0.25, "sad": 0.75}],
+    },
+}
+
+
+def make_history():
+    """AnalysisHistory over mock collections."""
+    database = {"history": MagicMock(), "user_stats": MagicMock()}
+    return AnalysisHistory(database), database
+
+
+def test_stats_increments():
+    """Test sums, face counts and dominant emotions are accumulated."""
+    entries = [
+        {"emotions": PROCESSED["results"]["emotions"]},
+        {"emotions": []},
+    ]
+    assert stats_increments(entries) == {
+        "analyses": 2,
+        "faces": 2,
+        "emotion_sums.happy": 1.0,
+        "emotion_sums.sad": 1.0,
+        "dominant.happy": 1,
+        "dominant.sad": 1,
+    }
+
+
+def test_record_inserts_entries_and_updates_stats():
+    """Test one insert_many and one upserted $inc per call."""
+    history, database = make_history()
+    failed = {"message": "Failed to decode image"}
+    no_faces = {"message": "No faces detected"}
+
+    assert history.record("alice", [PROCESSED, failed, no_faces]) == 2
+
+    database["history"].create_index.assert_called_once()
+    (entries,) = database["history"].insert_many.call_args[0]
+    assert [entry["user"] for entry in entries] == ["alice", "alice"]
+    assert entries[0]["result_id"] == "r1"
+    assert entries[1]["faces_detected"] == 0
+    query, update = database["user_stats"].update_one.call_args[0]
+    assert query == {"_id": "alice"}
+    assert update["$inc"]["analyses"] == 2
+    assert update["$inc"]["faces"] == 2
+    assert "last_analysis_at" in update["$set"]
+    assert database["user_stats"].update_one.call_args[1] == {"upsert": True}
+
+    history.record("alice", [PROCESSED])
+    database["history"].create_index.assert_called_once()
+
+
+def test_record_anonymous_or_failed_is_skipped():
+    """Test nothing is written without a user or a usable result."""
+    history, database = make_history()
+    assert history.record(None, [PROCESSED]) == 0
+    assert history.record("alice", [{"message": "Failed to decode image"}]) == 0
+    database["history"].insert_many.assert_not_called()
+    database["user_stats"].update_one.assert_not_called()
+
+
+@pytest.fixture(autouse=True)
+def sync_writer():
+    """Run deferred history writes inline."""
+    with patch("ml_client.result_writer", ResultWriter(MagicMock(), mode=SYNC)):
+        yield
+
+
+def test_process_api_records_for_user():
+    """Test X-User adds cached and fresh analyses to the user's history."""
+    with patch("ml_client.analysis_history") as history, patch(
+        "ml_client.result_cache", MagicMock(get=MagicMock(return_value=PROCESSED))
+    ):
+        client = app.test_client()
+        client.post(
+            "/process",
+            data=b"jpeg",
+            content_type="image/jpeg",
+            headers={"X-User": "alice"},
+        )
+        client.post("/process", data=b"jpeg", content_type="image/jpeg")
+    history.record.assert_called_once_with("alice", [PROCESSED])
+
+
+def test_process_api_survives_history_error():
+    """Test a failed history write still answers with the saved analysis."""
+    with patch("ml_client.analysis_history") as history, patch(
+        "ml_client.result_cache", MagicMock(get=MagicMock(return_value=PROCESSED))
+    ):
+        history.record.side_effect = PyMongoError("down")
+        response = app.test_client().post(
+            "/process",
+            data=b"jpeg",
+            content_type="image/jpeg",
+            headers={"X-User": "alice"},
+        )
+    assert response.status_code == 200
+    assert response.get_json() == PROCESSED
+
+
+def test_process_images_bytes_records_each_chunk():
+    """Test a batch records its history once per chunk."""
+    with patch("ml_client.analysis_history") as history, patch(
+        "ml_client.result_cache", MagicMock(get=MagicMock(return_value=PROCESSED))
+    ):
+        responses = list(
+            ml_client.process_images_bytes(
+                [b"a", b"b", b"c"], chunk_size=2, user="alice"
+            )
+        )
+    assert responses == [PROCESSED] * 3
+    assert [len(call[0][1]) for call in history.record.call_args_list] == [2, 1]
@@ -0,0 +1,55 @@
+"""Test module for header-only image inspection."""
+
+import cv2
+import numpy as np
+import pytest
+
+from image_header import ImageTooLarge, read_image_header, required_reduction
+
+
+def encode(extension, width, height):
+    """Encode a blank image of the given size."""
+    # pylint: disable=no-member
+    _, buffer = cv2.imencode(extension, np.zeros((height, width, 3), dtype=np.uint8))
+    return buffer.tobytes()
+
+
+@pytest.mark.parametrize(
+    "extension, name", [(".jpg", "jpeg"), (".png", "png")], ids=["jpeg", "png"]
+)
+def test_reads_dimensions(extension, name):
+    """Test width and height come from the header."""
+    assert read_image_header(encode(extension, 321, 123)) == (name, 321, 123)
+
+
+def test_reads_from_truncated_jpeg():
+    """Test only the start of the file is needed."""
+    data = encode(".jpg", 640, 480)
+    assert read_image_header(memoryview(data)[:1024]) == ("jpeg", 640, 480)
+
+
+def test_unknown_format():
+    """Test unrecognised data returns None."""
+    assert read_image_header(b"GIF89a....") is None
+    assert read_image_header(b"") is None
+    assert read_image_header(b"\xff\xd8\xff") is None
+
+
+def test_required_reduction():
+    """Test the smallest JPEG scale that fits the decode limit is chosen."""
+    assert required_reduction(("jpeg", 4000, 3000), 0, 0) == 1
+    assert required_reduction(("jpeg", 4000, 3000), 0, 12_000_000) == 1
+    assert required_reduction(("jpeg", 4000, 3000), 0, 3_000_000) == 2
+    assert required_reduction(("jpeg", 4000, 3000), 0, 750_000) == 4
+    assert required_reduction(("jpeg", 4001, 3001), 0, 750_000) == 8
+
+
+def test_required_reduction_rejects():
+    """Test images over the pixel limit, or PNGs over the decode limit, are refused."""
+    with pytest.raises(ImageTooLarge) as error:
+        required_reduction(("jpeg", 50_000, 50_000), 100_000_000, 0)
+    assert (error.value.width, error.value.height) == (50_000, 50_000)
+    with pytest.raises(ImageTooLarge):
+        required_reduction(("png", 4000, 3000), 0, 3_000_000)
+    with pytest.raises(ImageTooLarge):
+        required_reduction(("jpeg", 40_000, 30_000), 0, 3_000_000)
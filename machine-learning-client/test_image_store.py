@@ -0,0 +1,102 @@
+# pylint: disable=redefined-outer-name
+"""Test module for image storage backends and the migration command."""
+
+import base64
+from unittest.mock import MagicMock, patch
+import cv2
+import numpy as np
+import pytest
+
+from image_store import (
+    GridFSImageStore,
+    LocalImageStore,
+    image_digest,
+    make_image_store,
+)
+from migrate_images import image_bytes_from_document, migrate
+
+
+@pytest.fixture
+def png_bytes():
+    """A small encoded image."""
+    # pylint: disable=no-member
+    _, buffer = cv2.imencode(".png", np.full((30, 40, 3), 128, dtype=np.uint8))
+    return buffer.tobytes()
+
+
+def test_local_store_round_trip(tmp_path, png_bytes):
+    """Test bytes come back unchanged under their digest."""
+    store = LocalImageStore(str(tmp_path))
+    digest = store.put(png_bytes)
+    assert digest == image_digest(png_bytes)
+    assert store.exists(digest)
+    assert store.get(digest) == png_bytes
+    assert store.path(digest).startswith(str(tmp_path / digest[:2]))
+
+
+def test_stores_accept_memoryview(tmp_path, png_bytes):
+    """Test a request body can be stored straight from its memoryview."""
+    store = LocalImageStore(str(tmp_path))
+    digest = store.put(memoryview(png_bytes))
+    assert digest == image_digest(png_bytes)
+    assert store.get(digest) == png_bytes
+
+    with patch("image_store.gridfs.GridFS") as gridfs:
+        gridfs.return_value.exists.return_value = False
+        assert GridFSImageStore(MagicMock()).put(memoryview(png_bytes)) == digest
+    gridfs.return_value.put.assert_called_once_with(png_bytes, _id=digest)
+
+
+def test_local_store_deduplicates(tmp_path, png_bytes):
+    """Test the same bytes are written once."""
+    store = LocalImageStore(str(tmp_path))
+    assert store.put(png_bytes) == store.put(png_bytes)
+    assert len(list(tmp_path.rglob("*"))) == 2  # one folder, one file
+
+
+def test_make_image_store_rejects_unknown_kind():
+    """Test an unknown ML_IMAGE_STORE value is an error."""
+    with pytest.raises(ValueError):
+        make_image_store(MagicMock(), kind="s3")
+
+
+def test_image_bytes_from_document(png_bytes):
+    """Test base64, data URL and binary images are all understood."""
+    encoded = base64.b64encode(png_bytes).decode("utf-8")
+    assert image_bytes_from_document(encoded) == png_bytes
+    assert image_bytes_from_document("data:image/png;base64," + encoded) == png_bytes
+    assert image_bytes_from_document(png_bytes) == png_bytes
+
+
+def test_migrate_moves_images(tmp_path, png_bytes):
+    """Test embedded images are stored and replaced by a reference."""
+    collection = MagicMock()
+    collection.find.return_value = [
+        {"_id": 1, "image": base64.b64encode(png_bytes).decode("utf-8")},
+        {"_id": 2, "image": "bm90IGFuIGltYWdl"},
+        {"_id": 3, "image": "not base64!"},
+    ]
+    store = LocalImageStore(str(tmp_path))
+
+    migrated, skipped = migrate(collection, store, batch_size=10)
+
+    assert (migrated, skipped) == (1, 2)
+    (update,) = collection.bulk_write.call_args[0][0]
+    assert update._filter == {"_id": 1}  # pylint: disable=protected-access
+    changes = update._doc  # pylint: disable=protected-access
+    assert changes["$set"]["image_ref"] == image_digest(png_bytes)
+    assert changes["$set"]["image_width"] == 40
+    assert changes["$set"]["image_height"] == 30
+    assert changes["$unset"] == {"image": ""}
+    assert store.exists(image_digest(png_bytes))
+
+
+def test_migrate_dry_run_writes_nothing(tmp_path, png_bytes):
+    """Test a dry run only counts documents."""
+    collection = MagicMock()
+    collection.find.return_value = [{"_id": 1, "image": png_bytes}]
+    store = LocalImageStore(str(tmp_path))
+
+    assert migrate(collection, store, dry_run=True) == (1, 0)
+    collection.bulk_write.assert_not_called()
+    assert not store.exists(image_digest(png_bytes))
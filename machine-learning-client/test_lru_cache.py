@@ -0,0 +1,39 @@
+"""Test module for the in-process LRU cache."""
+
+from unittest.mock import patch
+
+from lru_cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    """Test the size bound drops the oldest untouched entry."""
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_expires_entries():
+    """Test entries older than the TTL are dropped."""
+    cache = LRUCache(maxsize=10, ttl=5)
+    with patch("lru_cache.time.monotonic", return_value=100.0):
+        cache.put("a", 1)
+    with patch("lru_cache.time.monotonic", return_value=104.0):
+        assert cache.get("a") == 1
+    with patch("lru_cache.time.monotonic", return_value=106.0):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_pop():
+    """Test a popped key is gone and popping a missing one is harmless."""
+    cache = LRUCache()
+    cache.put("a", 1)
+    cache.pop("a")
+    cache.pop("missing")
+    assert cache.get("a") is None
+    assert len(cache) == 0
@@ -0,0 +1,68 @@
+"""Tests for the Prometheus metrics."""
+
+import numpy as np
+import cv2
+
+from app import app
+from metrics import Histogram, STAGE_SECONDS, nearest_rank_quantiles
+from ml_client import decode_image_reduced
+
+
+def test_histogram_buckets_sum_and_count():
+    """Values land in the first bucket whose bound is not below them."""
+    histogram = Histogram("test_seconds", "Test.", (0.1, 1.0), ("stage",))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, "decode")
+    cumulative, total, count, _ = histogram.labels("decode").snapshot()
+    assert cumulative == [2, 3, 4]
+    assert total == 2.65
+    assert count == 4
+
+
+def test_nearest_rank_quantiles():
+    """p50/p95/p99 come from the recent observations."""
+    quantiles = nearest_rank_quantiles(list(range(1, 101)))
+    assert quantiles == {0.5: 51, 0.95: 96, 0.99: 100}
+    assert nearest_rank_quantiles([]) == {0.5: 0.0, 0.95: 0.0, 0.99: 0.0}
+
+
+def test_render_prometheus_text():
+    """The text format has buckets, sum, count and quantile gauges."""
+    histogram = Histogram("test_seconds", "Test.", (0.1,), ("stage",))
+    histogram.observe(0.05, "detect")
+    lines = histogram.render()
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{stage="detect",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="detect",le="+Inf"} 1' in lines
+    assert 'test_seconds_count{stage="detect"} 1' in lines
+    assert 'test_seconds_quantile{stage="detect",quantile="0.99"} 0.05' in lines
+
+
+def test_timed_decorator_records_calls():
+    """Every call of a decorated function is timed."""
+    histogram = Histogram("test_seconds", "Test.", (0.1,), ("stage",))
+
+    @histogram.timed("work")
+    def work(value):
+        return value * 2
+
+    assert work(21) == 42
+    assert histogram.labels("work").count == 1
+    assert work.__name__ == "work"
+
+
+def test_metrics_endpoint_reports_pipeline_stages():
+    """Pipeline stages show up on /metrics."""
+    # pylint: disable=no-member
+    _, buffer = cv2.imencode(".jpg", np.zeros((50, 50, 3), dtype=np.uint8))
+    before = STAGE_SECONDS.labels("decode").count
+    decode_image_reduced(buffer.tobytes())
+    assert STAGE_SECONDS.labels("decode").count == before + 1
+
+    response = app.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert 'ml_stage_seconds_count{stage="decode"}' in body
+    assert 'ml_stage_seconds_quantile{stage="decode",quantile="0.95"}' in body
+    assert "# TYPE ml_faces_per_image histogram" in body
@@ -1,13 +1,27 @@
 # pylint: disable=redefined-outer-name
 """Test module for machine learning client functionalities."""
+
 from unittest.mock import patch, MagicMock
 import base64
+import io
+import threading
 import pytest
 import numpy as np
 import cv2
 
-from ml_client import decode_image, identify_people, recognize_emotions, process_image
+from ml_client import (
+    decode_image,
+    decode_image_buffer,
+    decode_image_reduced,
+    identify_people,
+    recognize_emotions,
+    process_image,
+    process_images_bytes,
+)
 from app import app
+from image_header import ImageTooLarge
+from image_store import image_digest
+from result_writer import ResultWriter, SYNC
 
 
 @pytest.fixture
@@ -118,12 +132,11 @@ def test_decode_image_invalid_input():
         decode_image("invalid-base64-data")
 
 
-@patch("cv2.cvtColor")
 @patch("cv2.cvtColor")
 def test_identify_people(mock_cvt_color, sample_image, mock_face_detector):
     """Test face detection in an image."""
     mock_cvt_color.return_value = np.zeros((100, 100), dtype=np.uint8)
-    with patch("ml_client.face_detector", mock_face_detector):
+    with patch("ml_client.face_detector.cascade", mock_face_detector):
         faces = identify_people(sample_image)
         assert isinstance(faces, np.ndarray)
         assert faces.shape == (1, 4)
@@ -136,7 +149,7 @@ def test_identify_people_no_faces(mock_cvt_color, sample_image, mock_face_detect
     """Test face detection when no faces are present."""
     mock_cvt_color.return_value = np.zeros((100, 100), dtype=np.uint8)
     mock_face_detector.detectMultiScale.return_value = np.array([])
-    with patch("ml_client.face_detector", mock_face_detector):
+    with patch("ml_client.face_detector.cascade", mock_face_detector):
         faces = identify_people(sample_image)
         assert isinstance(faces, np.ndarray)
         assert len(faces) == 0
@@ -148,7 +161,7 @@ def test_recognize_emotions(sample_image, mock_emotion_detector):
     faces = np.array([[40, 40, 20, 20]])
 
     with patch("ml_client.emotion_detector", mock_emotion_detector):
-        emotions = recognize_emotions(sample_image, faces)
+        emotions = recognize_emotions(sample_image, faces, mode="single_pass")
 
         assert isinstance(emotions, list)
         assert len(emotions) == 1
@@ -157,6 +170,39 @@ def test_recognize_emotions(sample_image, mock_emotion_detector):
         assert emotions[0]["happy"] == 0.75
 
 
+def test_recognize_emotions_single_pass(sample_image, mock_emotion_detector):
+    """Test single-pass mode classifies the given boxes in one call."""
+    faces = np.array([[40, 40, 20, 20]])
+
+    with patch("ml_client.emotion_detector", mock_emotion_detector):
+        emotions = recognize_emotions(sample_image, faces, mode="single_pass")
+
+        assert emotions[0]["happy"] == 0.75
+        mock_emotion_detector.detect_emotions.assert_called_once()
+        _, kwargs = mock_emotion_detector.detect_emotions.call_args
+        assert kwargs["face_rectangles"] is faces
+
+
+def test_recognize_emotions_redetect(sample_image, mock_emotion_detector):
+    """Test redetect mode runs FER once per cropped face."""
+    faces = np.array([[0, 0, 20, 20], [40, 40, 20, 20]])
+
+    with patch("ml_client.emotion_detector", mock_emotion_detector):
+        emotions = recognize_emotions(sample_image, faces, mode="redetect")
+
+        assert len(emotions) == 2
+        assert mock_emotion_detector.detect_emotions.call_count == 2
+        first_crop = mock_emotion_detector.detect_emotions.call_args_list[0][0][0]
+        assert first_crop.shape == (20, 20, 3)
+
+
+def test_recognize_emotions_no_faces(sample_image, mock_emotion_detector):
+    """Test no model call is made when there are no faces."""
+    with patch("ml_client.emotion_detector", mock_emotion_detector):
+        assert not recognize_emotions(sample_image, np.array([]))
+        mock_emotion_detector.detect_emotions.assert_not_called()
+
+
 @pytest.mark.integration
 @patch("cv2.cvtColor")
 def test_full_pipeline_integration(
@@ -164,14 +210,14 @@ def test_full_pipeline_integration(
 ):
     """Test the full pipeline from image decoding to emotion recognition."""
     mock_cvt_color.return_value = np.zeros((100, 100), dtype=np.uint8)
-    with patch("ml_client.face_detector", mock_face_detector), patch(
+    with patch("ml_client.face_detector.cascade", mock_face_detector), patch(
         "ml_client.emotion_detector", mock_emotion_detector
     ):
         img = decode_image(encoded_image)
         assert isinstance(img, np.ndarray)
         faces = identify_people(img)
         assert len(faces) == 1
-        emotions = recognize_emotions(img, faces)
+        emotions = recognize_emotions(img, faces, mode="single_pass")
         assert len(emotions) == 1
         assert emotions[0]["happy"] == 0.75
 
@@ -181,8 +227,13 @@ def test_process_image_successful(encoded_image, mock_db_collection):
     with patch("ml_client.decode_image") as mock_decode, patch(
         "ml_client.identify_people"
     ) as mock_identify, patch("ml_client.recognize_emotions") as mock_recognize, patch(
-        "ml_client.collection", mock_db_collection
-    ):
+        "ml_client.result_writer", ResultWriter(mock_db_collection, mode=SYNC)
+    ), patch(
+        "ml_client.image_store"
+    ) as mock_store, patch(
+        "ml_client.result_cache"
+    ) as mock_cache:
+        mock_cache.get.return_value = None
 
         # Setup mock returns
         mock_decode.return_value = np.zeros((100, 100, 3))
@@ -197,7 +248,263 @@ def test_process_image_successful(encoded_image, mock_db_collection):
         assert "results" in result
         assert result["results"]["faces_detected"] == 1
         assert len(result["results"]["emotions"]) == 1
-        assert result["results"]["image"] == encoded_image
+        assert "image" not in result["results"]
+        assert mock_store.put.call_args[0][0] == base64.b64decode(encoded_image)
 
         # Verify database interaction
         mock_db_collection.insert_one.assert_called_once()
+
+
+@pytest.fixture
+def jpeg_bytes(sample_image):
+    """Raw JPEG bytes of the sample image."""
+    # pylint: disable=no-member
+    _, buffer = cv2.imencode(".jpg", sample_image)
+    return buffer.tobytes()
+
+
+@pytest.fixture
+def mock_pipeline():
+    """Mock detection, emotions and the database for API tests."""
+
+    def insert_one(document):
+        document["_id"] = "abc123"
+
+    def insert_many(documents):
+        for index, document in enumerate(documents):
+            document["_id"] = f"id{index}"
+
+    collection = MagicMock()
+    collection.insert_one.side_effect = insert_one
+    collection.insert_many.side_effect = insert_many
+    store = MagicMock()
+    store.name = "local"
+    with patch("ml_client.identify_people") as mock_identify, patch(
+        "ml_client.recognize_emotions"
+    ) as mock_recognize, patch(
+        "ml_client.recognize_emotions_many",
+        side_effect=lambda items: [[{"happy": 1.0}] * len(f) for _, f in items],
+    ), patch(
+        "ml_client.result_writer", ResultWriter(collection, mode=SYNC)
+    ), patch(
+        "ml_client.image_store", store
+    ), patch(
+        "ml_client.result_cache",
+        MagicMock(
+            get=MagicMock(return_value=None), key=MagicMock(return_value="f00d:1")
+        ),
+    ):
+        mock_identify.return_value = np.array([[10, 20, 30, 40]])
+        mock_recognize.return_value = [{"happy": 0.8, "sad": 0.2}]
+        yield collection
+
+
+def test_decode_image_buffer_memoryview(jpeg_bytes):
+    """Test decoding straight from a memoryview."""
+    result = decode_image_buffer(memoryview(jpeg_bytes))
+    assert result.shape == (100, 100, 3)
+
+
+def test_process_api_raw_body(client, jpeg_bytes, mock_pipeline):
+    """Test a raw image/jpeg body is processed without base64."""
+    response = client.post("/process", data=jpeg_bytes, content_type="image/jpeg")
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results["faces_detected"] == 1
+    assert results["image_ref"] == image_digest(jpeg_bytes)
+    assert results["image_width"] == 100
+    assert results["faces"] == [[10, 20, 30, 40]]
+    stored = mock_pipeline.insert_one.call_args[0][0]
+    assert "image" not in stored
+    assert len(stored["emotion_vectors"]) == 7 * 4
+    assert "emotion_vectors" not in results
+
+
+def test_process_api_multipart(client, jpeg_bytes, mock_pipeline):
+    """Test a multipart image part is processed."""
+    response = client.post(
+        "/process",
+        data={"image": (io.BytesIO(jpeg_bytes), "face.jpg")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+    assert response.get_json()["results"]["faces_detected"] == 1
+    mock_pipeline.insert_one.assert_called_once()
+
+
+def test_process_api_json_still_supported(client, encoded_image, mock_pipeline):
+    """Test the base64 JSON body keeps working."""
+    response = client.post("/process", json={"image": encoded_image})
+    assert response.status_code == 200
+    assert response.get_json()["results"]["image_ref"] == image_digest(
+        base64.b64decode(encoded_image)
+    )
+    mock_pipeline.insert_one.assert_called_once()
+
+
+def test_process_api_empty_raw_body(client):
+    """Test an empty raw body is rejected."""
+    response = client.post("/process", data=b"", content_type="image/png")
+    assert response.status_code == 400
+
+
+def test_process_image_cache_hit_skips_model(encoded_image):
+    """Test a cached image is answered without decoding or inference."""
+    cached = {"message": "Image processed", "results": {"faces_detected": 3}}
+    with patch("ml_client.result_cache") as mock_cache, patch(
+        "ml_client.decode_image_buffer"
+    ) as mock_decode, patch("ml_client.recognize_emotions") as mock_recognize:
+        mock_cache.get.return_value = cached
+        assert process_image(encoded_image) is cached
+        mock_decode.assert_not_called()
+        mock_recognize.assert_not_called()
+
+
+def test_cache_stats_endpoint(client):
+    """Test the cache counters are exposed."""
+    response = client.get("/cache/stats")
+    assert response.status_code == 200
+    assert {"memory_hits", "db_hits", "misses"} <= set(response.get_json())
+
+
+def test_decode_image_reduced_large_jpeg():
+    """Test big JPEGs are decoded at a reduced scale."""
+    # pylint: disable=no-member
+    _, buffer = cv2.imencode(".jpg", np.zeros((3000, 4000, 3), dtype=np.uint8))
+    frame, scale = decode_image_reduced(buffer.tobytes(), min_side=1280)
+    assert frame.shape == (1500, 2000, 3)
+    assert scale == 2.0
+
+
+def test_decode_image_reduced_small_image(jpeg_bytes):
+    """Test images below the limit are decoded at full size."""
+    frame, scale = decode_image_reduced(jpeg_bytes, min_side=1280)
+    assert frame.shape == (100, 100, 3)
+    assert scale == 1.0
+
+
+def test_decode_guard_reduces_large_jpeg():
+    """Test a JPEG over the decode limit is decoded small enough to fit."""
+    # pylint: disable=no-member
+    _, buffer = cv2.imencode(".jpg", np.zeros((3000, 4000, 3), dtype=np.uint8))
+    with patch("ml_client.MAX_DECODE_PIXELS", 1_000_000):
+        frame, scale = decode_image_reduced(buffer.tobytes(), min_side=0)
+    assert frame.shape == (750, 1000, 3)
+    assert scale == 4.0
+
+
+def test_decode_guard_refuses_bomb():
+    """Test a header claiming huge dimensions is refused without decoding."""
+    # a PNG header for 60000 x 60000 pixels, no image data
+    # pylint: disable=no-member
+    _, buffer = cv2.imencode(".png", np.zeros((1, 1, 3), dtype=np.uint8))
+    header = bytearray(buffer.tobytes()[:33])
+    header[16:24] = (60000).to_bytes(4, "big") * 2
+    with patch("ml_client.cv2.imdecode") as imdecode:
+        with pytest.raises(ImageTooLarge):
+            decode_image_reduced(bytes(header))
+        assert decode_image_reduced(b"GIF89a....") == (None, 1.0)
+    imdecode.assert_not_called()
+
+
+def test_process_api_image_too_large(client):
+    """Test /process answers 413 for an image over the size guard."""
+    with patch("app.process_image_bytes", side_effect=ImageTooLarge(60000, 60000)):
+        response = client.post("/process", data=b"png", content_type="image/png")
+    assert response.status_code == 413
+    assert response.get_json()["message"] == "Image too large (60000x60000)"
+
+
+def test_identify_people_downscales_and_maps_back(mock_face_detector):
+    """Test detection on a downsized copy returns full-size boxes."""
+    frame = np.zeros((1000, 2560, 3), dtype=np.uint8)
+    mock_face_detector.detectMultiScale.return_value = np.array([[10, 10, 20, 20]])
+    with patch("ml_client.face_detector.cascade", mock_face_detector):
+        faces = identify_people(frame, max_side=1280)
+    gray = mock_face_detector.detectMultiScale.call_args[0][0]
+    assert gray.shape == (500, 1280)
+    assert faces.tolist() == [[20, 20, 40, 40]]
+
+
+def test_process_images_bytes_chunks(jpeg_bytes, mock_pipeline):
+    """Test images are saved with one insert_many per chunk."""
+    responses = list(
+        process_images_bytes([jpeg_bytes, b"not an image", jpeg_bytes], chunk_size=2)
+    )
+    assert [response["message"] for response in responses] == [
+        "Image processed",
+        "Failed to decode image",
+        "Image processed",
+    ]
+    assert mock_pipeline.insert_many.call_count == 2
+    assert responses[0]["results"]["_id"] == "id0"
+    assert responses[0]["results"]["emotions"] == [{"happy": 1.0}]
+    mock_pipeline.insert_one.assert_not_called()
+
+
+def test_process_batch_api_multipart(client, jpeg_bytes, mock_pipeline):
+    """Test several uploaded files are answered in one response."""
+    response = client.post(
+        "/process_batch",
+        data={
+            "images": [
+                (io.BytesIO(jpeg_bytes), "a.jpg"),
+                (io.BytesIO(jpeg_bytes), "b.jpg"),
+            ]
+        },
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [result["filename"] for result in results] == ["a.jpg", "b.jpg"]
+    assert all(result["message"] == "Image processed" for result in results)
+    mock_pipeline.insert_many.assert_called_once()
+
+
+def test_process_batch_api_json(client, encoded_image, mock_pipeline):
+    """Test base64 images in a JSON body."""
+    response = client.post("/process_batch", json={"images": [encoded_image]})
+    assert response.status_code == 200
+    assert response.get_json()["results"][0]["filename"] is None
+    mock_pipeline.insert_many.assert_called_once()
+
+
+def test_process_batch_api_empty(client):
+    """Test a batch without images is rejected."""
+    response = client.post("/process_batch", json={"images": []})
+    assert response.status_code == 400
+
+
+def test_process_api_does_not_wait_for_mongodb(jpeg_bytes, mock_pipeline):
+    """Test /process answers while every MongoDB write is still blocked."""
+    unblock = threading.Event()
+    mock_pipeline.insert_many.side_effect = lambda *args, **kwargs: unblock.wait()
+    writer = ResultWriter(mock_pipeline, flush_interval=0.01)
+    responses = []
+    store = MagicMock()
+    store.name = "gridfs"
+    with patch("ml_client.result_writer", writer), patch(
+        "ml_client.analysis_history"
+    ) as history, patch("ml_client.image_store", store):
+        history.record.side_effect = lambda *args: unblock.wait()
+        store.put.side_effect = lambda *args: unblock.wait()
+        request = threading.Thread(
+            target=lambda: responses.append(
+                app.test_client().post(
+                    "/process",
+                    data=jpeg_bytes,
+                    content_type="image/jpeg",
+                    headers={"X-User": "alice"},
+                )
+            )
+        )
+        request.start()
+        request.join(timeout=10)
+        answered = not request.is_alive()
+        unblock.set()
+        assert writer.close(timeout=10)
+    assert answered
+    assert responses[0].status_code == 200
+    store.put.assert_called_once()
+    history.record.assert_called_once()
+    mock_pipeline.insert_many.assert_called_once()
@@ -0,0 +1,110 @@
+"""Test module for the on-demand sampling profiler."""
+
+import threading
+import time
+from unittest.mock import patch
+import pytest
+
+import app as ml_app
+from profiler import Profiler, ProfilerBusy, ProfileSession, admin_authorized
+
+
+def busy_loop(stop):
+    """Spin until stop is set, so the sampler has something to see."""
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_admin_authorized():
+    """Test only the configured bearer token is accepted."""
+    assert admin_authorized("Bearer s3cret", "s3cret")
+    assert not admin_authorized("Bearer wrong", "s3cret")
+    assert not admin_authorized(None, "s3cret")
+    assert not admin_authorized("Bearer ", "")
+
+
+def test_profile_collects_collapsed_stacks():
+    """Test a busy thread shows up as a collapsed stack, root first."""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    try:
+        session = Profiler().profile(seconds=0.2, interval=0.002)
+    finally:
+        stop.set()
+        worker.join()
+    assert session.samples > 10
+    lines = session.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy
+    stack, count = busy[0].rsplit(" ", 1)
+    assert "busy_loop (test_profiler.py:" in stack
+    assert int(count) > 0
+    # the sampler and the thread waiting for it are left out
+    assert not any(line.startswith("profiler;") for line in lines)
+    assert not any("test_profile_collects_collapsed_stacks" in line for line in lines)
+
+
+def test_profile_ends_after_requests():
+    """Test the session stops once the request budget is spent."""
+    profiler = Profiler()
+
+    def finish_requests():
+        while profiler.session is None:
+            time.sleep(0.001)
+        for _ in range(3):
+            profiler.request_finished()
+
+    threading.Thread(target=finish_requests).start()
+    started = time.monotonic()
+    session = profiler.profile(seconds=10, max_requests=3)
+    assert time.monotonic() - started < 5
+    assert session.requests == 3
+    assert profiler.session is None
+
+
+def test_one_profile_at_a_time():
+    """Test a second profile is refused while one runs."""
+    profiler = Profiler()
+    profiler.session = ProfileSession(1)
+    with pytest.raises(ProfilerBusy):
+        profiler.profile(seconds=0.01)
+
+
+def test_memory_diff():
+    """Test tracemalloc reports the lines whose allocations grew."""
+    profiler = Profiler()
+    kept = []
+
+    def allocate():
+        while profiler.session is None:
+            time.sleep(0.001)
+        kept.append(bytearray(4 << 20))
+
+    threading.Thread(target=allocate).start()
+    result = profiler.profile(seconds=0.2, memory=True).result()
+    assert result["memory_diff"][0]["size_diff"] >= 4 << 20
+    assert "test_profiler.py" in result["memory_diff"][0]["where"]
+
+
+def test_profile_endpoint_off_by_default():
+    """Test the endpoint does not exist without ML_ADMIN_TOKEN."""
+    client = ml_app.app.test_client()
+    with patch.object(ml_app, "ADMIN_TOKEN", ""):
+        assert client.post("/admin/profile?seconds=0").status_code == 404
+
+
+def test_profile_endpoint():
+    """Test the endpoint checks the token and returns collapsed stacks or JSON."""
+    client = ml_app.app.test_client()
+    with patch.object(ml_app, "ADMIN_TOKEN", "s3cret"):
+        response = client.post("/admin/profile?seconds=0.05")
+        assert response.status_code == 401
+        headers = {"Authorization": "Bearer s3cret"}
+        response = client.post("/admin/profile?seconds=0.05", headers=headers)
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        response = client.post(
+            "/admin/profile?seconds=0.05&format=json", headers=headers
+        )
+        assert response.get_json()["samples"] > 0
@@ -0,0 +1,63 @@
+"""Test module for the result cache."""
+
+from unittest.mock import MagicMock
+
+from result_cache import RESPONSE_PROJECTION, ResultCache, params_fingerprint
+
+RESPONSE = {"message": "Image processed", "results": {"faces_detected": 1}}
+
+
+def test_fingerprint_changes_with_params():
+    """Test different settings never share cache keys."""
+    assert params_fingerprint({"mode": "batched"}) == params_fingerprint(
+        {"mode": "batched"}
+    )
+    assert params_fingerprint({"mode": "batched"}) != params_fingerprint(
+        {"mode": "redetect"}
+    )
+
+
+def test_memory_hit_skips_database():
+    """Test the memory tier answers before MongoDB."""
+    collection = MagicMock()
+    cache = ResultCache(collection, params={})
+    cache.put("digest", RESPONSE)
+    assert cache.get("digest") is RESPONSE
+    collection.find_one.assert_not_called()
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_database_hit_fills_memory():
+    """Test a stored result is found by cache_key and then kept in memory."""
+    collection = MagicMock()
+    collection.find_one.return_value = {"_id": 7, "faces_detected": 2}
+    cache = ResultCache(collection, params={"mode": "batched"})
+
+    first = cache.get("digest")
+    second = cache.get("digest")
+
+    assert first["results"] == {"_id": "7", "faces_detected": 2}
+    assert second is first
+    collection.find_one.assert_called_once_with(
+        {"cache_key": cache.key("digest")}, RESPONSE_PROJECTION
+    )
+    collection.create_index.assert_not_called()
+    stats = cache.stats()
+    assert (stats["db_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 0)
+
+
+def test_ensure_index():
+    """Test the cache_key index is created on request, not by lookups."""
+    collection = MagicMock()
+    ResultCache(collection, params={}).ensure_index()
+    collection.create_index.assert_called_once_with("cache_key")
+
+
+def test_miss_is_counted():
+    """Test unknown images are counted as misses."""
+    collection = MagicMock()
+    collection.find_one.return_value = None
+    cache = ResultCache(collection, params={})
+    assert cache.get("digest") is None
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hit_ratio"] == 0.0
@@ -0,0 +1,180 @@
+"""Test module for the write-behind result writer."""
+
+import threading
+import time
+from unittest.mock import MagicMock
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import worker
+from result_writer import DUPLICATE_KEY, SYNC, ResultWriter
+
+
+def written_documents(collection):
+    """Every document passed to insert_many, in order."""
+    return [
+        document
+        for call in collection.insert_many.call_args_list
+        for document in call[0][0]
+    ]
+
+
+def test_sync_mode_inserts_before_returning():
+    """Test sync saves are acknowledged inside the call, with client-side ids."""
+    collection = MagicMock()
+    writer = ResultWriter(collection, mode=SYNC)
+    document = {"faces_detected": 1}
+    result_id = writer.save(document)
+    assert isinstance(result_id, ObjectId)
+    collection.insert_one.assert_called_once_with(document)
+    assert document["_id"] == result_id
+    ids = writer.save_many([{"a": 1}, {"a": 2}])
+    assert [item["_id"] for item in collection.insert_many.call_args[0][0]] == ids
+    assert writer.stats()["written"] == 3
+
+
+def test_unknown_mode_rejected():
+    """Test a typo in ML_WRITE_MODE fails loudly."""
+    with pytest.raises(ValueError):
+        ResultWriter(MagicMock(), mode="eventually")
+
+
+def test_write_behind_returns_before_insert():
+    """Test a slow MongoDB is not on the caller's path."""
+    collection = MagicMock()
+    collection.insert_many.side_effect = lambda *args, **kwargs: time.sleep(0.3)
+    writer = ResultWriter(collection, flush_interval=0.01)
+    start = time.perf_counter()
+    ids = [writer.save({"index": index}) for index in range(5)]
+    assert time.perf_counter() - start < 0.1
+    assert writer.flush(timeout=5)
+    assert [document["_id"] for document in written_documents(collection)] == ids
+    writer.close()
+
+
+def test_write_behind_batches_by_size():
+    """Test queued documents are written max_batch at a time."""
+    collection = MagicMock()
+    writer = ResultWriter(collection, max_batch=4, flush_interval=1.0)
+    writer.save_many([{"index": index} for index in range(10)])
+    assert writer.close(timeout=5)
+    sizes = [len(call[0][0]) for call in collection.insert_many.call_args_list]
+    assert sizes[:2] == [4, 4] and sum(sizes) == 10
+    assert collection.insert_many.call_args[1] == {"ordered": False}
+    assert writer.stats()["pending"] == 0
+
+
+def test_write_behind_flushes_on_interval():
+    """Test a lone document is written once flush_interval passes."""
+    collection = MagicMock()
+    writer = ResultWriter(collection, max_batch=100, flush_interval=0.02)
+    writer.save({"index": 0})
+    assert writer.flush(timeout=2)
+    collection.insert_many.assert_called_once()
+    writer.close()
+
+
+def test_retry_ignores_documents_already_saved():
+    """Test a retried batch succeeds when only duplicate keys remain."""
+    collection = MagicMock()
+    collection.insert_many.side_effect = [
+        AutoReconnect("primary stepped down"),
+        BulkWriteError({"writeErrors": [{"code": DUPLICATE_KEY, "index": 0}]}),
+    ]
+    writer = ResultWriter(collection, flush_interval=0.01)
+    writer.save_many([{"index": 0}, {"index": 1}])
+    assert writer.close(timeout=5)
+    assert collection.insert_many.call_count == 2
+    assert writer.stats()["written"] == 2
+    assert writer.stats()["failed"] == 0
+
+
+def test_failed_batch_is_dropped_after_retries():
+    """Test a batch that keeps failing is counted and does not block the queue."""
+    collection = MagicMock()
+    collection.insert_many.side_effect = AutoReconnect("down")
+    writer = ResultWriter(collection, flush_interval=0.01, retries=1)
+    writer.save({"index": 0})
+    assert writer.close(timeout=5)
+    assert writer.stats()["failed"] == 1
+
+
+def test_close_drains_and_later_saves_write_through():
+    """Test shutdown saves everything queued; saves after close are synchronous."""
+    collection = MagicMock()
+    writer = ResultWriter(collection, max_batch=1000, flush_interval=10.0)
+    writer.save_many([{"index": index} for index in range(3)])
+    assert writer.close(timeout=5)
+    assert len(written_documents(collection)) == 3
+    writer.save({"index": 3})
+    collection.insert_one.assert_called_once()
+
+
+def test_bounded_queue_applies_backpressure():
+    """Test saves block while max_pending documents are waiting."""
+    collection = MagicMock()
+    release = threading.Event()
+    collection.insert_many.side_effect = lambda *args, **kwargs: release.wait()
+    writer = ResultWriter(collection, max_batch=1, flush_interval=0, max_pending=1)
+    writer.save({"index": 0})  # taken by the writer thread, blocked in insert
+    time.sleep(0.05)
+    writer.save({"index": 1})  # fills the queue
+    blocked = threading.Thread(target=writer.save, args=({"index": 2},))
+    blocked.start()
+    blocked.join(timeout=0.1)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(timeout=2)
+    assert not blocked.is_alive()
+    assert writer.close(timeout=5)
+
+
+def test_worker_flushes_results_before_completing_jobs():
+    """Test job results are saved before jobs are marked done."""
+    jobs = MagicMock()
+    claimed = [{"_id": 1, "image": b"a", "attempts": 1}]
+    first, second = MagicMock(), MagicMock()
+    first.sort.return_value.limit.return_value = [{"_id": 1}]
+    second.sort.return_value = claimed
+    jobs.find.side_effect = [first, second]
+    calls = []
+    flush = MagicMock(side_effect=lambda: calls.append("flush"))
+    jobs.bulk_write.side_effect = lambda *args, **kwargs: calls.append("bulk_write")
+
+    worker.run_batch(jobs, "w1", MagicMock(return_value={}), flush=flush)
+
+    assert calls == ["flush", "bulk_write"]
+
+
+def test_deferred_calls_run_before_their_batch():
+    """Test deferred calls run on the writer thread ahead of queued documents."""
+    order = []
+    collection = MagicMock()
+    collection.insert_many.side_effect = lambda documents, **kwargs: order.append(
+        "insert"
+    )
+    writer = ResultWriter(collection, flush_interval=0.05)
+    writer.defer(order.append, "image")
+    writer.save({"index": 0})
+    writer.defer(order.append, "history")
+    assert writer.close(timeout=5)
+    assert order == ["image", "history", "insert"]
+
+
+def test_failed_deferred_call_is_counted():
+    """Test an exception in a deferred call does not stop the writer."""
+    collection = MagicMock()
+    writer = ResultWriter(collection, flush_interval=0.01)
+    writer.defer(MagicMock(side_effect=AutoReconnect("down"), __name__="put"))
+    writer.save({"index": 0})
+    assert writer.close(timeout=5)
+    assert writer.stats()["failed"] == 1
+    collection.insert_many.assert_called_once()
+
+
+def test_sync_mode_runs_deferred_calls_inline():
+    """Test sync mode makes deferred calls before returning."""
+    calls = []
+    ResultWriter(MagicMock(), mode=SYNC).defer(calls.append, 1)
+    assert calls == [1]
@@ -0,0 +1,23 @@
+"""Test module for the worker pool helpers."""
+
+import os
+from unittest.mock import patch
+
+from serving import limit_threads, threads_per_worker
+
+
+def test_threads_per_worker_splits_cpus():
+    """Test CPUs are shared evenly between workers, at least one each."""
+    assert threads_per_worker(1, cpus=8) == 8
+    assert threads_per_worker(4, cpus=8) == 2
+    assert threads_per_worker(16, cpus=8) == 1
+    assert threads_per_worker(0, cpus=8) == 8
+
+
+def test_limit_threads_sets_tensorflow_env():
+    """Test TensorFlow and OpenMP thread limits are exported."""
+    with patch.dict(os.environ, {}), patch("serving.cv2.setNumThreads") as cv_threads:
+        limit_threads(3)
+        assert os.environ["TF_NUM_INTRAOP_THREADS"] == "3"
+        assert os.environ["OMP_NUM_THREADS"] == "3"
+        cv_threads.assert_called_once_with(3)
@@ -0,0 +1,135 @@
+"""Tests for lazy startup and the health endpoints."""
+
+# pylint: disable=redefined-outer-name
+
+import os
+import subprocess
+import sys
+import threading
+from unittest.mock import MagicMock, patch
+import pytest
+from pymongo.errors import PyMongoError
+
+import ml_client
+from app import app
+from lazy import Lazy
+
+# what makes a cold start slow; none of it may load at import
+HEAVY_MODULES = ("tensorflow", "keras", "fer")
+
+STARTUP_SCRIPT = f"""
+import sys, time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+print(",".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))
+"""
+
+
+@pytest.fixture
+def client():
+    """Flask test client."""
+    return app.test_client()
+
+
+def test_startup_time_benchmark():
+    """
+    Importing the app loads no model code. The import time is reported,
+    not asserted: it depends on the machine, the modules loaded do not.
+    """
+    lines = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(ml_client.__file__)),
+    ).stdout.splitlines()
+    seconds, heavy_loaded = float(lines[-2]), lines[-1]
+    print(f"\napp import took {seconds:.3f}s")
+    assert heavy_loaded == ""
+
+
+def test_lazy_builds_once_on_first_use():
+    """The factory runs once, on the first attribute access."""
+    factory = MagicMock(return_value=MagicMock(value=42))
+    lazy = Lazy(factory)
+    assert not lazy.loaded
+    factory.assert_not_called()
+
+    threads = [threading.Thread(target=lambda: lazy.value) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert lazy.value == 42
+    assert lazy.loaded
+    factory.assert_called_once()
+
+
+def test_healthz(client):
+    """Liveness answers without the model or the database."""
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "ok"}
+
+
+def test_readyz_not_ready_until_warm(client):
+    """Readiness is 503 while the model is cold, 200 once warm."""
+    with patch("ml_client.model_ready", threading.Event()) as model_ready, patch(
+        "ml_client.database_reachable", return_value=True
+    ):
+        response = client.get("/readyz")
+        assert response.status_code == 503
+        assert response.get_json()["checks"] == {"model": False, "database": True}
+
+        model_ready.set()
+        response = client.get("/readyz")
+        assert response.status_code == 200
+        assert response.get_json()["status"] == "ready"
+
+
+def test_readyz_database_down(client):
+    """Readiness is 503 when MongoDB cannot be reached."""
+    ready = threading.Event()
+    ready.set()
+    with patch("ml_client.model_ready", ready), patch(
+        "ml_client.database_reachable", return_value=False
+    ):
+        response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json()["checks"]["database"] is False
+
+
+def test_start_warm_up_sets_ready():
+    """The background warm-up marks the model ready when it finishes."""
+    indexed = threading.Event()
+    with patch("ml_client.model_ready", threading.Event()) as model_ready, patch(
+        "ml_client.identify_people"
+    ), patch("ml_client.recognize_emotions"), patch(
+        "ml_client.ensure_indexes", side_effect=indexed.set
+    ) as ensure_indexes:
+        ml_client.start_warm_up()
+        # the timeouts only stop a broken warm-up from hanging the suite
+        assert model_ready.wait(timeout=30)
+        assert indexed.wait(timeout=30)
+    ensure_indexes.assert_called_once_with()
+
+
+def test_start_warm_up_failure_stays_not_ready():
+    """A failed warm-up leaves the service not ready."""
+    with patch("ml_client.model_ready", threading.Event()) as model_ready, patch(
+        "ml_client.identify_people", side_effect=RuntimeError("no model")
+    ) as identify_people, patch("ml_client.ensure_indexes"):
+        ml_client.start_warm_up().join()
+        identify_people.assert_called_once()
+        assert not model_ready.is_set()
+
+
+def test_ensure_indexes_retries_until_mongo_is_up():
+    """The result cache index is created at startup once MongoDB answers."""
+    cache = MagicMock()
+    cache.ensure_index.side_effect = [PyMongoError("down"), None]
+    with patch("ml_client.result_cache", cache), patch("ml_client.time.sleep") as sleep:
+        ml_client.ensure_indexes(retry_interval=2.0)
+    assert cache.ensure_index.call_count == 2
+    sleep.assert_called_once_with(2.0)
@@ -0,0 +1,83 @@
+"""Tests for the TFLite emotion backend."""
+
+# pylint: disable=redefined-outer-name
+
+import numpy as np
+import pytest
+
+import ml_client
+from emotion_engine import (
+    EMOTION_LABELS,
+    TFLiteEmotionEngine,
+    make_emotion_engine,
+)
+from export_emotion_model import export
+
+# largest difference from FER's scores (rounded to 2 decimals) we accept;
+# int8 is calibrated on random tensors here, real face crops do better
+TOLERANCE = {"float16": 0.01, "int8": 0.1}
+
+
+@pytest.fixture(scope="module")
+def tflite_models(tmp_path_factory):
+    """float16 and int8 exports of the fer model."""
+    output_dir = tmp_path_factory.mktemp("models")
+    paths = export(["float16", "int8"], str(output_dir))
+    return dict(zip(["float16", "int8"], paths))
+
+
+@pytest.fixture
+def frame():
+    """Create a random test frame."""
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(200, 300, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def faces():
+    """Three face boxes, one of them touching the image border."""
+    return np.array([[0, 0, 40, 50], [100, 60, 60, 60], [250, 150, 50, 50]])
+
+
+def as_matrix(emotions):
+    """Emotion dicts as an (n, 7) array."""
+    return np.array(
+        [[scores[label] for label in EMOTION_LABELS] for scores in emotions]
+    )
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_tflite_matches_fer(tflite_models, frame, faces, quantization):
+    """Test quantized models agree with FER's own emotion scores."""
+    expected = ml_client.emotion_detector.detect_emotions(frame, face_rectangles=faces)
+    expected = as_matrix([face["emotions"] for face in expected])
+    engine = TFLiteEmotionEngine(model_path=tflite_models[quantization])
+    actual = as_matrix(engine.predict(frame, faces))
+    assert np.abs(actual - expected).max() <= TOLERANCE[quantization]
+    assert (actual.argmax(axis=1) == expected.argmax(axis=1)).all()
+
+
+def test_tflite_pads_batches_to_powers_of_two(tflite_models):
+    """Test odd batch sizes reuse a power-of-two input and are trimmed."""
+    engine = TFLiteEmotionEngine(model_path=tflite_models["float16"], max_batch_size=8)
+    height, width = engine.target_size
+    scores = engine.run_model(np.zeros((11, height, width, 1), dtype=np.float32))
+    assert scores.shape == (11, len(EMOTION_LABELS))
+    # the last chunk of 3 faces ran as a batch of 4
+    assert engine.model.get_input_details()[0]["shape"][0] == 4
+    np.testing.assert_allclose(scores.sum(axis=1), 1.0, atol=1e-3)
+
+
+def test_tflite_model_loads_lazily(tmp_path):
+    """Test a missing model only fails when it is first needed."""
+    engine = make_emotion_engine("tflite", model_path=str(tmp_path / "missing.tflite"))
+    assert not engine.loaded
+    assert engine.model_name == "missing.tflite"
+    with pytest.raises(FileNotFoundError):
+        engine.predict(np.zeros((64, 64, 3), dtype=np.uint8), [[0, 0, 32, 32]])
+
+
+def test_make_emotion_engine_unknown():
+    """Test an unknown backend name is rejected."""
+    with pytest.raises(ValueError):
+        make_emotion_engine("onnx")
@@ -0,0 +1,222 @@
+"""Tests for the streaming video analysis."""
+
+# pylint: disable=redefined-outer-name,no-member
+
+from unittest.mock import MagicMock, patch
+import numpy as np
+import cv2
+import pytest
+
+from admission import DeadlineExceeded
+from app import app
+from video_analysis import (
+    VideoTooLarge,
+    analyze_video,
+    analyze_video_file,
+    clip_box,
+    iou_matrix,
+    iter_video_frames,
+    record_emotions,
+    update_tracks,
+)
+
+FPS = 20
+FRAMES = 40
+
+
+def moving_square(index):
+    """A textured frame with a square moving right by 2 pixels per frame."""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 60, (120, 160, 3), dtype=np.uint8)
+    x = 20 + 2 * index
+    frame[40:80, x : x + 40] = 220
+    frame[50:60, x + 10 : x + 30] = 30
+    return frame
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    """A 2 second MJPG clip at 20 fps."""
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), FPS, (160, 120))
+    for index in range(FRAMES):
+        writer.write(moving_square(index))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def mock_models():
+    """Detection finds the square; every face is happy."""
+
+    def detect(frame):
+        columns = np.where(frame[45].max(axis=1) > 200)[0]
+        return np.array([[columns[0], 40, 40, 40]])
+
+    with patch("ml_client.identify_people", side_effect=detect) as identify, patch(
+        "ml_client.recognize_emotions",
+        side_effect=lambda frame, faces: [{"happy": 1.0}] * len(faces),
+    ) as recognize:
+        yield identify, recognize
+
+
+def test_iter_video_frames_samples(video_path):
+    """Frames are sampled at the requested rate with their timestamps."""
+    frames = list(iter_video_frames(video_path, sample_fps=5))
+    assert len(frames) == FRAMES // 4
+    assert [seconds for seconds, _ in frames[:3]] == [0.0, 0.2, 0.4]
+    assert frames[0][1].shape == (120, 160, 3)
+
+
+def test_iter_video_frames_every_frame(video_path):
+    """A sample rate of 0 yields every frame."""
+    assert len(list(iter_video_frames(video_path, sample_fps=0))) == FRAMES
+
+
+def test_iter_video_frames_bad_file(tmp_path):
+    """An unreadable file raises ValueError."""
+    path = tmp_path / "junk.avi"
+    path.write_bytes(b"not a video")
+    with pytest.raises(ValueError):
+        list(iter_video_frames(str(path)))
+
+
+def test_iou_matrix():
+    """Identical boxes overlap fully, disjoint boxes not at all."""
+    overlaps = iou_matrix([[0, 0, 10, 10]], [[0, 0, 10, 10], [50, 50, 10, 10]])
+    assert overlaps.shape == (1, 2)
+    assert overlaps[0, 0] == pytest.approx(1.0)
+    assert overlaps[0, 1] == 0.0
+
+
+def test_update_tracks_keeps_ids():
+    """Overlapping detections keep their track; new ones get new ids."""
+    frame = moving_square(0)
+    tracks, next_id = update_tracks([], frame, [[20, 40, 40, 40]], 0)
+    assert [track.face_id for track in tracks] == [0]
+
+    tracks, next_id = update_tracks(
+        tracks, frame, [[22, 40, 40, 40], [100, 10, 20, 20]], next_id
+    )
+    assert [track.face_id for track in tracks] == [0, 1]
+    assert tracks[0].box == (22, 40, 40, 40)
+    assert next_id == 2
+
+
+def test_analyze_video_detects_every_n(video_path, mock_models):
+    """Detection runs every N sampled frames; the tracker fills the gaps."""
+    identify, recognize = mock_models
+    result = analyze_video(iter_video_frames(video_path, sample_fps=0), 10)
+
+    assert result["frames_processed"] == FRAMES
+    assert identify.call_count == FRAMES // 10
+    assert recognize.call_count == FRAMES
+    assert result["fps_processed"] > 0
+    assert result["cpu_seconds"] > 0
+
+    (face,) = result["faces"]
+    assert face["face_id"] == 0
+    assert len(face["series"]) == FRAMES
+    # the tracked box follows the square to the right
+    assert face["series"][9]["box"][0] > face["series"][0]["box"][0] + 10
+    assert face["series"][0]["emotions"] == {"happy": 1.0}
+
+
+def test_analyze_video_no_faces(video_path):
+    """A clip without faces returns an empty series list."""
+    with patch("ml_client.identify_people", return_value=np.empty((0, 4))):
+        result = analyze_video_file(video_path, sample_fps=5)
+    assert result["frames_processed"] == FRAMES // 4
+    assert result["faces"] == []
+
+
+def test_process_video_api(video_path, mock_models):
+    """The endpoint accepts a raw video body."""
+    with open(video_path, "rb") as video:
+        body = video.read()
+    response = app.test_client().post(
+        "/process_video?sample_fps=10&detect_every=2",
+        data=body,
+        content_type="video/x-msvideo",
+    )
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results["frames_processed"] == FRAMES // 2
+    assert mock_models[0].call_count == FRAMES // 4
+
+
+@pytest.mark.usefixtures("mock_models")
+def test_process_video_api_empty():
+    """An empty body is rejected."""
+    response = app.test_client().post(
+        "/process_video", data=b"", content_type="video/mp4"
+    )
+    assert response.status_code == 400
+
+
+def test_analyze_video_checks_deadline_per_frame(video_path, mock_models):
+    """A deadline passing mid-clip stops the analysis at the next frame."""
+    with patch("admission.time") as clock:
+        clock.monotonic.side_effect = range(FRAMES)
+        with pytest.raises(DeadlineExceeded):
+            analyze_video(iter_video_frames(video_path, sample_fps=0), 1, 2.5)
+    assert mock_models[0].call_count == 3
+
+
+def test_video_limits(video_path, mock_models):
+    """Clips over the duration or frame limit are refused."""
+    with pytest.raises(VideoTooLarge):
+        next(iter_video_frames(video_path, max_seconds=1))
+    with pytest.raises(VideoTooLarge):
+        analyze_video(iter_video_frames(video_path, sample_fps=0), max_frames=5)
+    assert mock_models[0].call_count == 1
+
+
+@pytest.mark.usefixtures("mock_models")
+def test_process_video_api_too_large(video_path):
+    """Uploads over ML_VIDEO_MAX_BYTES or ML_VIDEO_MAX_FRAMES get 413."""
+    with open(video_path, "rb") as video:
+        body = video.read()
+    client = app.test_client()
+    with patch("app.VIDEO_MAX_BYTES", len(body) - 1):
+        response = client.post("/process_video", data=body, content_type="video/avi")
+    assert response.status_code == 413
+    with patch("video_analysis.VIDEO_MAX_FRAMES", 2):
+        response = client.post("/process_video", data=body, content_type="video/avi")
+    assert response.status_code == 413
+
+
+def test_clip_box():
+    """Boxes are cut down to the frame; boxes outside it are dropped."""
+    frame = np.zeros((100, 300, 3), dtype=np.uint8)
+    assert clip_box([280, -10, 40, 40], frame) == (280, 0, 20, 30)
+    assert clip_box([400, 10, 40, 40], frame) is None
+
+
+def test_track_leaving_the_frame_is_lost():
+    """A tracker box that drifts out of the frame ends the track."""
+    frame = moving_square(0)
+    (track,), _ = update_tracks([], frame, [[20, 40, 40, 40]], 0)
+    track.tracker = MagicMock()
+    track.tracker.update.return_value = (True, (140, 100, 40, 40))
+    assert track.follow(frame)
+    assert track.box == (140, 100, 20, 20)
+    track.tracker.update.return_value = (True, (400, 10, 40, 40))
+    assert not track.follow(frame)
+
+
+def test_redetect_readings_match_their_tracks():
+    """Faces FER does not find again get no reading, and others keep theirs."""
+    frame = moving_square(0)
+    tracks, _ = update_tracks([], frame, [[0, 0, 20, 20], [60, 40, 40, 40]], 0)
+
+    def redetect(_frame, faces):
+        # FER finds nothing in the first crop
+        return [] if faces[0][0] == 0 else [{"sad": 1.0}]
+
+    with patch("ml_client.PIPELINE_MODE", "redetect"), patch(
+        "ml_client.recognize_emotions", side_effect=redetect
+    ):
+        record_emotions(tracks, 0.0, frame)
+    assert tracks[0].series == []
+    assert tracks[1].series[0]["emotions"] == {"sad": 1.0}
@@ -0,0 +1,151 @@
+"""Test module for the upload job worker."""
+
+import datetime
+from unittest.mock import MagicMock, patch
+from gridfs.errors import NoFile
+
+import worker
+from image_header import ImageTooLarge
+
+
+def make_jobs(queued, claimed):
+    """Mock jobs collection whose find() calls return the given lists."""
+    jobs = MagicMock()
+    first, second = MagicMock(), MagicMock()
+    first.sort.return_value.limit.return_value = queued
+    second.sort.return_value = claimed
+    jobs.find.side_effect = [first, second]
+    return jobs
+
+
+def test_claim_jobs_marks_batch_running():
+    """Test queued jobs are claimed in one update_many."""
+    jobs = make_jobs([{"_id": 1}, {"_id": 2}], [{"_id": 1}, {"_id": 2}])
+    claimed = worker.claim_jobs(jobs, "w1", batch_size=2)
+    assert [job["_id"] for job in claimed] == [1, 2]
+    query, update = jobs.update_many.call_args[0]
+    assert query == {"_id": {"$in": [1, 2]}, "status": worker.JOB_QUEUED}
+    assert update["$set"]["status"] == worker.JOB_RUNNING
+    assert update["$set"]["worker"] == "w1"
+
+
+def test_claim_jobs_empty_queue():
+    """Test nothing is updated when the queue is empty."""
+    jobs = make_jobs([], [])
+    assert not worker.claim_jobs(jobs, "w1")
+    jobs.update_many.assert_not_called()
+
+
+def test_run_batch_writes_results_in_bulk():
+    """Test every claimed job is completed with one bulk_write."""
+    jobs = make_jobs(
+        [{"_id": 1}, {"_id": 2}],
+        [{"_id": 1, "image": b"a", "attempts": 1}, {"_id": 2, "image": b"b"}],
+    )
+    process = MagicMock(return_value={"message": "Image processed"})
+
+    assert worker.run_batch(jobs, "w1", process) == 2
+
+    (updates,) = jobs.bulk_write.call_args[0]
+    # pylint: disable=protected-access
+    assert [update._filter for update in updates] == [{"_id": 1}, {"_id": 2}]
+    assert updates[0]._doc["$set"]["status"] == worker.JOB_DONE
+    assert updates[0]._doc["$set"]["result"] == {"message": "Image processed"}
+    assert "image" in updates[0]._doc["$unset"]
+
+
+def test_run_job_failure_retries_then_fails():
+    """Test failing jobs are requeued until MAX_ATTEMPTS."""
+
+    def process(_image, user=None):  # pylint: disable=unused-argument
+        raise RuntimeError("boom")
+
+    # pylint: disable=protected-access
+    retry = worker.run_job({"_id": 1, "image": b"a", "attempts": 1}, process)
+    assert retry._doc["$set"]["status"] == worker.JOB_QUEUED
+    final = worker.run_job(
+        {"_id": 1, "image": b"a", "attempts": worker.MAX_ATTEMPTS}, process
+    )
+    assert final._doc["$set"]["status"] == worker.JOB_FAILED
+    assert final._doc["$set"]["error"] == "boom"
+
+
+def test_requeue_expired():
+    """Test stale running jobs go back to the queue."""
+    jobs = MagicMock()
+    jobs.update_many.return_value.modified_count = 3
+    assert worker.requeue_expired(jobs) == (3, 3)
+    query, update = jobs.update_many.call_args_list[0][0]
+    assert query["status"] == worker.JOB_RUNNING
+    assert query["attempts"] == {"$lt": worker.MAX_ATTEMPTS}
+    assert update["$set"]["status"] == worker.JOB_QUEUED
+
+
+def test_requeue_expired_fails_crash_loop():
+    """Test a job whose worker keeps dying fails after MAX_ATTEMPTS leases."""
+    job = {"_id": 1, "status": worker.JOB_RUNNING, "attempts": 0}
+    jobs = MagicMock()
+    lease_ended = worker.utcnow() + datetime.timedelta(seconds=worker.LEASE_SECONDS + 1)
+
+    def update_many(query, update):
+        attempts = query["attempts"]
+        matches = job["status"] == query["status"] and (
+            attempts.get("$gte", 0) <= job["attempts"] < attempts.get("$lt", 99)
+        )
+        if matches:
+            job.update(update["$set"])
+        return MagicMock(modified_count=int(matches))
+
+    jobs.update_many.side_effect = update_many
+    leases = 0
+    while job["status"] != worker.JOB_FAILED and leases < 10:
+        # claimed, then the worker crashes and the lease runs out
+        job.update(status=worker.JOB_RUNNING, attempts=job["attempts"] + 1)
+        leases += 1
+        worker.requeue_expired(jobs, now=lease_ended)
+
+    assert leases == worker.MAX_ATTEMPTS
+    assert "lease expired" in job["error"]
+
+
+def test_run_job_reads_image_ref():
+    """Test jobs naming a stored image are processed with its bytes."""
+    images = MagicMock()
+    images.get.return_value = b"stored"
+    process = MagicMock(return_value={"message": "Image processed"})
+    update = worker.run_job(
+        {"_id": 1, "image_ref": "abc", "user": "ann"}, process, images
+    )
+    images.get.assert_called_once_with("abc")
+    process.assert_called_once_with(b"stored", user="ann")
+    # pylint: disable=protected-access
+    assert update._doc["$set"]["status"] == worker.JOB_DONE
+
+
+def test_run_job_permanent_errors_fail_at_once():
+    """Test errors no retry can fix are not retried."""
+    images = MagicMock()
+    images.get.side_effect = NoFile("gone")
+    gone = worker.run_job({"_id": 1, "image_ref": "abc", "attempts": 1}, None, images)
+
+    def too_large(_image, user=None):  # pylint: disable=unused-argument
+        raise ImageTooLarge(50000, 50000)
+
+    large = worker.run_job({"_id": 2, "image": b"a", "attempts": 1}, too_large)
+    # pylint: disable=protected-access
+    assert gone._doc["$set"]["status"] == worker.JOB_FAILED
+    assert large._doc["$set"]["status"] == worker.JOB_FAILED
+
+
+def test_run_batch_renews_lease():
+    """Test a long batch pushes back its claim before the lease runs out."""
+    jobs = make_jobs(
+        [{"_id": 1}, {"_id": 2}], [{"_id": 1, "image": b"a"}, {"_id": 2, "image": b"b"}]
+    )
+    clock = iter([0.0, 0.0, worker.LEASE_SECONDS, worker.LEASE_SECONDS])
+    with patch("worker.time.monotonic", side_effect=lambda: next(clock)):
+        worker.run_batch(jobs, "w1", MagicMock(return_value={}))
+    # one update_many claims the batch, the second renews it
+    query, update = jobs.update_many.call_args_list[1][0]
+    assert query == {"status": worker.JOB_RUNNING, "worker": "w1"}
+    assert "claimed_at" in update["$set"]
@@ -0,0 +1,251 @@
+"""
+Streaming emotion analysis for video clips.
+
+Frames are pulled one at a time from cv2.VideoCapture, so a clip is never
+held in memory. Frames are sampled at sample_fps; skipped frames are only
+grabbed, not decoded into images. Full face detection runs on every
+detect_every-th sampled frame and faces are followed with a MIL tracker
+in between. Every sampled frame gets one batched emotion call for all
+tracked faces, giving an emotion time series per face.
+
+A clip may be at most VIDEO_MAX_BYTES long on the wire, VIDEO_MAX_SECONDS
+of video and VIDEO_MAX_FRAMES sampled frames; beyond that VideoTooLarge
+is raised. The caller's deadline is checked before every frame.
+"""
+
+# pylint: disable=no-member
+
+import os
+import time
+import cv2
+import numpy as np
+
+import ml_client
+from admission import check_deadline
+
+VIDEO_SAMPLE_FPS = float(os.getenv("ML_VIDEO_SAMPLE_FPS", "5"))
+VIDEO_DETECT_EVERY = int(os.getenv("ML_VIDEO_DETECT_EVERY", "5"))
+VIDEO_MAX_BYTES = int(os.getenv("ML_VIDEO_MAX_BYTES", str(100 << 20)))
+VIDEO_MAX_SECONDS = float(os.getenv("ML_VIDEO_MAX_SECONDS", "300"))
+VIDEO_MAX_FRAMES = int(os.getenv("ML_VIDEO_MAX_FRAMES", "3000"))
+# a face is the same person as a detection when their boxes overlap this much
+VIDEO_MATCH_IOU = 0.3
+
+
+class VideoTooLarge(Exception):
+    """
+    Raised for a clip over one of the video limits.
+    """
+
+    def __init__(self, limit):
+        super().__init__(f"Video too large (over {limit})")
+        self.limit = limit
+
+
+def iter_video_frames(path, sample_fps=VIDEO_SAMPLE_FPS, max_seconds=None):
+    """
+    Yield (seconds, frame) for frames sampled at sample_fps.
+    A sample_fps of 0 yields every frame. Raises VideoTooLarge for a clip
+    longer than max_seconds (default VIDEO_MAX_SECONDS), up front when the
+    container says so and otherwise once decoding gets there.
+    """
+    max_seconds = max_seconds or VIDEO_MAX_SECONDS
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise ValueError("Could not open video")
+        video_fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        if capture.get(cv2.CAP_PROP_FRAME_COUNT) / video_fps > max_seconds:
+            raise VideoTooLarge(f"{max_seconds:g} seconds")
+        step = max(1, round(video_fps / sample_fps)) if sample_fps else 1
+        index = 0
+        while capture.grab():
+            if index / video_fps > max_seconds:
+                raise VideoTooLarge(f"{max_seconds:g} seconds")
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield index / video_fps, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def clip_box(box, frame):
+    """
+    An [x, y, w, h] box cut down to the frame, or None when nothing of it
+    is inside.
+    """
+    height, width = frame.shape[:2]
+    x, y, w, h = box  # pylint: disable=invalid-name
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(width, x + w), min(height, y + h)
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right - left, bottom - top)
+
+
+def iou_matrix(boxes, others):
+    """
+    Pairwise intersection over union of two lists of [x, y, w, h] boxes.
+    """
+    first = np.asarray(boxes, dtype=np.float64).reshape(-1, 1, 4)
+    second = np.asarray(others, dtype=np.float64).reshape(1, -1, 4)
+    left = np.maximum(first[..., 0], second[..., 0])
+    top = np.maximum(first[..., 1], second[..., 1])
+    right = np.minimum(first[..., 0] + first[..., 2], second[..., 0] + second[..., 2])
+    bottom = np.minimum(first[..., 1] + first[..., 3], second[..., 1] + second[..., 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    areas = first[..., 2] * first[..., 3] + second[..., 2] * second[..., 3]
+    union = areas - intersection
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+
+
+class FaceTrack:
+    """
+    One face followed through the clip.
+    """
+
+    def __init__(self, face_id, frame, box):
+        self.face_id = face_id
+        self.series = []
+        self.box = None
+        self.tracker = None
+        self.reset(frame, box)
+
+    def reset(self, frame, box):
+        """
+        Snap the track to a fresh detection.
+        """
+        self.box = tuple(int(value) for value in box)
+        self.tracker = cv2.TrackerMIL_create()
+        self.tracker.init(frame, self.box)
+
+    def follow(self, frame):
+        """
+        Move the box with the tracker; False when the face was lost.
+        The tracker may drift past the edges: the box is clipped to the
+        frame, and a face that left it is lost.
+        """
+        found, box = self.tracker.update(frame)
+        if found:
+            box = clip_box([int(value) for value in box], frame)
+            if box is None:
+                return False
+            self.box = box
+        return found
+
+
+def update_tracks(tracks, frame, faces, next_id):
+    """
+    Match detections to tracks by IoU. Matched tracks snap to the
+    detection, unmatched detections start new tracks and tracks without a
+    detection end. Returns (tracks, next_id).
+    """
+    updated, used = [], set()
+    if len(tracks) > 0 and len(faces) > 0:
+        overlaps = iou_matrix([track.box for track in tracks], faces)
+        for track, row in zip(tracks, overlaps):
+            best = int(np.argmax(row))
+            if row[best] >= VIDEO_MATCH_IOU and best not in used:
+                used.add(best)
+                track.reset(frame, faces[best])
+                updated.append(track)
+
+    for face_index, box in enumerate(faces):
+        if face_index not in used:
+            updated.append(FaceTrack(next_id, frame, box))
+            next_id += 1
+    return updated, next_id
+
+
+def track_emotions(tracks, frame):
+    """
+    One emotion reading per track, None where there is none. The redetect
+    mode drops faces FER does not find again, so its results cannot be
+    matched to tracks by position; each face is read on its own there.
+    """
+    if ml_client.PIPELINE_MODE == "redetect":
+        readings = [
+            ml_client.recognize_emotions(frame, np.array([track.box]))
+            for track in tracks
+        ]
+        return [reading[0] if reading else None for reading in readings]
+    boxes = np.array([track.box for track in tracks])
+    return ml_client.recognize_emotions(frame, boxes)
+
+
+def record_emotions(tracks, seconds, frame):
+    """
+    Append one batched emotion reading for every tracked face.
+    """
+    if not tracks:
+        return
+    for track, face_emotions in zip(tracks, track_emotions(tracks, frame)):
+        if face_emotions is None:
+            continue
+        track.series.append(
+            {"t": round(seconds, 3), "box": list(track.box), "emotions": face_emotions}
+        )
+
+
+def track_faces(frames, detect_every, deadline=None, max_frames=None):
+    """
+    Follow faces through (seconds, frame) pairs, reading their emotions.
+    Raises DeadlineExceeded when the deadline passes between frames and
+    VideoTooLarge past max_frames (default VIDEO_MAX_FRAMES) frames.
+    Returns (tracks by face_id, frames processed).
+    """
+    max_frames = max_frames or VIDEO_MAX_FRAMES
+    active, ended, next_id, processed = [], [], 0, 0
+    for processed, (seconds, frame) in enumerate(frames, start=1):
+        check_deadline(deadline)
+        if processed > max_frames:
+            raise VideoTooLarge(f"{max_frames} frames")
+        if (processed - 1) % detect_every == 0:
+            faces = ml_client.identify_people(frame)
+            kept, next_id = update_tracks(active, frame, faces, next_id)
+        else:
+            kept = [track for track in active if track.follow(frame)]
+        ended.extend(track for track in active if track not in kept)
+        active = kept
+        record_emotions(active, seconds, frame)
+    return sorted(ended + active, key=lambda track: track.face_id), processed
+
+
+def analyze_video(
+    frames, detect_every=VIDEO_DETECT_EVERY, deadline=None, max_frames=None
+):
+    """
+    Build a per-face emotion time series from (seconds, frame) pairs.
+    fps_processed is frames per second of process CPU time.
+    """
+    start, cpu_start = time.perf_counter(), time.process_time()
+    tracks, processed = track_faces(frames, detect_every, deadline, max_frames)
+    elapsed = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    return {
+        "frames_processed": processed,
+        "seconds": round(elapsed, 3),
+        "cpu_seconds": round(cpu_seconds, 3),
+        "fps_processed": round(processed / cpu_seconds, 2) if cpu_seconds else 0.0,
+        "faces": [
+            {"face_id": track.face_id, "series": track.series}
+            for track in tracks
+            if track.series
+        ],
+    }
+
+
+def analyze_video_file(
+    path, sample_fps=VIDEO_SAMPLE_FPS, detect_every=None, deadline=None
+):
+    """
+    Analyze a video file on disk.
+    """
+    return analyze_video(
+        iter_video_frames(path, sample_fps),
+        detect_every or VIDEO_DETECT_EVERY,
+        deadline,
+    )
@@ -0,0 +1,225 @@
+"""
+Worker that drains the upload job queue written by the web app.
+
+Jobs are claimed in bulk: a batch of queued job ids is marked "running"
+with this worker's claim token in one update_many, the claimed jobs are
+processed, and all results are written back with one bulk_write. While
+a batch runs the worker renews its claim every third of the lease; jobs
+whose claim is older than the lease (a worker died) are queued again,
+up to MAX_ATTEMPTS times.
+
+The web app stores a job's image in the GridFS image bucket and the job
+only carries its digest (image_ref); older jobs carry the bytes. Jobs
+that cannot succeed (the image is too large or missing) fail at once
+instead of being retried.
+
+    python worker.py
+"""
+
+import datetime
+import os
+import time
+import uuid
+from gridfs.errors import NoFile
+from pymongo import UpdateOne
+
+from image_header import ImageTooLarge
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+BATCH_SIZE = int(os.getenv("ML_WORKER_BATCH_SIZE", "16"))
+POLL_INTERVAL = float(os.getenv("ML_WORKER_POLL_INTERVAL", "0.5"))
+LEASE_SECONDS = float(os.getenv("ML_WORKER_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("ML_WORKER_MAX_ATTEMPTS", "3"))
+# errors no retry can fix
+PERMANENT_ERRORS = (ImageTooLarge, NoFile)
+
+
+def utcnow():
+    """Timezone-aware current time."""
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def ensure_indexes(jobs):
+    """
+    Index used to find the oldest queued jobs.
+    """
+    jobs.create_index([("status", 1), ("created_at", 1)])
+
+
+def requeue_expired(jobs, now=None):
+    """
+    Put jobs back in the queue when their worker stopped renewing them.
+    Jobs that already had MAX_ATTEMPTS leases fail instead, so a job that
+    crashes or hangs its worker is not picked up forever.
+    Returns (requeued, failed) counts.
+    """
+    now = now or utcnow()
+    expired = {
+        "status": JOB_RUNNING,
+        "claimed_at": {"$lt": now - datetime.timedelta(seconds=LEASE_SECONDS)},
+    }
+    requeued = jobs.update_many(
+        {**expired, "attempts": {"$lt": MAX_ATTEMPTS}},
+        {"$set": {"status": JOB_QUEUED, "updated_at": now}, "$unset": {"worker": ""}},
+    )
+    failed = jobs.update_many(
+        {**expired, "attempts": {"$gte": MAX_ATTEMPTS}},
+        {
+            "$set": {
+                "status": JOB_FAILED,
+                "error": f"Worker lease expired {MAX_ATTEMPTS} times",
+                "updated_at": now,
+            },
+            "$unset": {"worker": ""},
+        },
+    )
+    return requeued.modified_count, failed.modified_count
+
+
+def renew_lease(jobs, worker_id, now=None):
+    """
+    Push back the lease of every job this worker is running.
+    """
+    now = now or utcnow()
+    jobs.update_many(
+        {"status": JOB_RUNNING, "worker": worker_id},
+        {"$set": {"claimed_at": now, "updated_at": now}},
+    )
+
+
+def claim_jobs(jobs, worker_id, batch_size=BATCH_SIZE):
+    """
+    Claim up to batch_size queued jobs and return them, oldest first.
+    """
+    candidates = [
+        job["_id"]
+        for job in jobs.find({"status": JOB_QUEUED}, {"_id": 1})
+        .sort("created_at", 1)
+        .limit(batch_size)
+    ]
+    if not candidates:
+        return []
+    now = utcnow()
+    # another worker may claim some of the same ids; the status filter
+    # makes sure each job is only claimed once
+    jobs.update_many(
+        {"_id": {"$in": candidates}, "status": JOB_QUEUED},
+        {
+            "$set": {
+                "status": JOB_RUNNING,
+                "worker": worker_id,
+                "claimed_at": now,
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+    )
+    return list(
+        jobs.find({"_id": {"$in": candidates}, "worker": worker_id}).sort(
+            "created_at", 1
+        )
+    )
+
+
+def job_image(job, images):
+    """
+    The bytes of a job's image: from the image store by image_ref, or
+    from the job itself for jobs queued before image_ref.
+    """
+    if "image" in job:
+        return job["image"]
+    return images.get(job["image_ref"])
+
+
+def run_job(job, process, images=None):
+    """
+    Process one claimed job and return the update to write back.
+    The job's user, if any, is passed on so the analysis joins their history.
+    """
+    now = utcnow()
+    try:
+        result = process(job_image(job, images), user=job.get("user"))
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        retry = (
+            not isinstance(error, PERMANENT_ERRORS)
+            and job.get("attempts", 1) < MAX_ATTEMPTS
+        )
+        return UpdateOne(
+            {"_id": job["_id"]},
+            {
+                "$set": {
+                    "status": JOB_QUEUED if retry else JOB_FAILED,
+                    "error": str(error),
+                    "updated_at": now,
+                },
+                "$unset": {"worker": ""},
+            },
+        )
+    return UpdateOne(
+        {"_id": job["_id"]},
+        {
+            "$set": {"status": JOB_DONE, "result": result, "updated_at": now},
+            # the image now lives in the image store
+            "$unset": {"image": "", "worker": ""},
+        },
+    )
+
+
+def run_batch(
+    jobs, worker_id, process, batch_size=BATCH_SIZE, flush=None, images=None
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """
+    Claim, process and complete one batch. Returns the number of jobs run.
+    flush, if given, is called before the jobs are marked done, so a job
+    never points at a result that has not been saved yet. images is the
+    store job images are read from.
+    """
+    claimed = claim_jobs(jobs, worker_id, batch_size)
+    if claimed:
+        updates = []
+        renewed = time.monotonic()
+        for job in claimed:
+            if time.monotonic() - renewed >= LEASE_SECONDS / 3:
+                renew_lease(jobs, worker_id)
+                renewed = time.monotonic()
+            updates.append(run_job(job, process, images))
+        if flush is not None:
+            flush()
+        jobs.bulk_write(updates, ordered=False)
+    return len(claimed)
+
+
+def main():
+    """Entry point: poll the queue forever."""
+    # pylint: disable=import-outside-toplevel
+    from image_store import GridFSImageStore
+    from ml_client import db, process_image_bytes, result_writer, shutdown
+
+    jobs = db["jobs"]
+    # the web app puts job images in GridFS whatever ML_IMAGE_STORE is
+    images = GridFSImageStore(db)
+    ensure_indexes(jobs)
+    worker_id = f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    print(f" * Worker {worker_id} polling for jobs")
+    try:
+        while True:
+            requeue_expired(jobs)
+            ran = run_batch(
+                jobs,
+                worker_id,
+                process_image_bytes,
+                flush=result_writer.flush,
+                images=images,
+            )
+            if ran == 0:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        shutdown()
+
+
+if __name__ == "__main__":
+    main()
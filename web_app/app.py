@@ -3,14 +3,31 @@ Flask Web Application for User Authentication and File Upload.
 """
 
 import os
-import base64
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import json
+import mimetypes
+import threading
+import time
+import zipfile
+from flask import (
+    Flask, render_template, request, redirect, url_for, flash, session, jsonify,
+    stream_template, stream_with_context, g, Response, send_file, abort
+)
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo.errors import DocumentTooLarge, DuplicateKeyError, PyMongoError
 from dotenv import load_dotenv
-import requests 
+import requests
+from jobs import enqueue_job, get_job, job_status, JobImages, JOB_DONE, JOB_FAILED
+from history import get_history, get_stats, history_json, DEFAULT_PAGE_SIZE
+from session_store import ServerSideSessionInterface, SessionStore
+from uploads import (
+    store_upload, upload_path, thumbnail_path, thumbnail_name, annotated_thumbnail_path,
+    too_many_pixels
+)
+from ml_service import MLServiceClient, MLServiceConfig
+from metrics import FACES_PER_IMAGE, IMAGE_BYTES, REQUEST_SECONDS, STAGE_SECONDS, registry
+from profiler import Profiler, ProfilerBusy, admin_authorized
 
 # Load environment variables
 load_dotenv()
@@ -23,22 +40,91 @@ mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
 client = MongoClient(mongo_uri)
 db = client['user_database']
 users_collection = db['users']
-
-# Test MongoDB connection
-try:
-    client.admin.command("ping")
-    print(" * Connected to MongoDB!")
-except ConnectionFailure as e:
-    print(" * MongoDB connection error:", e)
+# queue shared with the ML worker
+jobs_collection = client['ml_database']['jobs']
+job_images = JobImages(client['ml_database'])
+# per-user history and totals, written by the ML service
+history_collection = client['ml_database']['history']
+stats_collection = client['ml_database']['user_stats']
+results_collection = client['ml_database']['analysis_results']
+
+# Sessions live server-side (memory, then MongoDB); the cookie only holds
+# a random id, so analysis results of any size fit in the session
+session_store = SessionStore(
+    db['sessions'],
+    maxsize=int(os.getenv('SESSION_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('SESSION_TTL', str(24 * 3600))),
+    memory_ttl=float(os.getenv('SESSION_CACHE_TTL', '5')),
+    logger=app.logger,
+)
+app.session_interface = ServerSideSessionInterface(session_store)
+
+# MongoClient connects in the background; /readyz reports when it is up,
+# so a missing database no longer stalls startup.
 
 # File upload setup
 UPLOAD_FOLDER = 'static/uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-
-# ML container configuration
+ARCHIVE_EXTENSIONS = {'zip'}
+# Stored uploads never change (they are named by their hash), so browsers
+# may keep them this long without asking again
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+# Request bodies over this many bytes are refused before they are read
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_BYTES', str(200 * 1024 * 1024)))
+# Single images whose header claims more pixels are refused without decoding
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', '100000000'))
+# Multi-file and zip uploads are capped at this many images
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "500"))
+# Zip members larger than this are skipped
+MAX_ARCHIVE_MEMBER_BYTES = int(os.getenv("MAX_ARCHIVE_MEMBER_BYTES", str(20 * 1024 * 1024)))
+
+# ML container configuration; a comma-separated list of /process URLs
+# spreads the load over several ML replicas
 ML_CLIENT_URL = os.getenv("ML_CLIENT_URL", "http://127.0.0.1:5001/process")
+ml_service = MLServiceClient(ML_CLIENT_URL, MLServiceConfig(
+    pool_size=int(os.getenv("ML_POOL_SIZE", "10")),
+    timeout=float(os.getenv("ML_TIMEOUT", "10")),
+    retries=int(os.getenv("ML_RETRIES", "2")),
+    failure_threshold=int(os.getenv("ML_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("ML_BREAKER_RESET", "30")),
+))
+# Seconds between /readyz checks of every ML replica (0 = passive only)
+ML_HEALTH_INTERVAL = float(os.getenv("ML_HEALTH_INTERVAL", "5"))
+# Images sent to /process_batch per request; results stream back per batch
+ML_BATCH_SIZE = int(os.getenv("ML_BATCH_SIZE", "16"))
+# When on, uploads are queued for the ML worker instead of calling /process
+ASYNC_UPLOADS = os.getenv("ASYNC_UPLOADS", "false").lower() in ('1', 'true', 'yes')
+
+
+# /admin/* needs "Authorization: Bearer <ADMIN_TOKEN>"; without a token
+# configured the admin endpoints do not exist
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+profiler = Profiler()
+
+
+def count_profiled_request(_exception=None):
+    """Let a running profile count finished requests."""
+    profiler.request_finished()
+
+
+# with profiling off, requests do not even pass through the hook
+if ADMIN_TOKEN:
+    app.teardown_request(count_profiled_request)
+
+
+@app.before_request
+def start_timer():
+    """Remember when the request started."""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    """Record how long the endpoint took (streamed bodies: until the first byte)."""
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, request.endpoint or 'unknown')
+    return response
 
 
 def allowed_file(filename):
@@ -48,6 +134,153 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@STAGE_SECONDS.timed('save')
+def save_upload(filename, image_bytes):
+    """
+    Keep a copy of an uploaded image in the upload folder, stored once
+    under its content hash. Returns the stored key.
+    """
+    IMAGE_BYTES.observe(len(image_bytes))
+    return store_upload(app.config['UPLOAD_FOLDER'], image_bytes, filename)
+
+
+@app.template_global()
+def thumbnail_url(key, size, faces=False):
+    """
+    URL of a stored upload's thumbnail, with the detected face boxes drawn
+    on when faces is set.
+    """
+    if faces:
+        return url_for('upload_faces_thumbnail', key=key, size=size)
+    return url_for('upload_thumbnail', key=key, size=size)
+
+
+def send_immutable(path, etag):
+    """
+    Send a content-addressed file with a strong ETag and a long max-age;
+    a matching If-None-Match gets 304 with no body.
+    """
+    response = send_file(
+        path, mimetype=image_mimetype(path), etag=etag, max_age=UPLOAD_CACHE_MAX_AGE,
+        conditional=True,
+    )
+    response.cache_control.immutable = True
+    return response
+
+
+def record_faces(result):
+    """
+    Count the faces of one ML result in the face-count histogram.
+    """
+    if result.get('message') in ('Image processed', 'No faces detected'):
+        FACES_PER_IMAGE.observe((result.get('results') or {}).get('faces_detected', 0))
+
+
+def is_archive(filename):
+    """
+    Check if the uploaded file is a zip archive of images.
+    """
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def image_mimetype(filename):
+    """
+    Content-Type to send an uploaded image to the ML container with.
+    """
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def ensure_indexes(retry_interval=5.0):
+    """
+    Create the unique index on users.username, the sessions TTL index and
+    the analysis_results index the face thumbnails are looked up by,
+    retrying until MongoDB is up. Run in a background thread so startup
+    never waits for it.
+    """
+    while True:
+        try:
+            users_collection.create_index('username', unique=True)
+            session_store.ensure_indexes()
+            results_collection.create_index('image_ref')
+            return
+        except PyMongoError as e:
+            print(f" * Could not create indexes yet: {e}")
+            time.sleep(retry_interval)
+
+
+def current_user():
+    """
+    Username of the signed-in user, or None.
+    """
+    return session.get('username')
+
+
+def database_reachable():
+    """
+    Whether MongoDB has been reached. Reads the state kept by pymongo's
+    background monitor, so it never blocks.
+    """
+    return client.topology_description.has_readable_server()
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Per-stage latency, image size and face count histograms in the
+    Prometheus text format.
+    """
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/admin/profile', methods=['POST'])
+def profile():
+    """
+    Sample this process's stacks for ?seconds= (default 10) or until
+    ?requests= requests finished, every ?interval_ms= (default 5).
+    Returns collapsed stacks as text, or JSON with ?format=json;
+    ?memory=1 adds a tracemalloc diff over the same window (JSON).
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'message': 'Not found'}), 404
+    if not admin_authorized(request.headers.get('Authorization'), ADMIN_TOKEN):
+        return jsonify({'message': 'Unauthorized'}), 401
+    memory = request.args.get('memory', '0') in ('1', 'true', 'yes')
+    try:
+        profile_session = profiler.profile(
+            seconds=request.args.get('seconds', 10.0, type=float),
+            max_requests=request.args.get('requests', 0, type=int),
+            interval=request.args.get('interval_ms', 5.0, type=float) / 1000.0,
+            memory=memory,
+        )
+    except ProfilerBusy as error:
+        return jsonify({'message': str(error)}), 409
+    if memory or request.args.get('format') == 'json':
+        return jsonify(profile_session.result())
+    return Response(profile_session.collapsed(), content_type='text/plain; charset=utf-8')
+
+
+@app.route('/ml/backends')
+def ml_backends():
+    """
+    Health, circuit state, in-flight requests and latency of each ML replica.
+    """
+    return jsonify(ml_service.stats())
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: MongoDB is reachable. 503 until it is."""
+    ready = database_reachable()
+    status = {'status': 'ready' if ready else 'not ready', 'checks': {'database': ready}}
+    return jsonify(status), 200 if ready else 503
+
+
 @app.route('/')
 def home():
     """Redirect to the login page."""
@@ -64,6 +297,9 @@ def login():
         user = users_collection.find_one({'username': username})
 
         if user and check_password_hash(user['password'], password):
+            # a new id, so one planted before login is never signed in
+            session.regenerate()
+            session['username'] = username
             flash("Login successful!", "success")
             return redirect(url_for('upload'))
 
@@ -90,7 +326,12 @@ def sign_up():
             return redirect(url_for('sign_up'))
 
         hashed_password = generate_password_hash(password)
-        users_collection.insert_one({'username': username, 'password': hashed_password})
+        try:
+            users_collection.insert_one({'username': username, 'password': hashed_password})
+        except DuplicateKeyError:
+            # taken between the check above and the insert
+            flash("Username already exists. Please choose another one.", "error")
+            return redirect(url_for('sign_up'))
         flash("Sign-up successful! Please log in.", "success")
         return redirect(url_for('login'))
 
@@ -99,13 +340,17 @@ def sign_up():
 
 
 @app.route('/upload', methods=['GET', 'POST'])
-def upload():
+def upload():  # pylint: disable=too-many-return-statements
     """
     Handle file uploads and forward them to the ML container for processing.
     """
     if request.method == 'POST':
         # Handle image from the file upload form
         if 'file' in request.files:
+            files = [f for f in request.files.getlist('file') if f.filename]
+            if len(files) > 1 or (files and is_archive(files[0].filename)):
+                return upload_batch(files)
+
             file = request.files['file']
 
             if file.filename == '':
@@ -113,22 +358,24 @@ def upload():
                 return redirect(request.url)
 
             if file and allowed_file(file.filename):
-                # Save the file locally
+                # Read the upload once and save those bytes locally
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
+                with STAGE_SECONDS.time('read_upload'):
+                    image_bytes = file.read()
+                if too_many_pixels(image_bytes, MAX_IMAGE_PIXELS):
+                    flash("Image is too large.", "error")
+                    return redirect(url_for('upload'))
+                key = save_upload(filename, image_bytes)
 
-                # Read the file and encode it as base64
-                try:
-                    with open(filepath, "rb") as image_file:
-                        image_data = base64.b64encode(image_file.read()).decode('latin-1')
+                if ASYNC_UPLOADS:
+                    return enqueue_upload(image_bytes, filename, key)
 
-                    # Send the image data to the ML container
-                    response = requests.post(
-                        ML_CLIENT_URL,
-                        json={"image": image_data},
-                        timeout=10
-                    )
+                try:
+                    # Send the raw image bytes to the ML container
+                    with STAGE_SECONDS.time('ml_request'):
+                        response = ml_service.process(
+                            image_bytes, image_mimetype(filename), user=current_user()
+                        )
 
                     if response.status_code != 200:
                         flash(f"ML error: {response.json().get('message', 'Unknown error')}", "error")
@@ -136,11 +383,12 @@ def upload():
 
                     # Save analysis results to the session
                     response_data = response.json()
+                    record_faces(response_data)
                     if response_data.get("results") is not None:
-                        # session to large is invalid, only store name
-                        response_data['results']['image'] = filename
+                        # the analysis page shows the saved upload by its key
+                        response_data['results']['image'] = key
                     session['analysis'] = response_data
-                    session['filename'] = filename
+                    session['filename'] = key
                     return redirect(url_for('analysis'))
 
                 except requests.exceptions.RequestException as e:
@@ -153,11 +401,171 @@ def upload():
     return render_template('upload.html')
 
 
+@app.errorhandler(413)
+def upload_too_large(_error):
+    """
+    Uploads over MAX_UPLOAD_BYTES: JSON clients get 413, browsers the form.
+    """
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'message': 'Upload too large'}), 413
+    flash("Upload is too large.", "error")
+    return redirect(url_for('upload'))
+
+
+def upload_batch(files):
+    """
+    Analyze several images (or zip archives of images) and stream the
+    results back as each batch comes back from the ML container.
+    """
+    for file in files:
+        if is_archive(file.filename) and not zipfile.is_zipfile(file.stream):
+            flash(f"{file.filename} is not a valid zip archive.", "error")
+            return redirect(url_for('upload'))
+
+    results = analyze_batch(iter_uploaded_images(files), current_user())
+    if request.accept_mimetypes.best == 'application/json':
+        lines = (json.dumps(result) + '\n' for result in results)
+        return app.response_class(stream_with_context(lines), mimetype='application/x-ndjson')
+    return app.response_class(stream_template('batch_analysis.html', results=results))
+
+
+def iter_uploaded_images(files):
+    """
+    Yield (filename, image_bytes) for every image in the uploaded files,
+    reading zip archives one member at a time.
+    """
+    count = 0
+    for file in files:
+        if is_archive(file.filename):
+            images = iter_archive_images(file.stream)
+        elif allowed_file(file.filename):
+            images = [(secure_filename(file.filename), file.read())]
+        else:
+            continue
+        for image in images:
+            if count >= MAX_BATCH_IMAGES:
+                return
+            count += 1
+            yield image
+
+
+def iter_archive_images(stream):
+    """
+    Yield (filename, image_bytes) for the images inside a zip archive.
+    """
+    with zipfile.ZipFile(stream) as archive:
+        for member in archive.infolist():
+            filename = secure_filename(os.path.basename(member.filename))
+            if member.is_dir() or not allowed_file(filename):
+                continue
+            if member.file_size > MAX_ARCHIVE_MEMBER_BYTES:
+                continue
+            yield filename, archive.read(member)
+
+
+def analyze_batch(images, user=None):
+    """
+    Save the images locally and send them to the ML container
+    ML_BATCH_SIZE at a time, yielding one result per image.
+    """
+    batch, keys = [], []
+    for filename, image_bytes in images:
+        keys.append(save_upload(filename, image_bytes))
+        batch.append((filename, image_bytes, image_mimetype(filename)))
+        if len(batch) == ML_BATCH_SIZE:
+            yield from with_upload_keys(process_batch(batch, user), keys)
+            batch, keys = [], []
+    if batch:
+        yield from with_upload_keys(process_batch(batch, user), keys)
+
+
+def with_upload_keys(results, keys):
+    """
+    Tag each batch result with the stored key of its image.
+    """
+    for result, key in zip(results, keys):
+        result['image'] = key
+        yield result
+
+
+def process_batch(batch, user=None):
+    """
+    Analyze one batch of images with a single /process_batch call.
+    Failures are reported per image so the rest of the upload goes on.
+    """
+    try:
+        with STAGE_SECONDS.time('ml_batch_request'):
+            response = ml_service.process_batch(batch, user=user)
+        if response.status_code == 200:
+            results = response.json()['results']
+            for result in results:
+                record_faces(result)
+            return results
+        message = f"ML error: {response.json().get('message', 'Unknown error')}"
+    except requests.exceptions.RequestException as e:
+        message = f"Failed to connect to the ML container: {e}"
+    return [{'filename': filename, 'message': message} for filename, _, _ in batch]
+
+
+def enqueue_upload(image_bytes, filename, key):
+    """
+    Queue an upload for the ML worker. JSON clients get the job id back,
+    browsers are sent to the analysis page which waits for the job.
+    """
+    try:
+        with STAGE_SECONDS.time('enqueue'):
+            # the upload key is the image's SHA-256, as in the ML image store
+            image_ref = job_images.put(image_bytes, key.split('.', 1)[0])
+            job_id = enqueue_job(
+                jobs_collection, image_ref, image_mimetype(filename), filename, current_user()
+            )
+    except (PyMongoError, DocumentTooLarge) as e:
+        print(f" * Could not queue upload: {e}")
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'message': 'Could not queue the upload, please try again'}), 503
+        flash("Could not queue the upload, please try again.", "error")
+        return redirect(url_for('upload'))
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('job_status_api', job_id=job_id),
+        }), 202
+
+    session.pop('analysis', None)
+    session['job_id'] = job_id
+    session['filename'] = key
+    return redirect(url_for('analysis'))
+
+
+@app.route('/jobs/<job_id>')
+def job_status_api(job_id):
+    """
+    Report the status of a queued upload, with its results once done.
+    """
+    job = get_job(jobs_collection, job_id)
+    if job is None:
+        return jsonify({'message': 'Unknown job'}), 404
+    return jsonify(job_status(job))
+
+
 @app.route('/analysis')
 def analysis():
     """
     Display analysis results.
     """
+    if 'job_id' in session and not session.get('analysis'):
+        job = get_job(jobs_collection, session['job_id'])
+        if job is None or job['status'] == JOB_FAILED:
+            session.pop('job_id', None)
+            flash("Image analysis failed. Please try again.", "error")
+            return redirect(url_for('upload'))
+        if job['status'] != JOB_DONE:
+            return render_template('processing.html', status=job['status'])
+        session.pop('job_id')
+        session['analysis'] = job.get('result') or {}
+
     analysis_results = session.get('analysis', {})
     filename = session.get('filename', '')
 
@@ -173,11 +581,113 @@ def analysis():
         'analysis.html',
         filename=filename,
         faces=results.get("faces_detected", 0),
-        emotions=results.get("emotions", [])
+        emotions=results.get("emotions", []),
+        boxes=results.get("faces", []),
+    )
+
+
+@app.route('/uploads/<key>')
+def upload_image(key):
+    """
+    Serve a stored upload. Its name is its hash, which is also its ETag.
+    """
+    path = upload_path(app.config['UPLOAD_FOLDER'], key)
+    if path is None:
+        abort(404)
+    return send_immutable(path, key)
+
+
+@app.route('/uploads/<key>/thumb/<int:size>')
+def upload_thumbnail(key, size):
+    """
+    Serve a thumbnail of a stored upload, made once and then read from disk.
+    """
+    try:
+        path = thumbnail_path(app.config['UPLOAD_FOLDER'], key, size)
+    except OSError:
+        return jsonify({'message': 'Not an image'}), 415
+    if path is None:
+        abort(404)
+    return send_immutable(path, thumbnail_name(key, size))
+
+
+def stored_faces(key):
+    """
+    Face boxes of the latest analysis of an upload, or None. The ML
+    service stores the image under the same SHA-256 as the upload key.
+    """
+    try:
+        document = results_collection.find_one(
+            {'image_ref': key.split('.', 1)[0], 'faces': {'$exists': True}},
+            {'faces': 1}, sort=[('_id', -1)],
+        )
+    except PyMongoError as e:
+        print(f" * Face lookup failed: {e}")
+        return None
+    return document['faces'] if document else None
+
+
+@app.route('/uploads/<key>/faces/<int:size>')
+def upload_faces_thumbnail(key, size):
+    """
+    Serve a thumbnail with the face boxes of the upload's stored analysis
+    drawn on, made once and then read from disk. Until the analysis is
+    saved this is the plain thumbnail, sent uncached.
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    try:
+        path = annotated_thumbnail_path(folder, key, size, lambda: stored_faces(key))
+        plain = None if path is not None else thumbnail_path(folder, key, size)
+    except OSError:
+        return jsonify({'message': 'Not an image'}), 415
+    if path is not None:
+        return send_immutable(path, thumbnail_name(key, size, faces=True))
+    if plain is None:
+        abort(404)
+    return send_file(plain, mimetype='image/jpeg', max_age=0)
+
+
+@app.route('/history')
+def history():
+    """
+    The signed-in user's past analyses, newest first, one page at a time
+    (?cursor=<next_cursor>&limit=N). JSON clients get the page and the
+    cursor of the next one.
+    """
+    user = current_user()
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    if user is None:
+        if wants_json:
+            return jsonify({'message': 'Login required'}), 401
+        flash("Please log in to see your history.", "error")
+        return redirect(url_for('login'))
+
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    try:
+        entries, next_cursor = get_history(
+            history_collection, user, request.args.get('cursor'), limit
+        )
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+    stats = get_stats(stats_collection, user)
+
+    if wants_json:
+        if stats['last_analysis_at'] is not None:
+            stats['last_analysis_at'] = stats['last_analysis_at'].isoformat()
+        return jsonify({
+            'entries': [history_json(entry) for entry in entries],
+            'next_cursor': next_cursor,
+            'stats': stats,
+        })
+    return render_template(
+        'history.html', user=user, entries=entries, next_cursor=next_cursor, stats=stats
     )
 
 
 
 
 if __name__ == "__main__":
+    threading.Thread(target=ensure_indexes, daemon=True).start()
+    if ML_HEALTH_INTERVAL > 0:
+        ml_service.start_health_checks(ML_HEALTH_INTERVAL)
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,91 @@
+"""
+Read side of the per-user analysis history written by the ML service.
+
+History pages use keyset pagination on the (user, created_at, _id) index:
+the cursor is the sort key of the last entry shown, so page N costs the
+same as page 1 instead of skipping over everything before it. Summary
+figures come from the user's precomputed user_stats document.
+"""
+
+import base64
+import datetime
+import json
+from bson import ObjectId
+from bson.errors import InvalidId
+
+HISTORY_SORT = [('created_at', -1), ('_id', -1)]
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(entry):
+    """
+    Opaque cursor pointing just after this history entry.
+    """
+    key = {'t': entry['created_at'].isoformat(), 'id': str(entry['_id'])}
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    (created_at, _id) from a cursor, or None if it is not a valid one.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(key['t']), ObjectId(key['id'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        return None
+
+
+def get_history(history_collection, user, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of a user's analyses, newest first.
+    Returns (entries, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for a cursor that cannot be decoded.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {'user': user}
+    if cursor:
+        key = decode_cursor(cursor)
+        if key is None:
+            raise ValueError('Invalid cursor')
+        created_at, entry_id = key
+        query['$or'] = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': entry_id}},
+        ]
+    # one extra entry tells whether there is a next page
+    entries = list(history_collection.find(query).sort(HISTORY_SORT).limit(limit + 1))
+    next_cursor = encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+    return entries[:limit], next_cursor
+
+
+def get_stats(stats_collection, user):
+    """
+    Summary of all of a user's analyses: counts, mean score per emotion
+    and how often each emotion was the dominant one.
+    """
+    stats = stats_collection.find_one({'_id': user}) or {}
+    faces = stats.get('faces', 0)
+    sums = stats.get('emotion_sums', {})
+    return {
+        'analyses': stats.get('analyses', 0),
+        'faces': faces,
+        'mean_emotions': {label: total / faces for label, total in sums.items()} if faces else {},
+        'dominant': stats.get('dominant', {}),
+        'last_analysis_at': stats.get('last_analysis_at'),
+    }
+
+
+def history_json(entry):
+    """
+    JSON-friendly view of a history entry.
+    """
+    return {
+        'id': str(entry['_id']),
+        'created_at': entry['created_at'].isoformat(),
+        'result_id': entry.get('result_id'),
+        'message': entry.get('message'),
+        'faces_detected': entry.get('faces_detected', 0),
+        'emotions': entry.get('emotions', []),
+    }
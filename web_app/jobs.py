@@ -0,0 +1,89 @@
+"""
+MongoDB-backed queue of image analysis jobs.
+
+The web app only enqueues jobs and reads their status; the ML worker
+(machine-learning-client/worker.py) claims queued jobs in bulk, runs them
+and writes the results back to the same document.
+
+A job does not carry the image: MongoDB documents stop at 16 MB and
+uploads may be far larger. The bytes go to the GridFS bucket the ML
+service keeps its images in (image_store.py), under their SHA-256, and
+the job only names that digest.
+"""
+
+import datetime
+import gridfs
+from bson import ObjectId
+from bson.errors import InvalidId
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+# the ML service's GridFS image store bucket
+IMAGE_BUCKET = 'images'
+
+
+class JobImages:
+    """
+    Image bytes for queued jobs, in the ML service's GridFS bucket and
+    keyed by SHA-256 digest like the images it stores itself.
+    """
+
+    def __init__(self, database, bucket=IMAGE_BUCKET):
+        self.fs = gridfs.GridFS(database, collection=bucket)
+
+    def put(self, image_bytes, digest):
+        """
+        Store the bytes unless an image with this digest is already there.
+        """
+        if not self.fs.exists(digest):
+            try:
+                self.fs.put(image_bytes, _id=digest)
+            except gridfs.errors.FileExists:
+                pass  # stored by a concurrent upload
+        return digest
+
+
+def enqueue_job(jobs_collection, image_ref, content_type, filename, user=None):
+    """
+    Queue an image already stored in JobImages under the digest image_ref
+    and return the job id as a string. The worker adds the result to the
+    user's history when one is given.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    result = jobs_collection.insert_one({
+        'status': JOB_QUEUED,
+        'image_ref': image_ref,
+        'content_type': content_type,
+        'filename': filename,
+        'user': user,
+        'attempts': 0,
+        'created_at': now,
+        'updated_at': now,
+    })
+    return str(result.inserted_id)
+
+
+def get_job(jobs_collection, job_id):
+    """
+    Return the job document without its image (jobs queued before
+    image_ref carried the bytes), or None if there is none.
+    """
+    try:
+        object_id = ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+    return jobs_collection.find_one({'_id': object_id}, {'image': 0})
+
+
+def job_status(job):
+    """
+    JSON-friendly view of a job for the poll endpoint.
+    """
+    status = {'job_id': str(job['_id']), 'status': job['status']}
+    if job['status'] == JOB_DONE:
+        status['result'] = job.get('result')
+    if job['status'] == JOB_FAILED:
+        status['error'] = job.get('error')
+    return status
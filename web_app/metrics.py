@@ -0,0 +1,260 @@
+"""
+In-process latency and size metrics in the Prometheus text format.
+
+Every histogram keeps cumulative bucket counts, a sum and a count, plus a
+ring of its most recent observations from which p50/p95/p99 are computed
+when /metrics is scraped. Recording a value is a bisect, three additions
+and a deque append under a lock, so it is cheap enough for the hot path.
+
+Each process has its own registry; a scrape sees the process that
+answered it.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from collections import deque
+from itertools import accumulate
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = tuple(2**power for power in range(10, 26, 2))  # 1 KiB .. 32 MiB
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 12, 20, 50)
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOW = 1024
+
+
+class Series:
+    """
+    Observations of one histogram for one set of label values.
+    """
+
+    def __init__(self, buckets, window=WINDOW):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Record one value.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.recent.append(value)
+
+    def snapshot(self):
+        """
+        (cumulative bucket counts, sum, count, quantiles) at this moment.
+        """
+        with self._lock:
+            counts = list(self.bucket_counts)
+            total, count, recent = self.sum, self.count, list(self.recent)
+        return list(accumulate(counts)), total, count, nearest_rank_quantiles(recent)
+
+
+def nearest_rank_quantiles(values):
+    """
+    Nearest-rank QUANTILES of a list of values (zeros when empty).
+    """
+    values = sorted(values)
+    if not values:
+        return {quantile: 0.0 for quantile in QUANTILES}
+    last = len(values) - 1
+    return {
+        quantile: values[min(last, int(quantile * len(values)))]
+        for quantile in QUANTILES
+    }
+
+
+class StageTimer:
+    """
+    Context manager that records the seconds spent in its block.
+    """
+
+    __slots__ = ("series", "start")
+
+    def __init__(self, series):
+        self.series = series
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.series.observe(time.perf_counter() - self.start)
+
+
+class Histogram:
+    """
+    A named histogram with one Series per combination of label values.
+    """
+
+    def __init__(self, name, documentation, buckets, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        The Series for these label values, created on first use.
+        """
+        series = self.series.get(values)
+        if series is None:
+            with self._lock:
+                series = self.series.setdefault(values, Series(self.buckets))
+        return series
+
+    def observe(self, value, *label_values):
+        """
+        Record one value.
+        """
+        self.labels(*label_values).observe(value)
+
+    def time(self, *label_values):
+        """
+        Time a block: with histogram.time("save"): ...
+        """
+        return StageTimer(self.labels(*label_values))
+
+    def timed(self, *label_values):
+        """
+        Decorator timing every call: @histogram.timed("save").
+        """
+        series = self.labels(*label_values)
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with StageTimer(series):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def render(self):
+        """
+        Prometheus text lines: the histogram and a <name>_quantile gauge.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        quantile_lines = [
+            f"# HELP {self.name}_quantile {self.documentation} "
+            f"(quantiles of the last {WINDOW} observations)",
+            f"# TYPE {self.name}_quantile gauge",
+        ]
+        for values, series in sorted(self.series.items()):
+            labels = [
+                f'{name}="{value}"' for name, value in zip(self.label_names, values)
+            ]
+            series_lines, series_quantiles = self._render_series(labels, series)
+            lines.extend(series_lines)
+            quantile_lines.extend(series_quantiles)
+        return lines + quantile_lines
+
+    def _render_series(self, labels, series):
+        cumulative, total, count, quantiles = series.snapshot()
+        bounds = [format_value(bound) for bound in self.buckets] + ["+Inf"]
+        lines = [
+            f"{self.name}_bucket{label_set(labels, 'le', bound)} {bucket_count}"
+            for bound, bucket_count in zip(bounds, cumulative)
+        ]
+        lines.append(f"{self.name}_sum{label_set(labels)} {format_value(total)}")
+        lines.append(f"{self.name}_count{label_set(labels)} {count}")
+        quantile_lines = [
+            f"{self.name}_quantile{label_set(labels, 'quantile', quantile)} "
+            f"{format_value(value)}"
+            for quantile, value in quantiles.items()
+        ]
+        return lines, quantile_lines
+
+
+def label_set(labels, name=None, value=None):
+    """
+    Format labels as {a="1",b="2"}, or nothing when there are none.
+    name/value adds one more label.
+    """
+    if name is not None:
+        labels = labels + [f'{name}="{value}"']
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value):
+    """
+    Prometheus number formatting.
+    """
+    return repr(float(value))
+
+
+class Registry:
+    """
+    The histograms a service exposes on /metrics.
+    """
+
+    def __init__(self):
+        self.histograms = []
+
+    def histogram(self, name, documentation, buckets, label_names=()):
+        """
+        Create and register a histogram.
+        """
+        histogram = Histogram(name, documentation, buckets, label_names)
+        self.histograms.append(histogram)
+        return histogram
+
+    def render(self):
+        """
+        The whole registry in the Prometheus text exposition format.
+        """
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "web_request_seconds",
+    "Seconds spent answering each endpoint.",
+    LATENCY_BUCKETS,
+    ("endpoint",),
+)
+STAGE_SECONDS = registry.histogram(
+    "web_stage_seconds",
+    "Seconds spent in each stage of the upload path.",
+    LATENCY_BUCKETS,
+    ("stage",),
+)
+IMAGE_BYTES = registry.histogram(
+    "web_image_bytes", "Size of the uploaded images.", SIZE_BUCKETS
+)
+FACES_PER_IMAGE = registry.histogram(
+    "web_faces_per_image", "Faces the ML service found per uploaded image.", COUNT_BUCKETS
+)
@@ -0,0 +1,413 @@
+"""
+Client for the ML container.
+
+Keeps a pooled keep-alive requests.Session, gives every call a deadline,
+retries connection errors and 5xx responses with jittered backoff, and
+stops calling a failing ML service for a while (circuit breaker) so web
+workers fail fast instead of waiting out the timeout.
+
+Every attempt tells the ML service how much of the deadline is left
+(X-Deadline-Ms) so it can drop work nobody will wait for. A 503 with
+Retry-After means the service is busy, not broken: it is retried after
+the requested delay if the deadline allows, and does not count against
+the circuit breaker. Neither does a 504: the service dropped the call
+because the deadline passed, so it is not retried either.
+
+Several ML replicas can be given. Each call goes to the better of two
+randomly picked replicas (power of two choices): fewer requests in
+flight, then lower recent latency. Each replica has its own circuit
+breaker, so one that keeps failing is ejected and re-admitted by a
+half-open trial call, and an optional background thread polls every
+replica's /readyz and skips those that are not ready. A retry goes to a
+different replica when there is one.
+"""
+
+import math
+import random
+import threading
+import time
+from collections import namedtuple
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEADLINE_HEADER = 'X-Deadline-Ms'
+# weight of the newest response in a replica's moving average latency
+LATENCY_EWMA_WEIGHT = 0.3
+# an unused replica's latency estimate halves this often, so a replica
+# that was slow once gets tried again later
+LATENCY_HALF_LIFE = 10.0
+HEALTH_TIMEOUT = 2.0
+
+# Connection pool size, per-call timeout, retries with their backoff base,
+# each replica's circuit breaker and an explicit /process_batch URL
+MLServiceConfig = namedtuple(
+    'MLServiceConfig',
+    ['pool_size', 'timeout', 'retries', 'backoff', 'failure_threshold', 'reset_timeout',
+     'batch_url'],
+    defaults=(10, 10.0, 2, 0.2, 5, 30.0, None))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of calling the ML service while the circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Open after failure_threshold consecutive failures; after reset_timeout
+    seconds let a single trial call through (half-open) and close again if
+    it succeeds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        'closed', 'open' or 'half-open'.
+        """
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """
+        Whether a call may be made now.
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        """
+        Close the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        """
+        Count a failure, opening (or re-opening) the circuit when needed.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class Backend:  # pylint: disable=too-many-instance-attributes
+    """
+    One ML replica: its endpoints, requests in flight, moving average
+    latency, /readyz health and circuit breaker.
+    """
+
+    def __init__(self, url, breaker, batch_url=None):
+        base = url.rsplit('/', 1)[0]
+        self.url = url
+        self.batch_url = batch_url or base + '/process_batch'
+        self.health_url = base + '/readyz'
+        self.breaker = breaker
+        self.healthy = True
+        self.outstanding = 0
+        self.latency = 0.0
+        self.last_used = 0.0
+
+    def expected_latency(self, now):
+        """
+        Moving average latency, decayed while the replica is not used.
+        """
+        idle = max(0.0, now - self.last_used)
+        return self.latency * math.pow(0.5, idle / LATENCY_HALF_LIFE)
+
+    def stats(self):
+        """
+        JSON-friendly state for /ml/backends.
+        """
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'circuit': self.breaker.state,
+            'outstanding': self.outstanding,
+            'latency_ms': round(self.latency * 1000, 1),
+        }
+
+
+class LoadBalancer:
+    """
+    Power-of-two-choices selection over the replicas that are ready and
+    whose circuit is not open.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self._lock = threading.Lock()
+
+    def choose(self, exclude=()):
+        """
+        Pick a replica for one attempt and count it as in flight, or return
+        None when every circuit is open. Replicas in exclude (already
+        failed during this call) are avoided unless nothing else is left.
+        """
+        with self._lock:
+            candidates = [backend for backend in self.backends
+                          if backend.breaker.state != 'open']
+            candidates = ([backend for backend in candidates if backend not in exclude]
+                          or candidates)
+            # not-ready replicas are a last resort rather than an outage
+            candidates = [backend for backend in candidates if backend.healthy] or candidates
+            now = time.monotonic()
+            while candidates:
+                pair = random.sample(candidates, min(2, len(candidates)))
+                backend = min(pair, key=lambda item: (item.outstanding,
+                                                      item.expected_latency(now)))
+                if backend.breaker.allow():
+                    backend.outstanding += 1
+                    backend.last_used = now
+                    return backend
+                candidates.remove(backend)  # another call holds its half-open trial
+            return None
+
+    def release(self, backend, seconds=None):
+        """
+        Mark an attempt finished; seconds updates the latency average.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            if seconds is not None:
+                backend.latency += LATENCY_EWMA_WEIGHT * (seconds - backend.latency)
+                backend.last_used = time.monotonic()
+
+
+def parse_urls(urls):
+    """
+    A list of ML /process URLs from a list or a comma-separated string.
+    """
+    if isinstance(urls, str):
+        urls = urls.split(',')
+    return [url.strip() for url in urls if url.strip()]
+
+
+def user_headers(user):
+    """
+    Headers naming the signed-in user an analysis is made for.
+    """
+    return {'X-User': user} if user else {}
+
+
+class MLServiceClient:
+    """
+    Pooled HTTP client for the /process and /process_batch endpoints of
+    one or more ML replicas. url is a /process URL, a comma-separated
+    string of them or a list.
+    """
+
+    def __init__(self, url, config=None, **settings):
+        """
+        Settings come from config (an MLServiceConfig), with any given as
+        keywords taking precedence.
+        """
+        config = (config or MLServiceConfig())._replace(**settings)
+        urls = parse_urls(url)
+        self.backends = [
+            Backend(backend_url,
+                    CircuitBreaker(config.failure_threshold, config.reset_timeout),
+                    config.batch_url)
+            for backend_url in urls
+        ]
+        self.balancer = LoadBalancer(self.backends)
+        self.timeout = config.timeout
+        self.retries = config.retries
+        self.backoff = config.backoff
+        self.session = requests.Session()
+        # retries are handled below, with the deadline in mind
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=config.pool_size,
+                              max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def breaker(self):
+        """
+        Circuit breaker of the first replica (the only one in most setups).
+        """
+        return self.backends[0].breaker
+
+    def check_health(self):
+        """
+        Poll every replica's /readyz once; not-ready replicas are skipped
+        until they pass again.
+        """
+        for backend in self.backends:
+            try:
+                healthy = self.session.get(backend.health_url,
+                                           timeout=HEALTH_TIMEOUT).status_code == 200
+            except requests.exceptions.RequestException:
+                healthy = False
+            if healthy != backend.healthy:
+                print(f" * ML replica {backend.url} {'re-admitted' if healthy else 'ejected'}")
+            backend.healthy = healthy
+
+    def start_health_checks(self, interval=5.0):
+        """
+        Run check_health every interval seconds in a daemon thread.
+        """
+        def run():
+            while True:
+                self.check_health()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name='ml-health', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """
+        State of every replica.
+        """
+        return [backend.stats() for backend in self.backends]
+
+    def _sleep_before_retry(self, attempt, deadline):
+        """
+        Full-jitter exponential backoff, never sleeping past the deadline.
+        Returns False when there is no time left for another attempt.
+        """
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    def _sleep_for_retry_after(self, response, attempt, deadline):
+        """
+        Wait as long as an overloaded service asked (Retry-After seconds),
+        or back off as usual if it named no delay. Returns False when the
+        deadline would pass first.
+        """
+        try:
+            delay = float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return self._sleep_before_retry(attempt, deadline)
+        if time.monotonic() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    def process(self, image_bytes, content_type, timeout=None, user=None):
+        """
+        POST an image to the ML service and return the response.
+
+        The whole call, retries included, finishes within timeout seconds.
+        Raises requests exceptions (CircuitOpenError when failing fast).
+        With a user the ML service adds the analysis to their history.
+        """
+        headers = {'Content-Type': content_type, **user_headers(user)}
+        return self._post('url', timeout, data=image_bytes, headers=headers)
+
+    def process_batch(self, images, timeout=None, user=None):
+        """
+        POST several images to /process_batch in one multipart request.
+        images is a list of (filename, image_bytes, content_type).
+        Same deadline, retry and circuit breaker rules as process().
+        """
+        files = [('images', image) for image in images]
+        return self._post('batch_url', timeout, files=files, headers=user_headers(user))
+
+    def _retry(self, attempt, deadline, busy_response=None):
+        """
+        Whether to make another attempt, after waiting for it: as long as a
+        busy_response asked, or with the usual backoff. False when the
+        retries are used up or the deadline would pass first.
+        """
+        if attempt >= self.retries:
+            return False
+        if busy_response is not None:
+            return self._sleep_for_retry_after(busy_response, attempt, deadline)
+        return self._sleep_before_retry(attempt, deadline)
+
+    @staticmethod
+    def _classify(backend, response):
+        """
+        Record a response with the replica's circuit breaker and return
+        'busy' (shed with Retry-After), 'failed' (any other 5xx) or 'done'.
+        """
+        if response.status_code == 503 and 'Retry-After' in response.headers:
+            # shed by admission control: alive, just busy
+            backend.breaker.record_success()
+            return 'busy'
+        if response.status_code >= 500 and response.status_code != 504:
+            backend.breaker.record_failure()
+            return 'failed'
+        # a 504 was dropped because our deadline passed while it was
+        # queued: busy, not broken, and there is no time left to retry
+        backend.breaker.record_success()
+        return 'done'
+
+    def _send(self, backend, endpoint, remaining, headers, kwargs):
+        """
+        One POST to a chosen replica, with the time left as its deadline.
+        """
+        attempt_headers = {**(headers or {}), DEADLINE_HEADER: str(int(remaining * 1000))}
+        started = time.monotonic()
+        try:
+            return self.session.post(
+                getattr(backend, endpoint), timeout=remaining, headers=attempt_headers,
+                **kwargs
+            )
+        except BaseException:
+            backend.breaker.record_failure()
+            raise
+        finally:
+            # always, or the replica would look busy (and its trial taken) forever
+            self.balancer.release(backend, time.monotonic() - started)
+
+    def _post(self, endpoint, timeout, headers=None, **kwargs):
+        """
+        POST to the given endpoint attribute ('url' or 'batch_url') of a
+        replica chosen for each attempt.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        failed = set()
+        while True:
+            # checked before choosing, so a half-open trial is never taken and dropped
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.exceptions.Timeout('ML service deadline exceeded')
+            backend = self.balancer.choose(exclude=failed)
+            if backend is None:
+                raise CircuitOpenError('ML service unavailable (circuit open)')
+
+            try:
+                response = self._send(backend, endpoint, remaining, headers, kwargs)
+            except requests.exceptions.RequestException:
+                failed.add(backend)
+                if not self._retry(attempt, deadline):
+                    raise
+                attempt += 1
+                continue
+
+            outcome = self._classify(backend, response)
+            if outcome == 'done':
+                return response
+            failed.add(backend)
+            if not self._retry(attempt, deadline, response if outcome == 'busy' else None):
+                return response
+            attempt += 1
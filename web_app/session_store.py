@@ -0,0 +1,218 @@
+"""
+Server-side sessions: the cookie carries only a random session id.
+
+Session data (the signed-in user, flashed messages, the last analysis
+with every face's emotions) is kept in MongoDB under that id, with an
+in-process LRU in front so a burst of requests reads the database once.
+The LRU only trusts an entry for a few seconds (memory_ttl), so a change
+or logout made through another process or replica is seen soon after.
+Each entry expires SESSION_TTL seconds after it was last saved; MongoDB's
+TTL index removes expired documents, and reads ignore them before it does.
+
+Signing in moves the session to a new id (ServerSession.regenerate), so
+an id planted in a browser before login is never authenticated.
+
+Values are serialized with Flask's own session serializer, so anything
+that worked in the cookie session round-trips unchanged.
+"""
+
+import datetime
+import logging
+import secrets
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from pymongo.errors import PyMongoError
+from werkzeug.datastructures import CallbackDict
+from lru_cache import LRUCache
+
+
+def new_session_id():
+    """
+    An unguessable session id (256 random bits).
+    """
+    return secrets.token_urlsafe(32)
+
+
+def utcnow():
+    """Timezone-aware current time."""
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class SessionStore:
+    """
+    Session payloads by id: an in-process LRU over a MongoDB collection.
+    With collection=None the LRU is the only tier (tests, single process)
+    and keeps entries for the whole ttl.
+    """
+
+    def __init__(
+        self, collection, maxsize=1024, ttl=86400.0, memory_ttl=5.0, logger=None
+    ):  # pylint: disable=too-many-arguments
+        self.collection = collection
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger(__name__)
+        # sid -> (serialized data, expires_at)
+        self.memory = LRUCache(maxsize, ttl if collection is None else memory_ttl)
+
+    def ensure_indexes(self):
+        """
+        TTL index so MongoDB deletes expired sessions by itself.
+        """
+        if self.collection is not None:
+            self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def _load(self, sid):
+        entry = self.memory.get(sid)
+        if entry is not None or self.collection is None:
+            return entry
+        try:
+            document = self.collection.find_one({'_id': sid, 'expires_at': {'$gt': utcnow()}})
+        except PyMongoError as e:
+            self.logger.warning('Session lookup failed: %s', e)
+            return None
+        if document is None:
+            return None
+        expires_at = document['expires_at'].replace(tzinfo=datetime.timezone.utc)
+        entry = (document['data'], expires_at)
+        self.memory.put(sid, entry)
+        return entry
+
+    def get(self, sid):
+        """
+        The session data for an id, or None if unknown or expired.
+        """
+        entry = self._load(sid)
+        if entry is None:
+            return None
+        return session_json_serializer.loads(entry[0])
+
+    def put(self, sid, data):
+        """
+        Save session data and restart its time to live.
+        """
+        self._save(sid, session_json_serializer.dumps(dict(data)))
+
+    def touch(self, sid):
+        """
+        Restart the time to live of a session that is read but not changed,
+        once half of it has passed, so active sessions do not expire.
+        """
+        entry = self._load(sid)
+        if entry is not None and entry[1] - utcnow() < datetime.timedelta(seconds=self.ttl / 2):
+            self._save(sid, entry[0])
+
+    def _save(self, sid, payload):
+        expires_at = utcnow() + datetime.timedelta(seconds=self.ttl)
+        self.memory.put(sid, (payload, expires_at))
+        if self.collection is None:
+            return
+        try:
+            self.collection.replace_one(
+                {'_id': sid}, {'data': payload, 'expires_at': expires_at}, upsert=True
+            )
+        except PyMongoError as e:
+            # still served from memory by this process, for memory_ttl
+            self.logger.warning('Session save failed: %s', e)
+
+    def delete(self, sid):
+        """
+        Forget a session.
+        """
+        self.memory.pop(sid)
+        if self.collection is None:
+            return
+        try:
+            self.collection.delete_one({'_id': sid})
+        except PyMongoError as e:
+            self.logger.warning('Session delete failed: %s', e)
+
+
+class ServerSession(CallbackDict, SessionMixin):  # pylint: disable=too-many-ancestors
+    """
+    Session dict that remembers its id and whether it was changed.
+    """
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+            session.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """
+        Move the session to a new id; call when its privileges change
+        (signing in). The old id is deleted when the session is saved.
+        """
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = new_session_id()
+        self.new = True
+        self.modified = True
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface backed by a SessionStore. Sessions are only
+    written when they change, and the cookie is only set when the id is
+    new or the cookie needs refreshing.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=new_session_id(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.replaced_sid:
+            self.store.delete(session.replaced_sid)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.store.put(session.sid, session)
+        elif not session.new:
+            self.store.touch(session.sid)
+        if session.new or session.modified or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
@@ -1,12 +1,17 @@
 import pytest
 from app import app
+from session_store import ServerSideSessionInterface, SessionStore
+
+# sessions are kept in memory only, so tests never wait for MongoDB
+app.session_interface = ServerSideSessionInterface(SessionStore(None))
 
 
 @pytest.fixture
-def client():
+def client(tmp_path):
     app.config['TESTING'] = True
     app.config['WTF_CSRF_ENABLED'] = False
-    app.config['UPLOAD_FOLDER'] = 'tests/uploads'
+    # uploads are stored by content hash; keep each test's files apart
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
     app.config['SECRET_KEY'] = 'test_secret_key'
     with app.test_client() as client:
         yield client
@@ -0,0 +1,71 @@
+"""
+Stand-in ML replicas for load balancing tests.
+
+StubMLServer answers /process and /process_batch after a fixed delay with
+a fixed status, and /readyz with 200 or 503, on a free local port:
+
+    with StubMLServer(delay=0.2) as slow, StubMLServer() as fast:
+        client = MLServiceClient([slow.url, fast.url])
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubMLServer:
+    """
+    A threaded HTTP server on 127.0.0.1 counting the analyses it served.
+    """
+
+    def __init__(self, delay=0.0, status=200, ready=True):
+        self.delay = delay
+        self.status = status
+        self.ready = ready
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """The /process URL of this replica."""
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/process'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                self._reply(200 if stub.ready else 503, {'status': 'ready'})
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:  # pylint: disable=protected-access
+                    stub.requests += 1
+                time.sleep(stub.delay)
+                self._reply(stub.status, {'message': 'No faces detected'})
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from ml_service import Backend, CircuitBreaker, LoadBalancer, MLServiceClient
+from tests.ml_stub import StubMLServer
+
+
+def make_backends(count):
+    return [Backend(f'http://ml{index}/process', CircuitBreaker(failure_threshold=1))
+            for index in range(count)]
+
+
+def test_backend_urls():
+    backend = make_backends(1)[0]
+    assert backend.batch_url == 'http://ml0/process_batch'
+    assert backend.health_url == 'http://ml0/readyz'
+
+
+def test_choose_prefers_fewer_outstanding_then_lower_latency():
+    """Test power of two choices picks the less loaded, then faster replica."""
+    busy, idle = make_backends(2)
+    busy.outstanding = 3
+    balancer = LoadBalancer([busy, idle])
+    assert balancer.choose() is idle
+    assert idle.outstanding == 1
+    balancer.release(idle, 0.5)
+    busy.outstanding = 0
+    assert balancer.choose() is busy
+
+
+def test_choose_skips_open_unhealthy_and_failed():
+    """Test ejected replicas are avoided, and used as a last resort only when ready."""
+    broken, unready, failed, good = make_backends(4)
+    broken.breaker.record_failure()
+    unready.healthy = False
+    balancer = LoadBalancer([broken, unready, failed, good])
+    assert {balancer.choose(exclude={failed}) for _ in range(20)} == {good}
+    # with nothing else left an unready replica is still tried
+    assert balancer.choose(exclude={failed, good}) is unready
+    broken_only = LoadBalancer([broken])
+    assert broken_only.choose() is None
+
+
+def test_single_replica_is_retried():
+    """Test retries reuse the only replica even after it failed."""
+    with StubMLServer(status=500) as stub, patch('ml_service.time.sleep'):
+        client = MLServiceClient(stub.url, retries=2, failure_threshold=10)
+        assert client.process(b'img', 'image/jpeg').status_code == 500
+    assert stub.requests == 3
+
+
+def test_routes_around_slow_replica():
+    """Test concurrent load goes mostly to the fast replicas."""
+    with StubMLServer(delay=0.3) as slow, StubMLServer(delay=0.01) as fast, \
+            StubMLServer(delay=0.01) as fast2:
+        client = MLServiceClient(','.join([slow.url, fast.url, fast2.url]), timeout=5)
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            codes = list(pool.map(lambda _: client.process(b'img', 'image/jpeg').status_code,
+                                  range(90)))
+    counts = {'slow': slow.requests, 'fast': fast.requests, 'fast2': fast2.requests}
+    print(f"\nrequests per replica: {counts}")
+    assert codes == [200] * 90
+    assert slow.requests < 0.15 * 90
+    assert fast.requests + fast2.requests > 0.85 * 90
+
+
+def test_failing_replica_is_ejected():
+    """Test a replica answering 500 is ejected and its calls retried elsewhere."""
+    with StubMLServer(status=500) as bad, StubMLServer() as good, \
+            patch('ml_service.time.sleep'):
+        client = MLServiceClient([bad.url, good.url], failure_threshold=2, reset_timeout=60)
+        codes = [client.process(b'img', 'image/jpeg').status_code for _ in range(20)]
+    assert codes == [200] * 20
+    assert bad.requests <= 2
+    assert client.backends[0].breaker.state == 'open'
+
+
+def test_request_errors_release_the_replica():
+    """Test any request error gives the replica back and lets its breaker recover."""
+    client = MLServiceClient(['http://ml0/process', 'http://ml1/process'], retries=1,
+                             failure_threshold=1, reset_timeout=10)
+    client.session.post = MagicMock(side_effect=[
+        requests.exceptions.ChunkedEncodingError('cut'),
+        requests.exceptions.InvalidURL('bad'),
+    ])
+    with patch('ml_service.time.sleep'), pytest.raises(requests.exceptions.InvalidURL):
+        client.process(b'img', 'image/jpeg')
+    assert [backend.outstanding for backend in client.backends] == [0, 0]
+    assert [backend.breaker.state for backend in client.backends] == ['open', 'open']
+
+    client.session.post = MagicMock(return_value=MagicMock(status_code=200, headers={}))
+    for backend in client.backends:
+        backend.breaker.opened_at -= 10
+        # the half-open trial is free again and a good answer closes the circuit
+        client.balancer.backends = [backend]
+        assert client.process(b'img', 'image/jpeg').status_code == 200
+        assert backend.breaker.state == 'closed'
+        assert backend.outstanding == 0
+
+
+def test_health_checks_eject_and_readmit():
+    """Test a replica failing /readyz gets no traffic until it passes again."""
+    with StubMLServer(ready=False) as warming, StubMLServer() as ready:
+        client = MLServiceClient([warming.url, ready.url])
+        client.check_health()
+        assert [backend.healthy for backend in client.backends] == [False, True]
+        for _ in range(10):
+            client.process(b'img', 'image/jpeg')
+        assert warming.requests == 0
+
+        warming.ready = True
+        client.check_health()
+        assert client.backends[0].healthy
+        for _ in range(20):
+            client.process(b'img', 'image/jpeg')
+        assert warming.requests > 0
+    stats = client.stats()
+    assert [item['url'] for item in stats] == [warming.url, ready.url]
+
+
+def test_ml_backends_endpoint(client):
+    response = client.get('/ml/backends')
+    assert response.status_code == 200
+    assert response.get_json()[0]['circuit'] == 'closed'
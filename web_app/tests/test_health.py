@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+# importing the app must not wait for MongoDB
+STARTUP_BUDGET_SECONDS = 2.0
+
+STARTUP_SCRIPT = """
+import os, time
+os.environ['MONGO_URI'] = 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=30000'
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+
+
+def test_startup_time_benchmark():
+    """Test the app imports quickly even when MongoDB is unreachable."""
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout.split()
+    seconds = float(output[-1])
+    print(f"\nweb app import took {seconds:.3f}s")
+    assert seconds < STARTUP_BUDGET_SECONDS
+
+
+def test_healthz(client):
+    """Test liveness answers without the database."""
+    response = client.get('/healthz')
+    assert response.status_code == 200
+    assert response.get_json() == {'status': 'ok'}
+
+
+def test_readyz_reports_database(client, monkeypatch):
+    """Test readiness follows MongoDB reachability."""
+    monkeypatch.setattr('app.database_reachable', lambda: False)
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['checks'] == {'database': False}
+
+    monkeypatch.setattr('app.database_reachable', lambda: True)
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'ready'
@@ -0,0 +1,183 @@
+import datetime
+import io
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+import app as web_app
+from history import decode_cursor, encode_cursor, get_history, get_stats
+
+T0 = datetime.datetime(2024, 11, 1, 12, 0, 0)
+
+
+def make_entries(count):
+    """History entries, newest first, two per timestamp."""
+    return [
+        {
+            '_id': ObjectId(f'{count - index:024x}'),
+            'user': 'alice',
+            'created_at': T0 - datetime.timedelta(minutes=index // 2),
+            'message': 'Image processed',
+            'faces_detected': 1,
+            'emotions': [{'happy': 0.9, 'sad': 0.1}],
+        }
+        for index in range(count)
+    ]
+
+
+def history_collection(entries):
+    """Mock collection whose find().sort().limit() returns entries."""
+    collection = MagicMock()
+    collection.find.return_value.sort.return_value.limit.side_effect = (
+        lambda limit: entries[:limit]
+    )
+    return collection
+
+
+@pytest.fixture
+def logged_in(client):
+    with client.session_transaction() as session:
+        session['username'] = 'alice'
+    return client
+
+
+def test_cursor_round_trip():
+    """Test a cursor decodes back to the entry's sort key."""
+    entry = make_entries(1)[0]
+    assert decode_cursor(encode_cursor(entry)) == (entry['created_at'], entry['_id'])
+    assert decode_cursor('not a cursor') is None
+
+
+def test_get_history_first_page():
+    """Test a page is read newest first with one extra entry to find the next page."""
+    entries = make_entries(5)
+    collection = history_collection(entries)
+
+    page, next_cursor = get_history(collection, 'alice', limit=3)
+
+    assert page == entries[:3]
+    assert decode_cursor(next_cursor) == (entries[2]['created_at'], entries[2]['_id'])
+    collection.find.assert_called_once_with({'user': 'alice'})
+    collection.find.return_value.sort.assert_called_once_with([('created_at', -1), ('_id', -1)])
+    collection.find.return_value.sort.return_value.limit.assert_called_once_with(4)
+
+
+def test_get_history_keyset_query():
+    """Test the cursor becomes a range on (created_at, _id), not a skip."""
+    entries = make_entries(5)
+    collection = history_collection(entries[3:])
+
+    page, next_cursor = get_history(collection, 'alice', encode_cursor(entries[2]), limit=3)
+
+    assert page == entries[3:]
+    assert next_cursor is None
+    query = collection.find.call_args[0][0]
+    assert query['user'] == 'alice'
+    assert query['$or'] == [
+        {'created_at': {'$lt': entries[2]['created_at']}},
+        {'created_at': entries[2]['created_at'], '_id': {'$lt': entries[2]['_id']}},
+    ]
+
+
+def test_get_history_invalid_cursor():
+    with pytest.raises(ValueError):
+        get_history(MagicMock(), 'alice', 'garbage')
+
+
+def test_get_stats_means_from_sums():
+    """Test averages come from the precomputed totals."""
+    stats = MagicMock()
+    stats.find_one.return_value = {
+        '_id': 'alice', 'analyses': 3, 'faces': 4,
+        'emotion_sums': {'happy': 3.0, 'sad': 1.0}, 'dominant': {'happy': 3, 'sad': 1},
+    }
+    summary = get_stats(stats, 'alice')
+    assert summary['mean_emotions'] == {'happy': 0.75, 'sad': 0.25}
+    assert summary['dominant'] == {'happy': 3, 'sad': 1}
+    stats.find_one.return_value = None
+    assert get_stats(stats, 'bob')['mean_emotions'] == {}
+
+
+def test_history_requires_login(client):
+    response = client.get('/history', headers={'Accept': 'application/json'})
+    assert response.status_code == 401
+    response = client.get('/history')
+    assert response.status_code == 302
+    assert '/login' in response.location
+
+
+def test_history_api(logged_in, monkeypatch):
+    """Test the JSON history page carries entries, next cursor and stats."""
+    entries = make_entries(3)
+    stats = MagicMock()
+    stats.find_one.return_value = {'_id': 'alice', 'analyses': 3, 'faces': 3,
+                                   'emotion_sums': {'happy': 2.7, 'sad': 0.3}}
+    monkeypatch.setattr(web_app, 'history_collection', history_collection(entries))
+    monkeypatch.setattr(web_app, 'stats_collection', stats)
+
+    response = logged_in.get('/history?limit=2', headers={'Accept': 'application/json'})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [entry['id'] for entry in data['entries']] == [str(e['_id']) for e in entries[:2]]
+    assert data['next_cursor'] == encode_cursor(entries[1])
+    assert data['stats']['analyses'] == 3
+    assert data['stats']['mean_emotions']['happy'] == pytest.approx(0.9)
+
+
+def test_history_page(logged_in, monkeypatch):
+    """Test the HTML page lists entries and links to the next page."""
+    entries = make_entries(3)
+    monkeypatch.setattr(web_app, 'history_collection', history_collection(entries))
+    monkeypatch.setattr(web_app, 'stats_collection', MagicMock(find_one=MagicMock(return_value=None)))
+
+    response = logged_in.get('/history?limit=2')
+
+    assert response.status_code == 200
+    assert b"alice's Analyses" in response.data
+    assert b'Older Analyses' in response.data
+
+
+def test_history_invalid_cursor(logged_in):
+    response = logged_in.get('/history?cursor=garbage')
+    assert response.status_code == 400
+
+
+def test_upload_sends_user_to_ml(logged_in, monkeypatch, tmp_path):
+    """Test a signed-in upload names the user so it joins their history."""
+    monkeypatch.setitem(logged_in.application.config, 'UPLOAD_FOLDER', str(tmp_path))
+    post = MagicMock(return_value=MagicMock(
+        status_code=200, json=lambda: {'message': 'No faces detected'}))
+    monkeypatch.setattr('requests.Session.post', post)
+
+    logged_in.post('/upload', content_type='multipart/form-data',
+                   data={'file': (io.BytesIO(b'fake image data'), 'test.jpg')})
+
+    assert post.call_args[1]['headers']['X-User'] == 'alice'
+
+
+def test_sign_up_duplicate_username(client, monkeypatch):
+    """Test the unique index catches a username taken after the check."""
+    users = MagicMock()
+    users.find_one.return_value = None
+    users.insert_one.side_effect = DuplicateKeyError('duplicate key')
+    monkeypatch.setattr(web_app, 'users_collection', users)
+
+    response = client.post('/sign_up', data={
+        'username': 'alice', 'password': 'pw', 'confirm_password': 'pw'})
+
+    assert response.status_code == 302
+    assert '/sign_up' in response.location
+
+
+def test_ensure_indexes_unique_username(monkeypatch):
+    users = MagicMock()
+    monkeypatch.setattr(web_app, 'users_collection', users)
+    results = MagicMock()
+    monkeypatch.setattr(web_app, 'results_collection', results)
+    monkeypatch.setattr(web_app.session_store, 'collection', MagicMock())
+    web_app.ensure_indexes()
+    users.create_index.assert_called_once_with('username', unique=True)
+    results.create_index.assert_called_once_with('image_ref')
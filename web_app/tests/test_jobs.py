@@ -0,0 +1,120 @@
+import io
+import os
+from bson import ObjectId
+from unittest.mock import MagicMock
+
+import hashlib
+from pymongo.errors import DocumentTooLarge
+
+import app as web_app
+from jobs import get_job, JOB_DONE, JOB_QUEUED
+
+
+def test_async_upload_returns_job_id(client, monkeypatch):
+    """Test async uploads are queued instead of calling the ML service."""
+    os.makedirs('tests/uploads', exist_ok=True)
+    jobs = MagicMock()
+    jobs.insert_one.return_value.inserted_id = ObjectId('0123456789ab0123456789ab')
+    monkeypatch.setattr(web_app, 'ASYNC_UPLOADS', True)
+    images = MagicMock()
+    images.put.side_effect = lambda image_bytes, digest: digest
+    monkeypatch.setattr(web_app, 'jobs_collection', jobs)
+    monkeypatch.setattr(web_app, 'job_images', images)
+    monkeypatch.setattr('requests.Session.post', MagicMock(side_effect=AssertionError))
+
+    response = client.post(
+        '/upload',
+        content_type='multipart/form-data',
+        data={'file': (io.BytesIO(b"fake image data"), 'test.jpg')},
+        headers={'Accept': 'application/json'},
+    )
+
+    assert response.status_code == 202
+    assert response.get_json()['job_id'] == '0123456789ab0123456789ab'
+    job = jobs.insert_one.call_args[0][0]
+    assert job['status'] == JOB_QUEUED
+    digest = hashlib.sha256(b"fake image data").hexdigest()
+    # the job names the stored image; the bytes are not in the document
+    assert 'image' not in job
+    assert job['image_ref'] == digest
+    assert images.put.call_args[0] == (b"fake image data", digest)
+    assert job['content_type'] == 'image/jpeg'
+
+
+def test_async_upload_browser_waits_on_analysis(client, monkeypatch):
+    """Test browsers are redirected to a page that waits for the job."""
+    os.makedirs('tests/uploads', exist_ok=True)
+    jobs = MagicMock()
+    jobs.insert_one.return_value.inserted_id = ObjectId()
+    jobs.find_one.return_value = {'_id': ObjectId(), 'status': 'running'}
+    monkeypatch.setattr(web_app, 'ASYNC_UPLOADS', True)
+    monkeypatch.setattr(web_app, 'jobs_collection', jobs)
+    monkeypatch.setattr(web_app, 'job_images', MagicMock())
+
+    response = client.post(
+        '/upload',
+        content_type='multipart/form-data',
+        data={'file': (io.BytesIO(b"fake image data"), 'test.jpg')},
+    )
+    assert response.status_code == 302
+    assert '/analysis' in response.location
+
+    response = client.get('/analysis')
+    assert response.status_code == 200
+    assert b"being analyzed" in response.data
+
+
+def test_async_upload_database_error(client, monkeypatch):
+    """Test a MongoDB error while queueing is a clean 503, not a crash."""
+    jobs = MagicMock()
+    jobs.insert_one.side_effect = DocumentTooLarge('too large')
+    monkeypatch.setattr(web_app, 'ASYNC_UPLOADS', True)
+    monkeypatch.setattr(web_app, 'jobs_collection', jobs)
+    monkeypatch.setattr(web_app, 'job_images', MagicMock())
+
+    response = client.post(
+        '/upload',
+        content_type='multipart/form-data',
+        data={'file': (io.BytesIO(b"fake image data"), 'test.jpg')},
+        headers={'Accept': 'application/json'},
+    )
+    assert response.status_code == 503
+
+    response = client.post(
+        '/upload',
+        content_type='multipart/form-data',
+        data={'file': (io.BytesIO(b"fake image data"), 'test.jpg')},
+    )
+    assert response.status_code == 302
+    assert response.location.endswith('/upload')
+
+
+def test_job_status_done(client, monkeypatch):
+    """Test the poll endpoint returns results of finished jobs."""
+    job_id = ObjectId()
+    jobs = MagicMock()
+    jobs.find_one.return_value = {
+        '_id': job_id,
+        'status': JOB_DONE,
+        'result': {'message': 'Image processed', 'results': {'faces_detected': 1}},
+    }
+    monkeypatch.setattr(web_app, 'jobs_collection', jobs)
+
+    response = client.get(f'/jobs/{job_id}')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == JOB_DONE
+    assert body['result']['results']['faces_detected'] == 1
+
+
+def test_job_status_unknown(client):
+    """Test malformed job ids are a 404 without a database lookup."""
+    response = client.get('/jobs/not-an-id')
+    assert response.status_code == 404
+
+
+def test_get_job_excludes_image():
+    """Test job lookups never load the image bytes."""
+    jobs = MagicMock()
+    get_job(jobs, '0123456789ab0123456789ab')
+    assert jobs.find_one.call_args[0][1] == {'image': 0}
@@ -0,0 +1,51 @@
+import io
+
+from metrics import Histogram, nearest_rank_quantiles
+
+
+class MockResponse:
+    def __init__(self, json_data, status_code):
+        self.json_data = json_data
+        self.status_code = status_code
+
+    def json(self):
+        return self.json_data
+
+
+def test_histogram_render():
+    """Test buckets, sum, count and quantiles in the Prometheus text format."""
+    histogram = Histogram('test_seconds', 'Test.', (0.1, 1.0), ('stage',))
+    histogram.observe(0.05, 'save')
+    histogram.observe(0.5, 'save')
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="save",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="save",le="+Inf"} 2' in lines
+    assert 'test_seconds_count{stage="save"} 2' in lines
+    assert 'test_seconds_quantile{stage="save",quantile="0.5"} 0.5' in lines
+
+
+def test_nearest_rank_quantiles():
+    """Test p50/p95/p99 of the recent observations."""
+    assert nearest_rank_quantiles(list(range(1, 101))) == {0.5: 51, 0.95: 96, 0.99: 100}
+
+
+def test_upload_stages_on_metrics(client, monkeypatch, tmp_path):
+    """Test an upload records its stages, size and faces on /metrics."""
+    monkeypatch.setitem(client.application.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(
+        'requests.Session.post',
+        lambda self, url, **kwargs: MockResponse(
+            {"message": "Image processed", "results": {"faces_detected": 2}}, 200),
+    )
+    client.post('/upload', content_type='multipart/form-data',
+                data={'file': (io.BytesIO(b"fake image data"), 'test.jpg')})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    for stage in ('read_upload', 'save', 'ml_request'):
+        assert f'web_stage_seconds_count{{stage="{stage}"}}' in body
+    assert 'web_request_seconds_count{endpoint="upload"}' in body
+    assert 'web_image_bytes_bucket{le="1024.0"}' in body
+    assert 'web_faces_per_image_sum' in body
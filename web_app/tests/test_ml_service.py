@@ -0,0 +1,206 @@
+import io
+import os
+import pytest
+import requests
+from unittest.mock import MagicMock, patch
+
+import app as web_app
+from ml_service import CircuitBreaker, CircuitOpenError, MLServiceClient, MLServiceConfig
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def ml_service():
+    service = MLServiceClient('http://ml/process', timeout=5, retries=2,
+                              backoff=0.01, failure_threshold=3, reset_timeout=30)
+    service.session.post = MagicMock()
+    return service
+
+
+def test_pool_size_is_configured():
+    """Test the session keeps a connection pool of the requested size."""
+    service = MLServiceClient('http://ml/process', pool_size=7)
+    adapter = service.session.get_adapter('http://ml/process')
+    assert adapter._pool_maxsize == 7
+
+
+def test_config_object_with_overrides():
+    """Test settings come from one MLServiceConfig, keywords taking precedence."""
+    config = MLServiceConfig(timeout=3, retries=4, failure_threshold=7,
+                             batch_url='http://ml/batch')
+    service = MLServiceClient('http://ml/process', config, retries=1)
+    assert (service.timeout, service.retries, service.backoff) == (3, 1, 0.2)
+    (backend,) = service.backends
+    assert backend.breaker.failure_threshold == 7
+    assert backend.batch_url == 'http://ml/batch'
+
+
+def test_success_passes_image_and_deadline(ml_service):
+    """Test a healthy call is made once with a timeout inside the deadline."""
+    ml_service.session.post.return_value = FakeResponse(200)
+    response = ml_service.process(b'img', 'image/png')
+    assert response.status_code == 200
+    _, kwargs = ml_service.session.post.call_args
+    assert kwargs['data'] == b'img'
+    assert kwargs['headers']['Content-Type'] == 'image/png'
+    assert 0 < kwargs['timeout'] <= 5
+    assert 0 < int(kwargs['headers']['X-Deadline-Ms']) <= 5000
+
+
+def test_process_batch_posts_multipart(ml_service):
+    """Test a batch goes to /process_batch as one multipart request."""
+    ml_service.session.post.return_value = FakeResponse(200)
+    images = [('a.jpg', b'a', 'image/jpeg'), ('b.png', b'b', 'image/png')]
+    ml_service.process_batch(images)
+    args, kwargs = ml_service.session.post.call_args
+    assert args[0] == 'http://ml/process_batch'
+    assert kwargs['files'] == [('images', images[0]), ('images', images[1])]
+
+
+def test_retries_5xx_then_succeeds(ml_service):
+    """Test 5xx responses are retried."""
+    ml_service.session.post.side_effect = [FakeResponse(503), FakeResponse(200)]
+    with patch('ml_service.time.sleep'):
+        assert ml_service.process(b'img', 'image/png').status_code == 200
+    assert ml_service.session.post.call_count == 2
+
+
+def test_deadline_header_shrinks_between_attempts(ml_service):
+    """Test every attempt carries the time left, not the original timeout."""
+    clock = [100.0]
+
+    def slow_failure(*args, **kwargs):
+        clock[0] += 2.0
+        return FakeResponse(500)
+
+    responses = iter([slow_failure, lambda *args, **kwargs: FakeResponse(200)])
+    ml_service.session.post.side_effect = lambda *args, **kwargs: next(responses)(*args, **kwargs)
+    with patch('ml_service.time.monotonic', side_effect=lambda: clock[0]), \
+            patch('ml_service.random.uniform', return_value=0.0), patch('ml_service.time.sleep'):
+        ml_service.process(b'img', 'image/png')
+    budgets = [call[1]['headers']['X-Deadline-Ms'] for call in ml_service.session.post.call_args_list]
+    assert budgets == ['5000', '3000']
+
+
+def test_overloaded_waits_retry_after(ml_service):
+    """Test a shed request is retried after Retry-After and does not trip the breaker."""
+    busy = FakeResponse(503, {'Retry-After': '1'})
+    ml_service.session.post.side_effect = [busy, busy, busy]
+    with patch('ml_service.time.sleep') as sleep:
+        assert ml_service.process(b'img', 'image/png').status_code == 503
+    assert [call[0][0] for call in sleep.call_args_list] == [1.0, 1.0]
+    assert ml_service.breaker.failures == 0
+    assert ml_service.breaker.state == 'closed'
+
+
+def test_overloaded_not_retried_past_deadline(ml_service):
+    """Test Retry-After longer than the time left returns the 503 at once."""
+    ml_service.session.post.return_value = FakeResponse(503, {'Retry-After': '30'})
+    with patch('ml_service.time.sleep') as sleep:
+        assert ml_service.process(b'img', 'image/png').status_code == 503
+    sleep.assert_not_called()
+    assert ml_service.session.post.call_count == 1
+
+
+def test_deadline_expired_is_not_a_failure(ml_service):
+    """Test a 504 for an expired deadline is returned at once and does not trip the breaker."""
+    ml_service.session.post.return_value = FakeResponse(504)
+    for _ in range(5):
+        assert ml_service.process(b'img', 'image/png').status_code == 504
+    assert ml_service.session.post.call_count == 5
+    assert ml_service.breaker.failures == 0
+    assert ml_service.breaker.state == 'closed'
+
+
+def test_retries_connection_errors_then_raises(ml_service):
+    """Test connection errors are retried, then raised."""
+    ml_service.session.post.side_effect = requests.exceptions.ConnectionError('down')
+    with patch('ml_service.time.sleep'), pytest.raises(requests.exceptions.ConnectionError):
+        ml_service.process(b'img', 'image/png')
+    assert ml_service.session.post.call_count == 3
+
+
+def test_4xx_is_not_retried(ml_service):
+    """Test client errors are returned straight away."""
+    ml_service.session.post.return_value = FakeResponse(400)
+    assert ml_service.process(b'img', 'image/png').status_code == 400
+    assert ml_service.session.post.call_count == 1
+
+
+def test_circuit_opens_and_fails_fast(ml_service):
+    """Test a failing ML service stops being called."""
+    ml_service.session.post.side_effect = requests.exceptions.ConnectionError('down')
+    with patch('ml_service.time.sleep'), pytest.raises(requests.exceptions.ConnectionError):
+        ml_service.process(b'img', 'image/png')
+    ml_service.session.post.reset_mock()
+
+    with pytest.raises(CircuitOpenError):
+        ml_service.process(b'img', 'image/png')
+    ml_service.session.post.assert_not_called()
+
+
+def test_breaker_half_open_trial():
+    """Test one trial call is allowed after the reset timeout."""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    with patch('ml_service.time.monotonic', return_value=100.0):
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        assert not breaker.allow()
+    with patch('ml_service.time.monotonic', return_value=111.0):
+        assert breaker.state == 'half-open'
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record_success()
+        assert breaker.state == 'closed'
+
+
+def test_upload_reports_open_circuit(client, monkeypatch):
+    """Test the upload page fails fast while the circuit is open."""
+    os.makedirs('tests/uploads', exist_ok=True)
+    monkeypatch.setattr(web_app.ml_service.breaker, 'opened_at', float('inf'))
+    monkeypatch.setattr('requests.Session.post', MagicMock(side_effect=AssertionError))
+
+    response = client.post('/upload', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(b"fake image data"), 'test.jpg')})
+    assert response.status_code == 302
+    assert '/upload' in response.location
+
+
+def test_half_open_trial_ends_on_any_request_error(ml_service):
+    """Test a trial call failing with a non-connection error re-opens the circuit."""
+    ml_service.retries = 0
+    ml_service.session.post.side_effect = requests.exceptions.ConnectionError('down')
+    with patch('ml_service.time.monotonic', return_value=100.0):
+        for _ in range(3):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                ml_service.process(b'img', 'image/png')
+        assert ml_service.breaker.state == 'open'
+
+    ml_service.session.post.side_effect = requests.exceptions.ChunkedEncodingError('cut')
+    with patch('ml_service.time.monotonic', return_value=131.0), \
+            pytest.raises(requests.exceptions.ChunkedEncodingError):
+        ml_service.process(b'img', 'image/png')
+    assert not ml_service.breaker._trial_running
+
+    ml_service.session.post.side_effect = None
+    ml_service.session.post.return_value = FakeResponse(200)
+    with patch('ml_service.time.monotonic', return_value=162.0):
+        assert ml_service.process(b'img', 'image/png').status_code == 200
+        assert ml_service.breaker.state == 'closed'
+
+
+def test_expired_deadline_does_not_take_the_trial(ml_service):
+    """Test a call out of time raises before using the half-open trial."""
+    ml_service.breaker.record_failure()
+    ml_service.breaker.record_failure()
+    ml_service.breaker.record_failure()
+    ml_service.breaker.opened_at -= 60
+    with pytest.raises(requests.exceptions.Timeout):
+        ml_service.process(b'img', 'image/png', timeout=-1)
+    ml_service.session.post.assert_not_called()
+    assert ml_service.breaker.allow()
@@ -0,0 +1,58 @@
+import threading
+
+import app as web_app
+
+
+def test_profile_off_by_default(client, monkeypatch):
+    monkeypatch.setattr(web_app, 'ADMIN_TOKEN', '')
+    assert client.post('/admin/profile?seconds=0').status_code == 404
+
+
+def test_profile_requires_token(client, monkeypatch):
+    monkeypatch.setattr(web_app, 'ADMIN_TOKEN', 's3cret')
+    response = client.post('/admin/profile?seconds=0',
+                           headers={'Authorization': 'Bearer nope'})
+    assert response.status_code == 401
+
+
+def test_profile_returns_collapsed_stacks(client, monkeypatch):
+    """Test a busy thread appears in the collapsed stacks of the web process."""
+    monkeypatch.setattr(web_app, 'ADMIN_TOKEN', 's3cret')
+    stop = threading.Event()
+
+    def render_pages():
+        while not stop.is_set():
+            web_app.app.jinja_env.from_string('{{ x }}').render(x=1)
+
+    worker = threading.Thread(target=render_pages, name='renderer')
+    worker.start()
+    try:
+        response = client.post('/admin/profile?seconds=0.2&interval_ms=2',
+                               headers={'Authorization': 'Bearer s3cret'})
+    finally:
+        stop.set()
+        worker.join()
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    lines = response.get_data(as_text=True).splitlines()
+    assert any(line.startswith('renderer;') and 'render_pages' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+def test_profile_counts_requests(monkeypatch):
+    """Test a profile limited to N requests ends after N requests."""
+    monkeypatch.setattr(web_app, 'ADMIN_TOKEN', 's3cret')
+    result = {}
+
+    def run_profile():
+        result['session'] = web_app.profiler.profile(seconds=10, max_requests=2)
+
+    thread = threading.Thread(target=run_profile)
+    thread.start()
+    while web_app.profiler.session is None:
+        pass
+    for _ in range(2):
+        web_app.count_profiled_request()
+    thread.join(timeout=5)
+    assert result['session'].requests == 2
@@ -1,5 +1,8 @@
 import os
 import io
+import hashlib
+import json
+import zipfile
 import pytest
 from unittest.mock import patch
 
@@ -87,10 +90,13 @@ def test_upload_page(client):
 def test_file_upload_success(client, monkeypatch):
     """Test successful file upload."""
     os.makedirs('tests/uploads', exist_ok=True)
-    def mock_post(url, json, **kwargs):
+    sent = {}
+
+    def mock_post(self, url, **kwargs):
+        sent.update(kwargs)
         return MockResponse({"message": "Image processed", "results": {}}, 200)
 
-    monkeypatch.setattr('requests.post', mock_post)
+    monkeypatch.setattr('requests.Session.post', mock_post)
 
     data = {
         'file': (io.BytesIO(b"fake image data"), 'test.jpg')
@@ -98,6 +104,72 @@ def test_file_upload_success(client, monkeypatch):
     response = client.post('/upload', content_type='multipart/form-data', data=data)
     assert response.status_code == 302
     assert '/analysis' in response.location
+    assert sent['data'] == b"fake image data"
+    assert sent['headers']['Content-Type'] == 'image/jpeg'
+
+
+def test_multi_file_upload_streams_batches(client, monkeypatch, tmp_path):
+    """Test several files go to /process_batch and stream back as NDJSON."""
+    monkeypatch.setitem(client.application.config, 'UPLOAD_FOLDER', str(tmp_path))
+    calls = []
+
+    def mock_post(self, url, **kwargs):
+        calls.append((url, [image[0] for _, image in kwargs['files']]))
+        results = [{"filename": name, "message": "Image processed",
+                    "results": {"faces_detected": 1, "emotions": [{"happy": 0.9}]}}
+                   for _, (name, _, _) in kwargs['files']]
+        return MockResponse({"results": results}, 200)
+
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('app.ML_BATCH_SIZE', 2)
+
+    data = {'file': [(io.BytesIO(b"a"), 'a.jpg'), (io.BytesIO(b"b"), 'b.png'),
+                     (io.BytesIO(b"c"), 'c.jpg')]}
+    response = client.post('/upload', content_type='multipart/form-data', data=data,
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['filename'] for line in lines] == ['a.jpg', 'b.png', 'c.jpg']
+    assert [names for _, names in calls] == [['a.jpg', 'b.png'], ['c.jpg']]
+    assert calls[0][0].endswith('/process_batch')
+    assert sorted(os.listdir(tmp_path)) == sorted(line['image'] for line in lines)
+    assert lines[1]['image'] == hashlib.sha256(b"b").hexdigest() + '.png'
+
+
+def test_zip_upload_renders_results(client, monkeypatch, tmp_path):
+    """Test the images inside a zip archive are analyzed as a batch."""
+    monkeypatch.setitem(client.application.config, 'UPLOAD_FOLDER', str(tmp_path))
+
+    def mock_post(self, url, **kwargs):
+        results = [{"filename": name, "message": "No faces detected"}
+                   for _, (name, _, _) in kwargs['files']]
+        return MockResponse({"results": results}, 200)
+
+    monkeypatch.setattr('requests.Session.post', mock_post)
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('album/one.jpg', b"one")
+        zip_file.writestr('album/notes.txt', b"skip me")
+        zip_file.writestr('album/two.png', b"two")
+    archive.seek(0)
+
+    response = client.post('/upload', content_type='multipart/form-data',
+                           data={'file': (archive, 'album.zip')})
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'one.jpg' in page and 'two.png' in page
+    assert 'notes.txt' not in page
+    assert page.count('No faces detected') == 2
+
+
+def test_invalid_zip_upload(client):
+    """Test a file named .zip that is not an archive is rejected."""
+    response = client.post('/upload', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(b"nope"), 'album.zip')})
+    assert response.status_code == 302
+    assert '/upload' in response.location
 
 
 def test_analysis_page(client):
@@ -0,0 +1,170 @@
+import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+from flask.sessions import session_json_serializer
+from pymongo.errors import PyMongoError
+from werkzeug.security import generate_password_hash
+
+import app as web_app
+from app import app
+from lru_cache import LRUCache
+from session_store import ServerSideSessionInterface, SessionStore, utcnow
+
+EMOTIONS = {'angry': 0.01, 'disgust': 0.0, 'fear': 0.02, 'happy': 0.9,
+            'sad': 0.03, 'surprise': 0.02, 'neutral': 0.02}
+
+
+@pytest.fixture
+def store(client):
+    store = SessionStore(None)
+    app.session_interface = ServerSideSessionInterface(store)
+    yield store
+    app.session_interface = ServerSideSessionInterface(SessionStore(None))
+
+
+def session_cookie(client):
+    return next(cookie.value for cookie in client.cookie_jar if cookie.name == 'session')
+
+
+def test_cookie_carries_only_the_id(client, store):
+    """Test a session holding a large analysis still sends a short cookie."""
+    analysis = {'message': 'Image processed', 'results': {
+        'faces_detected': 200, 'emotions': [dict(EMOTIONS) for _ in range(200)]}}
+    with client.session_transaction() as session:
+        session['username'] = 'alice'
+        session['analysis'] = analysis
+        session['filename'] = 'crowd.jpg'
+
+    sid = session_cookie(client)
+    assert len(sid) < 64
+    assert store.get(sid)['analysis'] == analysis
+
+    response = client.get('/analysis')
+    assert response.status_code == 200
+    assert b'crowd.jpg' in response.data
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_cleared_session_is_deleted(client, store):
+    with client.session_transaction() as session:
+        session['username'] = 'alice'
+    sid = session_cookie(client)
+
+    with client.session_transaction() as session:
+        session.clear()
+
+    assert store.get(sid) is None
+
+
+def test_unknown_sid_starts_new_session(client, store):
+    client.set_cookie('localhost', 'session', 'forged')
+    with client.session_transaction() as session:
+        assert 'username' not in session
+        session['username'] = 'alice'
+    assert session_cookie(client) != 'forged'
+
+
+def test_login_moves_session_to_new_id(client, store, monkeypatch):
+    """Test an id planted before login is not the one that gets signed in."""
+    users = MagicMock()
+    users.find_one.return_value = {'username': 'alice',
+                                   'password': generate_password_hash('pw')}
+    monkeypatch.setattr(web_app, 'users_collection', users)
+    with client.session_transaction() as session:
+        session['filename'] = 'photo.jpg'
+    planted = session_cookie(client)
+
+    client.post('/login', data={'username': 'alice', 'password': 'pw'})
+
+    sid = session_cookie(client)
+    assert sid != planted
+    assert store.get(planted) is None
+    assert store.get(sid)['username'] == 'alice'
+    assert store.get(sid)['filename'] == 'photo.jpg'
+
+
+def test_store_reads_through_to_mongo():
+    """Test a session saved by another process is found in MongoDB and cached."""
+    collection = MagicMock()
+    payload = session_json_serializer.dumps({'username': 'alice'})
+    collection.find_one.return_value = {
+        '_id': 'sid', 'data': payload,
+        'expires_at': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}
+    store = SessionStore(collection)
+
+    assert store.get('sid') == {'username': 'alice'}
+    assert store.get('sid') == {'username': 'alice'}
+    collection.find_one.assert_called_once()
+    assert collection.find_one.call_args[0][0]['_id'] == 'sid'
+
+
+def test_memory_copy_is_revalidated():
+    """Test another process's logout is seen once memory_ttl passes."""
+    collection = MagicMock()
+    payload = session_json_serializer.dumps({'username': 'alice'})
+    collection.find_one.return_value = {
+        '_id': 'sid', 'data': payload,
+        'expires_at': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}
+    store = SessionStore(collection, memory_ttl=5)
+    with patch('lru_cache.time.monotonic', return_value=100.0):
+        assert store.get('sid') == {'username': 'alice'}
+    collection.find_one.return_value = None
+    with patch('lru_cache.time.monotonic', return_value=104.0):
+        assert store.get('sid') == {'username': 'alice'}
+    with patch('lru_cache.time.monotonic', return_value=106.0):
+        assert store.get('sid') is None
+
+
+def test_store_put_upserts_with_expiry():
+    collection = MagicMock()
+    store = SessionStore(collection, ttl=60)
+
+    store.put('sid', {'username': 'alice'})
+
+    selector, document = collection.replace_one.call_args[0]
+    assert selector == {'_id': 'sid'}
+    assert collection.replace_one.call_args[1] == {'upsert': True}
+    assert session_json_serializer.loads(document['data']) == {'username': 'alice'}
+    assert document['expires_at'] - utcnow() <= datetime.timedelta(seconds=60)
+    assert store.get('sid') == {'username': 'alice'}
+    collection.find_one.assert_not_called()
+
+
+def test_touch_extends_only_after_half_the_ttl():
+    """Test reads refresh the expiry rarely, not on every request."""
+    collection = MagicMock()
+    store = SessionStore(collection, ttl=60)
+    store.put('sid', {'username': 'alice'})
+    store.touch('sid')
+    assert collection.replace_one.call_count == 1
+
+    payload, _ = store.memory.get('sid')
+    store.memory.put('sid', (payload, utcnow() + datetime.timedelta(seconds=10)))
+    store.touch('sid')
+    assert collection.replace_one.call_count == 2
+
+
+def test_store_tolerates_mongo_errors():
+    collection = MagicMock()
+    collection.find_one.side_effect = PyMongoError('down')
+    collection.replace_one.side_effect = PyMongoError('down')
+    collection.delete_one.side_effect = PyMongoError('down')
+    logger = MagicMock()
+    store = SessionStore(collection, logger=logger)
+
+    assert store.get('missing') is None
+    store.put('sid', {'username': 'alice'})
+    assert store.get('sid') == {'username': 'alice'}
+    store.delete('sid')
+    assert store.get('sid') is None
+    assert logger.warning.call_count == 4
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import os
+from unittest.mock import MagicMock
+
+import pytest
+from PIL import Image
+
+import app as web_app
+from uploads import (
+    annotated_thumbnail_path, store_upload, thumbnail_path, too_many_pixels, upload_key,
+    upload_path
+)
+
+
+def jpeg_bytes(size=(640, 480), color=(0, 128, 255)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def upload_folder(client, monkeypatch, tmp_path):
+    monkeypatch.setitem(client.application.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path
+
+
+def test_store_upload_dedups_by_content(tmp_path):
+    """Test identical bytes are stored once and same-named images never collide."""
+    first = store_upload(str(tmp_path), b'one', 'photo.jpg')
+    again = store_upload(str(tmp_path), b'one', 'other.JPEG')
+    second = store_upload(str(tmp_path), b'two', 'photo.jpg')
+
+    assert first == again == hashlib.sha256(b'one').hexdigest() + '.jpg'
+    assert second != first
+    assert sorted(os.listdir(tmp_path)) == sorted([first, second])
+    assert upload_path(str(tmp_path), upload_key(b'two', 'x.png')) is None
+
+
+def test_upload_path_rejects_other_names(tmp_path):
+    (tmp_path / 'secret.jpg').write_bytes(b'x')
+    assert upload_path(str(tmp_path), 'secret.jpg') is None
+    assert upload_path(str(tmp_path), '../' + 'a' * 64 + '.jpg') is None
+
+
+def test_thumbnail_made_once(tmp_path):
+    """Test a thumbnail is resized on first use and then read from disk."""
+    key = store_upload(str(tmp_path), jpeg_bytes(), 'photo.jpg')
+
+    path = thumbnail_path(str(tmp_path), key, 150)
+    modified = os.stat(path).st_mtime_ns
+    with Image.open(path) as thumb:
+        assert thumb.width == 150 and thumb.height < 150
+    assert thumbnail_path(str(tmp_path), key, 150) == path
+    assert os.stat(path).st_mtime_ns == modified
+    assert thumbnail_path(str(tmp_path), key, 123) is None
+
+
+def test_annotated_thumbnail_made_once(tmp_path):
+    """Test the boxed thumbnail is drawn once and its boxes loaded only then."""
+    key = store_upload(str(tmp_path), jpeg_bytes(color=(0, 0, 0)), 'photo.jpg')
+    load_faces = MagicMock(return_value=[[64, 48, 320, 240]])
+
+    boxed = annotated_thumbnail_path(str(tmp_path), key, 300, load_faces)
+
+    assert annotated_thumbnail_path(str(tmp_path), key, 300, load_faces) == boxed
+    load_faces.assert_called_once_with()
+    assert boxed != thumbnail_path(str(tmp_path), key, 300)
+    with Image.open(boxed) as thumb:
+        # the box's top-left corner, scaled from 640 to 300 wide
+        red, green, _ = thumb.getpixel((31, 23))
+        assert red > 150 and green < 120
+        assert thumb.getpixel((100, 100))[0] < 40
+    assert annotated_thumbnail_path(str(tmp_path), key, 123, load_faces) is None
+
+
+def test_annotated_thumbnail_needs_boxes(tmp_path):
+    """Test nothing is cached while the analysis has no boxes."""
+    key = store_upload(str(tmp_path), jpeg_bytes(), 'photo.jpg')
+    assert annotated_thumbnail_path(str(tmp_path), key, 150, lambda: None) is None
+    assert len(os.listdir(tmp_path / 'thumbs')) == 1
+
+
+def test_serve_upload_with_cache_headers(client, upload_folder):
+    """Test uploads get a strong ETag, a long max-age and 304 on revalidation."""
+    key = store_upload(str(upload_folder), jpeg_bytes(), 'photo.jpg')
+
+    response = client.get(f'/uploads/{key}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.headers['ETag'] == f'"{key}"'
+    assert response.cache_control.max_age == 365 * 24 * 3600
+    assert response.cache_control.immutable
+    assert response.cache_control.public
+
+    response = client.get(f'/uploads/{key}', headers={'If-None-Match': f'"{key}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_serve_thumbnail(client, upload_folder):
+    key = store_upload(str(upload_folder), jpeg_bytes(), 'photo.jpg')
+
+    response = client.get(f'/uploads/{key}/thumb/150')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    etag = response.headers['ETag']
+    assert etag == f'"{key[:64]}-150.jpg"'
+    response = client.get(f'/uploads/{key}/thumb/150', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    assert client.get(f'/uploads/{key}/thumb/999').status_code == 404
+    assert client.get('/uploads/missing.jpg').status_code == 404
+
+
+def test_serve_faces_thumbnail_from_stored_analysis(client, upload_folder, monkeypatch):
+    """Test the boxes come from the stored analysis and the result is cached."""
+    key = store_upload(str(upload_folder), jpeg_bytes(), 'photo.jpg')
+    results = MagicMock()
+    results.find_one.return_value = {'faces': [[10, 10, 50, 50]]}
+    monkeypatch.setattr(web_app, 'results_collection', results)
+
+    response = client.get(f'/uploads/{key}/faces/150')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{key[:64]}-150-faces.jpg"'
+    assert response.cache_control.immutable
+    assert client.get(f'/uploads/{key}/faces/150').status_code == 200
+
+    results.find_one.assert_called_once()
+    assert results.find_one.call_args[0][0]['image_ref'] == key[:64]
+    assert len(os.listdir(upload_folder / 'thumbs')) == 2
+    assert client.get(f'/uploads/{key}/faces/999').status_code == 404
+
+
+def test_faces_thumbnail_before_analysis_is_saved(client, upload_folder, monkeypatch):
+    """Test the plain thumbnail is sent, uncached, until boxes are stored."""
+    key = store_upload(str(upload_folder), jpeg_bytes(), 'photo.jpg')
+    monkeypatch.setattr(web_app, 'results_collection',
+                        MagicMock(find_one=MagicMock(return_value=None)))
+
+    response = client.get(f'/uploads/{key}/faces/150')
+
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+    assert response.cache_control.max_age == 0
+    assert len(os.listdir(upload_folder / 'thumbs')) == 1
+
+
+def test_thumbnail_of_non_image(client, upload_folder):
+    key = store_upload(str(upload_folder), b'fake image data', 'photo.jpg')
+    assert client.get(f'/uploads/{key}/thumb/150').status_code == 415
+
+
+def test_analysis_page_shows_annotated_thumbnail(client, upload_folder):
+    key = store_upload(str(upload_folder), jpeg_bytes(), 'photo.jpg')
+    with client.session_transaction() as session:
+        session['filename'] = key
+        session['analysis'] = {'message': 'Image processed', 'results': {
+            'faces_detected': 1, 'emotions': [{'happy': 0.9}], 'faces': [[10, 20, 30, 40]]}}
+
+    page = client.get('/analysis').get_data(as_text=True)
+
+    assert f'/uploads/{key}/faces/300' in page
+    assert f'href="/uploads/{key}"' in page
+
+
+def test_too_many_pixels_reads_header_only():
+    data = jpeg_bytes((640, 480))
+    assert too_many_pixels(data, 640 * 480 - 1)
+    assert not too_many_pixels(data, 640 * 480)
+    assert not too_many_pixels(data, 0)
+    assert not too_many_pixels(b'not an image', 1)
+
+
+def test_upload_refuses_too_many_pixels(client, upload_folder, monkeypatch):
+    """Test an image over MAX_IMAGE_PIXELS is neither stored nor sent to the ML service."""
+    monkeypatch.setattr('app.MAX_IMAGE_PIXELS', 1000)
+    post = MagicMock()
+    monkeypatch.setattr('requests.Session.post', post)
+
+    response = client.post('/upload', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(jpeg_bytes()), 'big.jpg')})
+
+    assert response.status_code == 302
+    assert '/upload' in response.location
+    post.assert_not_called()
+    assert os.listdir(upload_folder) == []
+
+
+def test_upload_over_max_bytes(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'MAX_CONTENT_LENGTH', 1024)
+    response = client.post('/upload', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(b'x' * 4096), 'big.jpg')},
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 413
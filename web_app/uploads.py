@@ -0,0 +1,218 @@
+"""
+Content-addressed storage for uploaded images, with cached thumbnails.
+
+An upload is stored once under the SHA-256 of its bytes
+(<digest>.<ext>), so the same image uploaded twice, by anyone, under any
+name, is written once, and two different images named "photo.jpg" never
+overwrite each other. The stored name doubles as a strong ETag: the
+bytes behind it can never change.
+
+Thumbnails are made on first request and kept in the thumbs/ subfolder,
+so each upload is decoded and resized once per size. The variant with the
+detected face boxes drawn on is cached next to it, once per size; its
+boxes come from the stored analysis, never from the request.
+"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from PIL import Image, ImageDraw, ImageOps
+
+THUMBNAIL_DIR = 'thumbs'
+# Only these widths are served, so the cache holds at most four thumbnails
+# per upload: plain and annotated at each size
+THUMBNAIL_SIZES = (150, 300)
+BOX_COLOR = (255, 64, 64)
+EXIF_ORIENTATION = 0x0112
+
+_KEY = re.compile(r'^([0-9a-f]{64})\.(jpg|png)$')
+# one lock per thumbnail being made, so concurrent requests make it once
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def upload_key(image_bytes, filename):
+    """
+    Storage name of an upload: the SHA-256 of its bytes plus its type.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower()
+    extension = 'png' if extension == 'png' else 'jpg'
+    return f'{hashlib.sha256(image_bytes).hexdigest()}.{extension}'
+
+
+def is_upload_key(key):
+    """
+    Whether key looks like a name returned by store_upload.
+    """
+    return bool(_KEY.match(key or ''))
+
+
+def _write_atomic(path, write):
+    """
+    Write a file through a temporary name so readers never see half of it.
+    """
+    folder = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            write(temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def store_upload(folder, image_bytes, filename):
+    """
+    Save an upload under its content hash and return the key. Bytes that
+    are already stored are not written again.
+    """
+    key = upload_key(image_bytes, filename)
+    path = os.path.join(folder, key)
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        _write_atomic(path, lambda image_file: image_file.write(image_bytes))
+    return key
+
+
+def upload_path(folder, key):
+    """
+    Path of a stored upload, or None for an unknown or malformed key.
+    """
+    if not is_upload_key(key):
+        return None
+    path = os.path.join(folder, key)
+    return path if os.path.exists(path) else None
+
+
+def too_many_pixels(image_bytes, max_pixels):
+    """
+    Whether the image's header claims more than max_pixels pixels
+    (0 = no limit). Only the header is read; nothing is decoded.
+    """
+    if not max_pixels:
+        return False
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        return True
+    except OSError:
+        # not an image Pillow knows; the ML service reports it
+        return False
+    return width * height > max_pixels
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def thumbnail_name(key, size, faces=False):
+    """
+    File name of a thumbnail; also its ETag.
+    """
+    digest = _KEY.match(key).group(1)
+    return f'{digest}-{size}-faces.jpg' if faces else f'{digest}-{size}.jpg'
+
+
+def _cached(path, make):
+    """
+    Return path, first writing make() there as a JPEG if it is missing.
+    """
+    if os.path.exists(path):
+        return path
+    with _lock_for(path):
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            image = make()
+            _write_atomic(path, lambda thumb_file: image.save(thumb_file, 'JPEG', quality=85))
+    with _locks_guard:
+        _locks.pop(path, None)
+    return path
+
+
+def thumbnail_path(folder, key, size):
+    """
+    Path of a thumbnail no wider or taller than size, making it on first
+    use. None when the upload or size is unknown. Raises OSError if the
+    upload is not a readable image or is too large to decode.
+    """
+    source = upload_path(folder, key)
+    if source is None or size not in THUMBNAIL_SIZES:
+        return None
+
+    def make():
+        try:
+            return make_thumbnail(source, size)
+        except Image.DecompressionBombError as error:
+            raise OSError(str(error)) from error
+
+    return _cached(os.path.join(folder, THUMBNAIL_DIR, thumbnail_name(key, size)), make)
+
+
+def annotated_thumbnail_path(folder, key, size, load_faces):
+    """
+    Path of the thumbnail with the upload's face boxes drawn on, made on
+    first use from the plain thumbnail and load_faces(), which returns the
+    boxes in the original image's pixels. load_faces is not called once
+    the thumbnail is cached. None when the upload or size is unknown or
+    there are no boxes (yet); OSError as for thumbnail_path.
+    """
+    plain = thumbnail_path(folder, key, size)
+    if plain is None:
+        return None
+    path = os.path.join(folder, THUMBNAIL_DIR, thumbnail_name(key, size, faces=True))
+    if os.path.exists(path):
+        return path
+    faces = load_faces()
+    if not faces:
+        return None
+
+    def make():
+        with Image.open(upload_path(folder, key)) as original:
+            width = oriented_size(original)[0]
+        with Image.open(plain) as thumb:
+            image = thumb.convert('RGB')
+        draw_faces(image, faces, image.width / width)
+        return image
+
+    return _cached(path, make)
+
+
+def oriented_size(image):
+    """
+    (width, height) of an opened image as displayed, after EXIF rotation.
+    """
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+        width, height = height, width
+    return width, height
+
+
+def make_thumbnail(source, size):
+    """
+    Decode an image at reduced size, upright, no larger than size.
+    """
+    with Image.open(source) as image:
+        # JPEGs decode straight at 1/2, 1/4 or 1/8 scale
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((size, size))
+    return image
+
+
+def draw_faces(image, faces, scale):
+    """
+    Draw face boxes on an image, scaling their coordinates by scale.
+    """
+    draw = ImageDraw.Draw(image)
+    line = max(1, max(image.size) // 100)
+    for x, y, box_width, box_height in faces:
+        draw.rectangle(
+            [x * scale, y * scale, (x + box_width) * scale, (y + box_height) * scale],
+            outline=BOX_COLOR, width=line,
+        )